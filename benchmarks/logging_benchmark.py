@@ -0,0 +1,88 @@
+''' Benchmark deferred formatting of log messages below the verbosity threshold '''
+# Usage: python benchmarks/logging_benchmark.py [callCount]
+#
+# Compares formatting each message before calling goodlogging.Log.Info with
+# util.LogInfo (which only formats messages that will be displayed) for a
+# batch of typical low verbosity messages, then times a batch of database
+# lookups answered from the table cache, which log on every call.
+
+# Python default package imports
+import os
+import sys
+import tempfile
+import time
+
+# Third-party package imports
+import goodlogging
+
+# Local file imports
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import clear.database as database
+import clear.util as util
+
+############################################################################
+# EagerLog
+############################################################################
+def EagerLog(callCount, args):
+  """ Format every message before the verbosity check. """
+  for count in range(callCount):
+    goodlogging.Log.Info("DB", "Database Command: {0} {1}".format("SELECT ShowID FROM FileName WHERE FileName=?", args), verbosity=goodlogging.Verbosity.MINIMAL)
+    goodlogging.Log.Info("DB", "Looking up directory for ShowID={0} Season={1} in database".format(count, 1), verbosity=goodlogging.Verbosity.MINIMAL)
+
+############################################################################
+# LazyLog
+############################################################################
+def LazyLog(callCount, args):
+  """ Only format messages which pass the verbosity check. """
+  for count in range(callCount):
+    util.LogInfo("DB", "Database Command: {0} {1}", "SELECT ShowID FROM FileName WHERE FileName=?", args, verbosity=goodlogging.Verbosity.MINIMAL)
+    util.LogInfo("DB", "Looking up directory for ShowID={0} Season={1} in database", count, 1, verbosity=goodlogging.Verbosity.MINIMAL)
+
+############################################################################
+# DatabaseLookups
+############################################################################
+def DatabaseLookups(db, callCount):
+  """ Run cached database lookups (each logs several low verbosity messages). """
+  for count in range(callCount):
+    db.SearchFileNameTable('show.name.{0}'.format(count % 100))
+    db.SearchSeasonDirTable(count % 100, 1)
+    util.StripSpecialCharacters('Show Name: {0} & Friends'.format(count))
+
+############################################################################
+# TimeFunction
+############################################################################
+def TimeFunction(function, *args):
+  """ Return seconds taken to run function. """
+  startTime = time.perf_counter()
+  function(*args)
+  return time.perf_counter() - startTime
+
+############################################################################
+# main
+############################################################################
+def main():
+  callCount = 200000
+  if len(sys.argv) > 1:
+    callCount = int(sys.argv[1])
+
+  goodlogging.Log.verbosityThreshold = goodlogging.Verbosity.NORMAL
+  args = ('show.name.s01e01.720p.hdtv.x264', )
+
+  eagerTime = TimeFunction(EagerLog, callCount, args)
+  lazyTime = TimeFunction(LazyLog, callCount, args)
+  print("{0} x 2 messages below threshold".format(callCount))
+  print("Eager format: {0:.3f}s".format(eagerTime))
+  print("LogInfo:      {0:.3f}s ({1:.1f}x)".format(lazyTime, eagerTime/lazyTime))
+
+  with tempfile.TemporaryDirectory() as tempDir:
+    with database.RenamerDB(os.path.join(tempDir, 'benchmark.db'), cacheTables = True) as db:
+      with db.Transaction():
+        for count in range(100):
+          showID = db.AddShowToTVLibrary('Show {0}'.format(count))
+          db.AddToFileNameTable('show.name.{0}'.format(count), showID)
+          db.AddSeasonDirTable(showID, 1, 'Season 1')
+      lookupTime = TimeFunction(DatabaseLookups, db, callCount)
+  print("{0} cached file name, season directory and strip lookups: {1:.3f}s".format(callCount, lookupTime))
+
+if __name__ == "__main__":
+  main()
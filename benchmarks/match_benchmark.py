@@ -0,0 +1,164 @@
+''' Benchmark show name matching against the epguides allshows list '''
+# Usage: python benchmarks/match_benchmark.py [allshows.csv] [lookupCount]
+#
+# If no allshows csv file is given the list is loaded (or downloaded) by
+# EPGuidesLookup in the current directory. A set of accented and non-Latin
+# titles is added to the list and to the lookups. Each lookup is run with the
+# original full difflib comparison and with the pruned and indexed
+# comparisons from clear.util; the results must be identical.
+
+# Python default package imports
+import difflib
+import os
+import random
+import sys
+import time
+
+# Local file imports
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import clear.epguides as epguides
+import clear.util as util
+
+############################################################################
+# ReferenceStringMatchValue
+############################################################################
+def ReferenceStringMatchValue(string1, string2):
+  """ Original util.GetBestStringMatchValue (copied unchanged). """
+  # Ignore case
+  string1 = string1.lower()
+  string2 = string2.lower()
+
+  # Ignore non-alphanumeric characters
+  string1 = ''.join(i for i in string1 if i.isalnum())
+  string2 = ''.join(i for i in string2 if i.isalnum())
+
+  # Finding best match value between string1 and string2
+  if len(string1) == 0 or len(string2) == 0:
+    bestRatio = 0
+  elif len(string1) == len(string2):
+    match = difflib.SequenceMatcher(None, string1, string2)
+    bestRatio = match.ratio()
+  else:
+    if len(string1) > len(string2):
+      shortString = string2
+      longString = string1
+    else:
+      shortString = string1
+      longString = string2
+
+    match = difflib.SequenceMatcher(None, shortString, longString)
+    bestRatio = match.ratio()
+
+    for block in match.get_matching_blocks():
+      subString = longString[block[1]:block[1]+block[2]]
+      subMatch = difflib.SequenceMatcher(None, shortString, subString)
+      if(subMatch.ratio() > bestRatio):
+        bestRatio = subMatch.ratio()
+
+  return(bestRatio)
+
+############################################################################
+# ReferenceBestMatch
+############################################################################
+def ReferenceBestMatch(target, matchList):
+  """ Original util.GetBestMatch (copied unchanged): score every element of the list. """
+  bestMatchList = []
+
+  if len(matchList) > 0:
+    ratioMatch = []
+    for item in matchList:
+      ratioMatch.append(ReferenceStringMatchValue(target, item))
+
+    maxRatio = max(ratioMatch)
+    if maxRatio > 0.8:
+      matchIndexList = [i for i, j in enumerate(ratioMatch) if j == maxRatio]
+
+      for index in matchIndexList:
+        if maxRatio == 1 and len(matchList[index]) == len(target):
+          return [matchList[index], ]
+        else:
+          bestMatchList.append(matchList[index])
+
+  return bestMatchList
+
+# Titles with accented and non-Latin characters (added to the title list so
+# lookups are checked for names which are not plain ASCII)
+NON_ASCII_TITLE_LIST = ['Les Revenants', 'Les Revenants (2012)', 'Skam', 'Skam España', 'Borgen',
+                        'Forbrydelsen', 'Bron/Broen', 'Dark', 'Élite', 'Élite Short Stories',
+                        'La Casa de Papel', 'Casa de Papel: Corea', 'Ørnen', 'Süper Baba',
+                        'Kärlek & Anarki', 'Ñoños', 'Москва. Три вокзала', 'Кухня',
+                        '孤独のグルメ', '深夜食堂', '오징어 게임', 'Δεσμά Αίματος', 'Naruto Shippūden',
+                        'Pokémon', 'Pokémon Origins', 'Café Society', 'Señora Acero']
+
+############################################################################
+# LoadTitleList
+############################################################################
+def LoadTitleList(allShowsPath):
+  """ Return the allshows title list, from file if a path is given. """
+  guide = epguides.EPGuidesLookup()
+  if allShowsPath is not None:
+    with open(allShowsPath, 'r') as allShowsFile:
+      guide._allShowList = allShowsFile.read().strip()
+  guide._GetTitleList()
+  return guide._showTitleList + [title for title in NON_ASCII_TITLE_LIST if title not in guide._showTitleList]
+
+############################################################################
+# MakeLookupList
+############################################################################
+def MakeLookupList(titleList, lookupCount):
+  """ Make file name style lookups from random titles and every non-ASCII title (some misspelt). """
+  rand = random.Random(0)
+  lookupList = []
+  for title in rand.sample(titleList, lookupCount) + NON_ASCII_TITLE_LIST:
+    lookup = title.replace(' ', '.')
+    if rand.random() < 0.5 and len(lookup) > 3:
+      dropIndex = rand.randrange(len(lookup))
+      lookup = lookup[:dropIndex] + lookup[dropIndex+1:]
+    lookupList.append(lookup)
+  return lookupList
+
+############################################################################
+# TimeLookups
+############################################################################
+def TimeLookups(lookupFunc, lookupList):
+  """ Return (seconds, result list) for running lookupFunc on each lookup. """
+  startTime = time.time()
+  resultList = [lookupFunc(lookup) for lookup in lookupList]
+  return (time.time() - startTime, resultList)
+
+############################################################################
+# main
+############################################################################
+def main():
+  allShowsPath = None
+  lookupCount = 10
+  if len(sys.argv) > 1:
+    allShowsPath = sys.argv[1]
+  if len(sys.argv) > 2:
+    lookupCount = int(sys.argv[2])
+
+  titleList = LoadTitleList(allShowsPath)
+  lookupList = MakeLookupList(titleList, lookupCount)
+  print("{0} titles, {1} lookups".format(len(titleList), len(lookupList)))
+
+  startTime = time.time()
+  matchIndex = util.BuildMatchIndex(titleList)
+  print("Index build: {0:.3f}s".format(time.time() - startTime))
+
+  refTime, refResult = TimeLookups(lambda lookup: ReferenceBestMatch(lookup, titleList), lookupList)
+  print("Reference:   {0:.3f}s".format(refTime))
+
+  prunedTime, prunedResult = TimeLookups(lambda lookup: util.GetBestMatch(lookup, titleList), lookupList)
+  print("Pruned:      {0:.3f}s ({1:.1f}x)".format(prunedTime, refTime/prunedTime))
+
+  indexTime, indexResult = TimeLookups(lambda lookup: util.GetBestMatch(lookup, titleList, matchIndex), lookupList)
+  print("Indexed:     {0:.3f}s ({1:.1f}x)".format(indexTime, refTime/indexTime))
+
+  if prunedResult == refResult and indexResult == refResult:
+    print("Results identical")
+  else:
+    print("Results differ")
+    sys.exit(1)
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,154 @@
+''' Benchmark source directory scanning on a synthetic directory tree '''
+# Usage: python benchmarks/scan_benchmark.py [fileCount] [treeDir]
+#
+# Builds a tree of fileCount files (default 100000) spread over nested
+# directories, including an ignored directory, then times the original
+# recursive glob scan against ClearManager._WalkSourceDir. Only file
+# discovery is timed (log output is discarded). If treeDir is given the
+# tree is built there and kept, otherwise a temporary directory is used.
+#
+# Then times a full ClearManager._GetSupportedFilesInDir scan (including
+# file name parsing) which saves the scan state, followed by a rescan of
+# the unchanged tree using the saved state.
+
+# Python default package imports
+import contextlib
+import glob
+import os
+import sys
+import tempfile
+import time
+
+# Local file imports
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import clear.clear
+import clear.database as database
+import clear.util as util
+
+FILES_PER_DIR = 50
+DIRS_PER_DIR = 4
+IGNORE_DIR = 'DONE'
+
+############################################################################
+# BuildTree
+############################################################################
+def BuildTree(rootDir, fileCount):
+  """ Build a nested tree of media and other files under rootDir. """
+  dirQueue = [rootDir]
+  fileIndex = 0
+  while fileIndex < fileCount:
+    dirPath = dirQueue.pop(0)
+    os.makedirs(dirPath, exist_ok=True)
+    for count in range(FILES_PER_DIR):
+      if fileIndex % 3 == 0:
+        fileName = 'Show.{0}.S01E{1:02d}.mkv'.format(fileIndex, count)
+      else:
+        fileName = 'file{0}.nfo'.format(fileIndex)
+      open(os.path.join(dirPath, fileName), 'w').close()
+      fileIndex = fileIndex + 1
+    for count in range(DIRS_PER_DIR):
+      dirQueue.append(os.path.join(dirPath, 'dir{0}'.format(count)))
+  os.makedirs(os.path.join(rootDir, IGNORE_DIR), exist_ok=True)
+  open(os.path.join(rootDir, IGNORE_DIR, 'Ignored.S01E01.mkv'), 'w').close()
+
+############################################################################
+# GlobScan
+############################################################################
+def GlobScan(fileDir, fileList, supportedFormatList, ignoreDirList):
+  """ Original recursive glob scan. """
+  for globPath in glob.glob(os.path.join(fileDir, '*')):
+    if util.FileExtensionMatch(globPath, supportedFormatList):
+      fileList.append(globPath)
+    elif os.path.isdir(globPath):
+      if os.path.basename(globPath) not in ignoreDirList:
+        GlobScan(globPath, fileList, supportedFormatList, ignoreDirList)
+
+############################################################################
+# WalkScan
+############################################################################
+def WalkScan(fileDir, fileList, supportedFormatList, ignoreDirList):
+  """ Iterative os.scandir walk. """
+  clearManager = clear.clear.ClearManager()
+  for entry in clearManager._WalkSourceDir(fileDir, ignoreDirList):
+    if util.FileExtensionMatch(entry.name, supportedFormatList):
+      fileList.append(entry.path)
+
+############################################################################
+# StateScan
+############################################################################
+def StateScan(db, rootDir):
+  """ Scan using saved state, treating all parsed files as processed. """
+  clearManager = clear.clear.ClearManager()
+  clearManager._db = db
+  clearManager._sourceDir = rootDir
+  clearManager._supportedFormatsList = ['.mkv']
+  clearManager._ignoredDirsList = [IGNORE_DIR]
+  clearManager._LoadScanState()
+  tvFileList = []
+  clearManager._GetSupportedFilesInDir(rootDir, tvFileList, clearManager._supportedFormatsList, clearManager._ignoredDirsList)
+  for tvFile in tvFileList:
+    tvFile.fileInfo.newPath = tvFile.fileInfo.origPath
+  clearManager._SaveScanState(tvFileList)
+  return len(tvFileList)
+
+############################################################################
+# TimeScan
+############################################################################
+def TimeScan(scanFunction, rootDir):
+  """ Return (seconds, sorted file list) for scanFunction. """
+  fileList = []
+  with open(os.devnull, 'w') as devNull:
+    with contextlib.redirect_stdout(devNull):
+      startTime = time.perf_counter()
+      scanFunction(rootDir, fileList, ['.mkv'], [IGNORE_DIR])
+      scanTime = time.perf_counter() - startTime
+  return (scanTime, sorted(fileList))
+
+############################################################################
+# RunBenchmark
+############################################################################
+def RunBenchmark(rootDir, fileCount):
+  if not os.path.isdir(rootDir) or len(os.listdir(rootDir)) == 0:
+    startTime = time.perf_counter()
+    BuildTree(rootDir, fileCount)
+    print("Built {0} file tree in {1:.1f}s".format(fileCount, time.perf_counter() - startTime))
+
+  globTime, globList = TimeScan(GlobScan, rootDir)
+  walkTime, walkList = TimeScan(WalkScan, rootDir)
+  print("Glob scan: {0:.3f}s ({1} files)".format(globTime, len(globList)))
+  print("Walk scan: {0:.3f}s ({1} files, {2:.1f}x)".format(walkTime, len(walkList), globTime/walkTime))
+
+  if globList != walkList:
+    print("Results differ")
+    sys.exit(1)
+  print("Results identical")
+
+  with tempfile.TemporaryDirectory() as dbDir:
+    with database.RenamerDB(os.path.join(dbDir, 'benchmark.db')) as db:
+      with open(os.devnull, 'w') as devNull:
+        with contextlib.redirect_stdout(devNull):
+          startTime = time.perf_counter()
+          fullCount = StateScan(db, rootDir)
+          fullTime = time.perf_counter() - startTime
+          startTime = time.perf_counter()
+          rescanCount = StateScan(db, rootDir)
+          rescanTime = time.perf_counter() - startTime
+  print("Full scan and parse: {0:.3f}s ({1} files)".format(fullTime, fullCount))
+  print("Unchanged rescan:    {0:.3f}s ({1} files, {2:.1f}x)".format(rescanTime, rescanCount, fullTime/rescanTime))
+
+############################################################################
+# main
+############################################################################
+def main():
+  fileCount = 100000
+  if len(sys.argv) > 1:
+    fileCount = int(sys.argv[1])
+
+  if len(sys.argv) > 2:
+    RunBenchmark(sys.argv[2], fileCount)
+  else:
+    with tempfile.TemporaryDirectory() as tempDir:
+      RunBenchmark(tempDir, fileCount)
+
+if __name__ == "__main__":
+  main()
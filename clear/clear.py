@@ -5,8 +5,8 @@ This is the entry point for this program. """
 # Python default package imports
 import os
 import sys
+import time
 import argparse
-import glob
 
 # Third-party package imports
 import goodlogging
@@ -14,9 +14,11 @@ import goodlogging
 # Local file imports
 import clear.renamer as renamer
 import clear.database as database
+import clear.epguides as epguides
 import clear.tvfile as tvfile
 import clear.util as util
 import clear.extract as extract
+import clear.watch as watch
 
 #################################################
 # ClearManager
@@ -87,6 +89,20 @@ class ClearManager:
       Default to False. Set by plusarg. Enables extraction
       of files from compressed archives.
 
+    _extractWorkerCount : int
+      Default to extract.EXTRACT_WORKER_COUNT. Set by plusarg.
+      Maximum number of archives to extract at once.
+
+    _dbCacheTables : boolean
+      Default to False. Set by plusarg. If set the show,
+      file name and season directory tables are cached in
+      memory for the run.
+
+    _dbProfile : boolean
+      Default to False. Set by plusarg. If set database
+      query statistics are recorded and logged at the end
+      of the run.
+
     _skipUserInputRename : boolean
       Default to False. Set by plusarg. If set all user
       input during rename phase is skipped.
@@ -94,7 +110,77 @@ class ClearManager:
     _skipUserInputExtract : boolean
       Default to False. Set by plusarg. If set all user
       input during extract phase is skipped.
+
+    _fullScan : boolean
+      Default to False. Set by plusarg. If set the saved
+      scan state is ignored and every directory and file
+      in the source directory is parsed.
+
+    _scanDirStateDict : dict
+      Directory state from the last scan of the source
+      directory {dirPath: (parentDir, mTime, inode, settled)}.
+      None if the scan state is not in use.
+
+    _scanFileStateDict : dict
+      File state from the last scan of the source directory
+      {filePath: (dirPath, size, mTime, state)}. None if the
+      scan state is not in use.
+
+    _scanDirContentDict : dict
+      Sub-directories and files of each directory from the
+      last scan {dirPath: (subDirList, filePathList)}.
+
+    _newScanDirStateDict : dict
+      Directory state recorded during the current scan.
+
+    _scanStartTime : int
+      Time the current scan started in nanoseconds.
+
+    _newScanFileStateDict : dict
+      File state recorded during the current scan. Files which
+      are passed on to the renamer have a state of None until
+      the rename is complete.
+
+    _watchMode : boolean
+      Default to False. Set by plusarg. If set the source
+      directory is watched and new files are processed
+      until the program is stopped.
+
+    _watchPollInterval : float
+      Number of seconds between each scan of the source
+      directory in watch mode if inotify is not available.
+      Set by plusarg.
+
+    _settleTime : float
+      Files modified less than this number of seconds ago
+      are assumed to still be being written and are left
+      until a later scan. Set by plusarg (only used in
+      watch mode).
+
+    _deferredFileCount : int
+      Number of files left by the last scan as they were
+      still being written.
+
+    _watcher : InotifyWatcher or PollWatcher object
+      Source directory watcher (only set in watch mode).
+
+    _guide : EPGuidesLookup object
+      Guide used by the renamer. This is reused for each
+      scan in watch mode so previous lookups are kept.
+
+    _guideTime : float
+      Time the guide object was created.
+
+    _guideCacheTTL : int
+      Default to epguides.EPGuidesLookup.EPISODE_CACHE_TTL.
+      Set by plusarg. Number of hours for which cached show
+      info (and the guide object) is reused. 0 disables the
+      cache.
   """
+  WATCH_POLL_INTERVAL = 60
+  WATCH_SETTLE_TIME = 30
+  WATCH_QUIET_TIME = 1
+  SCAN_MTIME_MARGIN = 2
 
   #################################################
   # constructor
@@ -113,8 +199,26 @@ class ClearManager:
     self._dbUpdate = False
     self._dbPrint = False
     self._enableExtract = False
+    self._extractWorkerCount = extract.EXTRACT_WORKER_COUNT
+    self._dbCacheTables = False
+    self._dbProfile = False
     self._skipUserInputRename = False
     self._skipUserInputExtract = False
+    self._fullScan = False
+    self._scanDirStateDict = None
+    self._scanFileStateDict = None
+    self._scanDirContentDict = {}
+    self._newScanDirStateDict = {}
+    self._newScanFileStateDict = {}
+    self._scanStartTime = None
+    self._watchMode = False
+    self._watchPollInterval = self.WATCH_POLL_INTERVAL
+    self._settleTime = 0
+    self._deferredFileCount = 0
+    self._watcher = None
+    self._guide = None
+    self._guideTime = None
+    self._guideCacheTTL = epguides.EPGuidesLookup.EPISODE_CACHE_TTL
 
   ############################################################################
   # _UserUpdateConfigValue
@@ -264,9 +368,7 @@ class ClearManager:
     origFormatList = set(origFormatList)
 
     if formatList != origFormatList:
-      self._db.PurgeSupportedFormats()
-      for fileFormat in formatList:
-        self._db.AddSupportedFormat(fileFormat)
+      self._db.SetSupportedFormats(formatList)
 
     return formatList
 
@@ -344,9 +446,7 @@ class ClearManager:
     origIgnoredDirs = set(origIgnoredDirs)
 
     if ignoredDirs != origIgnoredDirs:
-      self._db.PurgeIgnoredDirs()
-      for ignoredDir in ignoredDirs:
-        self._db.AddIgnoredDir(ignoredDir)
+      self._db.SetIgnoredDirs(ignoredDirs)
 
     return list(ignoredDirs)
 
@@ -431,6 +531,7 @@ class ClearManager:
     parser.add_argument('-d', '--dst', help='override database destination directory')
 
     parser.add_argument('-e', '--extract', help='enable extracting of rar files', action="store_true")
+    parser.add_argument('--extract_workers', help='number of rar files to extract at once (default: {0})'.format(extract.EXTRACT_WORKER_COUNT), type=int)
 
     parser.add_argument('-c', '--copy', help='enable copying between file systems', action="store_true")
     parser.add_argument('-i', '--inplace', help='rename files in place', action="store_true")
@@ -442,6 +543,16 @@ class ClearManager:
     parser.add_argument('-nr', '--no_input_rename', help='automatically accept or skip user input for guide lookup and rename', action="store_true")
     parser.add_argument('-ne', '--no_input_extract', help='automatically accept or skip user input for extraction', action="store_true")
 
+    parser.add_argument('-w', '--watch', help='watch source directory and process new files until stopped (implies --no_input)', action="store_true")
+    parser.add_argument('--poll_interval', help='seconds between scans in watch mode if inotify is not available (default: {0})'.format(self.WATCH_POLL_INTERVAL), type=float)
+    parser.add_argument('--settle_time', help='seconds since last change before a file is processed in watch mode (default: {0})'.format(self.WATCH_SETTLE_TIME), type=float)
+
+    parser.add_argument('--epguides_cache_ttl', help='hours to reuse cached epguides show info, 0 disables the cache (default: {0})'.format(epguides.EPGuidesLookup.EPISODE_CACHE_TTL), type=int)
+
+    parser.add_argument('--full_scan', help='parse every file in source directory (ignore saved scan state)', action="store_true")
+    parser.add_argument('--cache_db', help='cache show, file name and season directory tables in memory', action="store_true")
+    parser.add_argument('--profile_db', help='log database query statistics at end of run', action="store_true")
+
     parser.add_argument('--debug', help='enable full logging', action="store_true")
     parser.add_argument('--tags', help='enable tags on log info', action="store_true")
 
@@ -453,12 +564,22 @@ class ClearManager:
     if args.test:
       self._databasePath = 'test.db'
 
-    if args.no_input or args.no_input_rename:
+    if args.no_input or args.no_input_rename or args.watch:
       self._skipUserInputRename = True
 
-    if args.no_input or args.no_input_extract:
+    if args.no_input or args.no_input_extract or args.watch:
       self._skipUserInputExtract = True
 
+    if args.watch:
+      self._watchMode = True
+      self._settleTime = self.WATCH_SETTLE_TIME
+
+    if args.poll_interval is not None:
+      self._watchPollInterval = args.poll_interval
+
+    if args.settle_time is not None:
+      self._settleTime = args.settle_time
+
     if args.reset:
       goodlogging.Log.Info("CLEAR", "*WARNING* YOU ARE ABOUT TO DELETE DATABASE {0}".format(self._databasePath))
       response = goodlogging.Log.Input("CLEAR", "Are you sure you want to proceed [y/n]? ")
@@ -489,6 +610,25 @@ class ClearManager:
     if args.extract:
       self._enableExtract = True
 
+    if args.extract_workers is not None:
+      if args.extract_workers < 1:
+        goodlogging.Log.Fatal("CLEAR", 'Extract worker count must be at least 1: {}'.format(args.extract_workers))
+      self._extractWorkerCount = args.extract_workers
+
+    if args.epguides_cache_ttl is not None:
+      if args.epguides_cache_ttl < 0:
+        goodlogging.Log.Fatal("CLEAR", 'Epguides cache time to live must not be negative: {}'.format(args.epguides_cache_ttl))
+      self._guideCacheTTL = args.epguides_cache_ttl
+
+    if args.cache_db:
+      self._dbCacheTables = True
+
+    if args.profile_db:
+      self._dbProfile = True
+
+    if args.full_scan:
+      self._fullScan = True
+
     if args.src:
       if os.path.isdir(args.src):
         self._sourceDir = args.src
@@ -501,12 +641,436 @@ class ClearManager:
       else:
         goodlogging.Log.Fatal("CLEAR", 'Target directory argument is not recognised as a directory: {}'.format(args.dst))
 
+  ############################################################################
+  # _WalkSourceDir
+  ############################################################################
+  def _WalkSourceDir(self, rootDir, ignoreDirList):
+    """
+    Iteratively walk a directory tree with os.scandir, yielding every
+    file found.
+
+    The file type of each entry is taken from its os.DirEntry so no extra
+    stat call is needed on most platforms. Directories in ignoreDirList
+    are skipped without being read and any directory which cannot be read
+    is logged and skipped. Every directory is walked at most once, keyed
+    on its device and inode, so a link loop can not be walked forever and
+    a directory reached through both a real path and a symbolic link is
+    not read twice. Symbolic links to directories are only followed once
+    the rest of the tree has been walked so a directory is always found
+    under its real path where it has one.
+
+    In watch mode each directory is watched before it is read so no change
+    made after it has been read can be missed.
+
+    If the scan state is in use a directory which is settled and has not
+    changed since the last scan is not read again. Its files are not
+    yielded and the sub-directories found by the last scan are walked
+    instead.
+
+    Parameters
+    ----------
+      rootDir : string
+        Path to root of directory tree to search.
+
+      ignoreDirList : list
+        List of directory names to ignore.
+
+    Yields
+    ----------
+      os.DirEntry
+        Directory entry for each file in the tree.
+    """
+    dirStack = [(rootDir, None)]
+    linkDirStack = []
+    visitedDirSet = set()
+
+    while dirStack or linkDirStack:
+      if dirStack:
+        dirPath, parentDir = dirStack.pop()
+      else:
+        dirPath, parentDir = linkDirStack.pop()
+
+      try:
+        dirStat = os.stat(dirPath)
+      except OSError as ex:
+        goodlogging.Log.Info("CLEAR", "Unable to read directory {0}: {1}".format(dirPath, ex))
+        continue
+
+      dirKey = (dirStat.st_dev, dirStat.st_ino)
+      if dirKey in visitedDirSet:
+        goodlogging.Log.Info("CLEAR", "Skipping already parsed directory: {0}".format(dirPath))
+        continue
+      visitedDirSet.add(dirKey)
+
+      if self._watcher is not None:
+        self._WatchDir(dirPath)
+
+      dirState = None
+      if self._scanDirStateDict is not None:
+        dirState = self._GetScanDirState(dirPath, parentDir)
+        if dirState is not None and dirState[3] is True and dirState == self._scanDirStateDict.get(dirPath):
+          self._CopyScanDirState(dirPath)
+          subDirList = [(subDir, dirPath) for subDir in self._GetScanSubDirs(dirPath)]
+          dirStack.extend(reversed(subDirList))
+          continue
+
+      goodlogging.Log.Info("CLEAR", "Parsing file directory: {0}".format(dirPath))
+
+      try:
+        with os.scandir(dirPath) as dirIterator:
+          entryList = list(dirIterator)
+      except OSError as ex:
+        goodlogging.Log.Info("CLEAR", "Unable to read directory {0}: {1}".format(dirPath, ex))
+        continue
+
+      if dirState is not None:
+        self._newScanDirStateDict[dirPath] = dirState
+
+      subDirList = []
+      for entry in entryList:
+        try:
+          isDir = entry.is_dir()
+        except OSError:
+          isDir = False
+
+        if isDir is False:
+          yield entry
+        elif entry.name in ignoreDirList:
+          goodlogging.Log.Info("CLEAR", "Skipping ignored directory: {0}".format(entry.path))
+        elif entry.is_symlink():
+          linkDirStack.append((entry.path, dirPath))
+        else:
+          subDirList.append((entry.path, dirPath))
+
+      # Walk sub-directories depth first in the order they were listed
+      dirStack.extend(reversed(subDirList))
+
+  ############################################################################
+  # _GetArchiveFormats
+  ############################################################################
+  def _GetArchiveFormats(self):
+    """
+    Get compressed archive formats to find in source directory.
+
+    Returns
+    ----------
+      list
+        List of compressed archive file extensions (empty if extraction
+        is not enabled).
+    """
+    if self._enableExtract:
+      return list(extract.COMPRESSED_FORMAT_LIST)
+    else:
+      return []
+
+  ############################################################################
+  # _GetScanKey
+  ############################################################################
+  def _GetScanKey(self):
+    """
+    Get key describing the settings which decide how each file is
+    classified during a scan. Saved scan state is only reused if it was
+    saved with the same key.
+
+    Returns
+    ----------
+      string
+        Scan key for current supported formats, ignored directories and
+        compressed archive formats.
+    """
+    return repr((sorted(self._supportedFormatsList), sorted(self._ignoredDirsList), self._GetArchiveFormats()))
+
+  ############################################################################
+  # _LoadScanState
+  ############################################################################
+  def _LoadScanState(self):
+    """
+    Load the scan state saved by the last run for the source directory.
+    If full scan is enabled no saved state is loaded, so every directory
+    and file is parsed, but the new state is still saved at the end of
+    the run.
+    """
+    if self._fullScan:
+      goodlogging.Log.Info("CLEAR", "Full scan enabled - ignoring saved scan state")
+      self._scanDirStateDict, self._scanFileStateDict = {}, {}
+    else:
+      self._scanDirStateDict, self._scanFileStateDict = self._db.GetScanState(self._sourceDir, self._GetScanKey())
+
+    self._scanDirContentDict = {dirPath: ([], []) for dirPath in self._scanDirStateDict}
+    for dirPath, dirState in self._scanDirStateDict.items():
+      if dirState[0] in self._scanDirContentDict:
+        self._scanDirContentDict[dirState[0]][0].append(dirPath)
+    for filePath, fileState in self._scanFileStateDict.items():
+      if fileState[0] in self._scanDirContentDict:
+        self._scanDirContentDict[fileState[0]][1].append(filePath)
+
+    self._newScanDirStateDict = {}
+    self._newScanFileStateDict = {}
+    self._scanStartTime = time.time_ns()
+
+  ############################################################################
+  # _SaveScanState
+  ############################################################################
+  def _SaveScanState(self, tvFileList):
+    """
+    Save the state of the current scan to the database.
+
+    Files passed to the renamer which did not need to be renamed are
+    recorded as processed. Any other file passed to the renamer is not
+    recorded (it will either have been moved or it will be parsed again
+    next run) and its directory is marked as unsettled so it is read
+    again next run.
+
+    Parameters
+    ----------
+      tvFileList : list
+        List of TVFile objects passed to the renamer.
+    """
+    for tvFile in tvFileList:
+      filePath = tvFile.fileInfo.origPath
+      fileState = self._newScanFileStateDict.get(filePath)
+      if fileState is not None and tvFile.fileInfo.newPath == filePath:
+        self._newScanFileStateDict[filePath] = fileState[:3] + ('processed', )
+
+    for filePath, fileState in list(self._newScanFileStateDict.items()):
+      if fileState[3] is None:
+        del self._newScanFileStateDict[filePath]
+        dirState = self._newScanDirStateDict.get(fileState[0])
+        if dirState is not None:
+          self._newScanDirStateDict[fileState[0]] = dirState[:3] + (False, )
+
+    self._db.SetScanState(self._sourceDir, self._GetScanKey(), self._newScanDirStateDict, self._newScanFileStateDict, savedState = (self._scanDirStateDict, self._scanFileStateDict))
+
+  ############################################################################
+  # _GetScanDirState
+  ############################################################################
+  def _GetScanDirState(self, dirPath, parentDir):
+    """
+    Get the current state of a directory. The directory is assumed to be
+    settled, this is cleared when the scan state is saved if any file in
+    the directory is left unprocessed.
+
+    A directory modified within SCAN_MTIME_MARGIN seconds of the start of
+    the scan is never settled. A file added just after the directory is
+    read could otherwise leave its mtime unchanged on file systems with a
+    coarse timestamp resolution (such as FAT or some network shares), so
+    the directory would not be read again.
+
+    Parameters
+    ----------
+      dirPath : string
+        Path to directory.
+
+      parentDir : string
+        Path to parent directory (None for the root directory).
+
+    Returns
+    ----------
+      tuple or None
+        Directory state (parentDir, mTime, inode, settled) or None if the
+        directory can not be accessed.
+    """
+    try:
+      dirStat = os.stat(dirPath)
+    except OSError:
+      return None
+    settled = self._scanStartTime - dirStat.st_mtime_ns > self.SCAN_MTIME_MARGIN * 1000000000
+    return (parentDir, dirStat.st_mtime_ns, dirStat.st_ino, settled)
+
+  ############################################################################
+  # _CopyScanDirState
+  ############################################################################
+  def _CopyScanDirState(self, dirPath):
+    """
+    Copy the saved state of an unchanged directory and of all files in it
+    to the state for the current scan.
+
+    Parameters
+    ----------
+      dirPath : string
+        Path to directory.
+    """
+    util.LogInfo("CLEAR", "Skipping unchanged directory: {0}", dirPath, verbosity=goodlogging.Verbosity.MINIMAL)
+    self._newScanDirStateDict[dirPath] = self._scanDirStateDict[dirPath]
+    for filePath in self._scanDirContentDict[dirPath][1]:
+      self._newScanFileStateDict[filePath] = self._scanFileStateDict[filePath]
+
+  ############################################################################
+  # _GetScanSubDirs
+  ############################################################################
+  def _GetScanSubDirs(self, dirPath):
+    """
+    Get the sub-directories of a directory found by the last scan.
+
+    Parameters
+    ----------
+      dirPath : string
+        Path to directory.
+
+    Returns
+    ----------
+      list
+        List of sub-directory paths.
+    """
+    return self._scanDirContentDict[dirPath][0]
+
+  ############################################################################
+  # _GetScanFileState
+  ############################################################################
+  def _GetScanFileState(self, filePath, fileStat = None):
+    """
+    Get the current state of a file (without a classification).
+
+    Parameters
+    ----------
+      filePath : string
+        Path to file.
+
+      fileStat : os.stat_result [optional : default = None]
+        Status of file. If not given this is looked up.
+
+    Returns
+    ----------
+      tuple or None
+        File state (dirPath, size, mTime) or None if the scan state is not
+        in use or the file can not be accessed.
+    """
+    if self._scanFileStateDict is None:
+      return None
+
+    if fileStat is None:
+      try:
+        fileStat = os.stat(filePath)
+      except OSError:
+        return None
+
+    return (os.path.dirname(filePath), fileStat.st_size, fileStat.st_mtime_ns)
+
+  ############################################################################
+  # _GetSourceFilesInDir
+  ############################################################################
+  def _GetSourceFilesInDir(self, fileDir, archiveFileList, candidateFileList, supportedFormatList, ignoreDirList, archiveFormatList = []):
+    """
+    Find all compressed archives and all supported files given a root
+    search directory in a single walk of the directory tree.
+
+    Supported file extensions and compressed archive extensions are given as
+    lists, as are any directories which should be ignored.
+
+    The results will be appended to the given archive and candidate file
+    list arguments.
+
+    If the scan state is in use a file which has the same size and
+    modification time as in the last scan is skipped, as it was either
+    unsupported, incompatible or already processed. Unsupported files found
+    by this scan are recorded as such. Archives are not given a state so
+    their directory is always read again until they have been extracted
+    and archived.
+
+    If a settle time is set any archive or supported file modified more
+    recently than this is left for a later scan, as are any other archives
+    in the same directory.
+
+    Parameters
+    ----------
+      fileDir : string
+        Path to root of directory tree to search.
+
+      archiveFileList : list
+        List to add any found compressed archives to.
+
+      candidateFileList : list
+        List to add any found supported files to.
+
+      supportedFormatList : list
+        List of supported file extensions.
+
+      ignoreDirList : list
+        List of directories to ignore.
+
+      archiveFormatList : list [optional : default = []]
+        List of compressed archive file extensions. If empty, archives are
+        treated the same as any other file.
+    """
+    if os.path.isdir(fileDir) is True:
+      dirArchiveList = []
+      deferredDirSet = set()
+      for entry in self._WalkSourceDir(os.path.normpath(fileDir), ignoreDirList):
+        fileStat = None
+        if self._scanFileStateDict is not None or self._settleTime > 0:
+          try:
+            fileStat = entry.stat()
+          except OSError:
+            pass
+
+        fileState = None
+        if fileStat is not None and self._scanFileStateDict is not None:
+          fileState = self._GetScanFileState(entry.path, fileStat)
+          savedFileState = self._scanFileStateDict.get(entry.path)
+          if savedFileState is not None and savedFileState[:3] == fileState:
+            util.LogInfo("CLEAR", "Skipping unchanged {0} file: {1}", savedFileState[3], entry.path, verbosity=goodlogging.Verbosity.MINIMAL)
+            self._newScanFileStateDict[entry.path] = savedFileState
+            continue
+
+        fileStateName = None
+        isArchive = util.FileExtensionMatch(entry.name, archiveFormatList)
+        if not isArchive and not util.FileExtensionMatch(entry.name, supportedFormatList):
+          goodlogging.Log.Info("CLEAR", "Ignoring unsupported file: {0}".format(entry.path))
+          fileStateName = 'unsupported'
+        elif fileStat is not None and time.time() - fileStat.st_mtime < self._settleTime:
+          goodlogging.Log.Info("CLEAR", "Waiting for file to finish writing: {0}".format(entry.path))
+          self._deferredFileCount = self._deferredFileCount + 1
+          deferredDirSet.add(os.path.dirname(entry.path))
+        elif isArchive:
+          dirArchiveList.append(entry.path)
+        else:
+          candidateFileList.append(entry.path)
+
+        if fileState is not None:
+          self._newScanFileStateDict[entry.path] = fileState + (fileStateName, )
+
+      # Leave all archives in a directory if any file in it is still being
+      # written, as it may be another volume of a multi-part archive
+      for filePath in dirArchiveList:
+        if os.path.dirname(filePath) in deferredDirSet:
+          goodlogging.Log.Info("CLEAR", "Waiting for directory to finish writing: {0}".format(filePath))
+        else:
+          archiveFileList.append(filePath)
+    else:
+      goodlogging.Log.Info("CLEAR", "Invalid non-directory path given to parse")
+
+  ############################################################################
+  # _ParseSupportedFiles
+  ############################################################################
+  def _ParseSupportedFiles(self, candidateFileList, fileList):
+    """
+    Get show details from the file name of each supported file. Files which
+    are compatible are appended to the given file list argument, any others
+    are recorded as incompatible if the scan state is in use.
+
+    Parameters
+    ----------
+      candidateFileList : list
+        List of supported file paths.
+
+      fileList : list
+        List to add TVFile objects for compatible files to.
+    """
+    for filePath in candidateFileList:
+      newFile = tvfile.TVFile(filePath)
+      if newFile.GetShowDetails():
+        fileList.append(newFile)
+      else:
+        fileState = self._newScanFileStateDict.get(filePath)
+        if fileState is not None:
+          self._newScanFileStateDict[filePath] = fileState[:3] + ('incompatible', )
+
   ############################################################################
   # GetSupportedFilesInDir
   ############################################################################
   def _GetSupportedFilesInDir(self, fileDir, fileList, supportedFormatList, ignoreDirList):
     """
-    Recursively get all supported files given a root search directory.
+    Get all supported files given a root search directory.
 
     Supported file extensions are given as a list, as are any directories which
     should be ignored.
@@ -527,22 +1091,165 @@ class ClearManager:
       ignoreDirList : list
         List of directories to ignore.
     """
-    goodlogging.Log.Info("CLEAR", "Parsing file directory: {0}".format(fileDir))
-    if os.path.isdir(fileDir) is True:
-      for globPath in glob.glob(os.path.join(fileDir, '*')):
-        if util.FileExtensionMatch(globPath, supportedFormatList):
-          newFile = tvfile.TVFile(globPath)
-          if newFile.GetShowDetails():
-            fileList.append(newFile)
-        elif os.path.isdir(globPath):
-          if(os.path.basename(globPath) in ignoreDirList):
-            goodlogging.Log.Info("CLEAR", "Skipping ignored directory: {0}".format(globPath))
-          else:
-            self._GetSupportedFilesInDir(globPath, fileList, supportedFormatList, ignoreDirList)
-        else:
-          goodlogging.Log.Info("CLEAR", "Ignoring unsupported file or folder: {0}".format(globPath))
+    candidateFileList = []
+    self._GetSourceFilesInDir(fileDir, [], candidateFileList, supportedFormatList, ignoreDirList)
+    self._ParseSupportedFiles(candidateFileList, fileList)
+
+  ############################################################################
+  # _GetGuide
+  ############################################################################
+  def _GetGuide(self):
+    """
+    Get guide object for the renamer. The same object is reused (along with
+    all show info it has looked up) until it is older than the guide cache
+    time to live, after which a new object is created so show and episode
+    lists are refreshed. If the cache time to live is 0 a new object is
+    created every time.
+
+    Returns
+    ----------
+      EPGuidesLookup object
+        Guide object.
+    """
+    if self._guide is None or time.time() - self._guideTime >= self._guideCacheTTL * 60 * 60:
+      self._guide = epguides.EPGuidesLookup(cacheTTL = self._guideCacheTTL)
+      self._guideTime = time.time()
+    return self._guide
+
+  ############################################################################
+  # _ProcessSourceDir
+  ############################################################################
+  def _ProcessSourceDir(self):
+    """
+    Find, extract and rename all new files in the source directory.
+
+    Does the following steps:
+
+    - Load saved scan state for source directory.
+    - Recursively parse source directory for compressed archives
+      and files matching supported format list (skipping any which
+      are unchanged since the last scan).
+    - Optionally extract compressed archives.
+    - Get show details for all supported and extracted files.
+    - Call renamer.TVRenamer with file list (in watch mode this
+      is skipped if the list is empty).
+    - Save scan state for source directory.
+    """
+    goodlogging.Log.Seperator()
+
+    self._deferredFileCount = 0
+    archiveFileList = []
+    candidateFileList = []
+    if self._enableExtract:
+      goodlogging.Log.Info("CLEAR", "Parsing source directory for compressed and compatible files")
     else:
-      goodlogging.Log.Info("CLEAR", "Invalid non-directory path given to parse")
+      goodlogging.Log.Info("CLEAR", "Parsing source directory for compatible files")
+    goodlogging.Log.IncreaseIndent()
+    self._LoadScanState()
+    self._GetSourceFilesInDir(self._sourceDir, archiveFileList, candidateFileList, self._supportedFormatsList, self._ignoredDirsList, self._GetArchiveFormats())
+    goodlogging.Log.DecreaseIndent()
+
+    if self._enableExtract:
+      goodlogging.Log.Seperator()
+      extractedFileList = []
+      extract.Extract(archiveFileList, self._supportedFormatsList, self._archiveDir, self._skipUserInputExtract, extractedFileList, self._extractWorkerCount, self._db)
+
+      # Files moved by extraction are replaced by their extracted path
+      if len(extractedFileList) > 0:
+        candidateFileList = [filePath for filePath in candidateFileList if os.path.isfile(filePath)]
+      candidateFileSet = set(candidateFileList)
+      for filePath in extractedFileList:
+        if filePath not in candidateFileSet:
+          candidateFileSet.add(filePath)
+          candidateFileList.append(filePath)
+          fileState = self._GetScanFileState(filePath)
+          if fileState is not None:
+            self._newScanFileStateDict[filePath] = fileState + (None, )
+
+    tvFileList = []
+    self._ParseSupportedFiles(candidateFileList, tvFileList)
+
+    if len(tvFileList) > 0 or self._watchMode is False:
+      tvRenamer = renamer.TVRenamer(self._db,
+                                    tvFileList,
+                                    self._archiveDir,
+                                    guideName = 'EPGUIDES',
+                                    tvDir = self._tvDir,
+                                    inPlaceRename = self._inPlaceRename,
+                                    forceCopy = self._crossSystemCopyEnabled,
+                                    skipUserInput = self._skipUserInputRename,
+                                    guide = self._GetGuide())
+      tvRenamer.Run()
+    self._SaveScanState(tvFileList)
+
+  ############################################################################
+  # _WatchDir
+  ############################################################################
+  def _WatchDir(self, dirPath):
+    """
+    Add directory to the source directory watcher. If this fails (e.g. the
+    inotify watch limit is reached) the watcher falls back to polling.
+
+    Parameters
+    ----------
+      dirPath : string
+        Path to directory.
+    """
+    try:
+      self._watcher.WatchDirs([dirPath])
+    except OSError as ex:
+      goodlogging.Log.Info("CLEAR", "Unable to watch directory {0} ({1}) - polling every {2}s".format(dirPath, ex, self._watchPollInterval))
+      self._watcher.close()
+      self._watcher = watch.PollWatcher(self._watchPollInterval)
+
+  ############################################################################
+  # _WatchSourceDir
+  ############################################################################
+  def _WatchSourceDir(self):
+    """
+    Process the source directory each time it changes until the program is
+    stopped (e.g. by keyboard interrupt).
+
+    The database, its table cache and the guide object are kept between
+    scans and the saved scan state means only changed directories are read
+    again. After a change is detected processing waits until there have
+    been no changes for WATCH_QUIET_TIME seconds (up to the settle time) so
+    a burst of changes is handled by a single scan. If the last scan left
+    files which were still being written the source directory is scanned
+    again after the settle time.
+
+    If a scan fails (e.g. a guide lookup or database error) the error is
+    logged and the source directory is scanned again after the poll
+    interval, or sooner if a change is detected.
+    """
+    goodlogging.Log.Seperator()
+    goodlogging.Log.Info("CLEAR", "Watching source directory: {0} (press Ctrl+C to stop)".format(self._sourceDir))
+    self._watcher = watch.GetWatcher(self._watchPollInterval)
+
+    try:
+      while True:
+        try:
+          self._ProcessSourceDir()
+        except Exception as ex:
+          goodlogging.Log.ResetIndent()
+          goodlogging.Log.Error("CLEAR", "Processing source directory failed - Exception: {0}".format(ex))
+          timeout = self._watchPollInterval
+        else:
+          if self._deferredFileCount > 0:
+            timeout = self._settleTime
+          else:
+            timeout = None
+
+        if self._watcher.Wait(timeout):
+          quietEndTime = time.time() + max(self._settleTime, self.WATCH_QUIET_TIME)
+          while time.time() < quietEndTime and self._watcher.Wait(self.WATCH_QUIET_TIME):
+            pass
+    except KeyboardInterrupt:
+      goodlogging.Log.NewLine()
+      goodlogging.Log.Info("CLEAR", "Stopped watching source directory")
+    finally:
+      self._watcher.close()
+      self._watcher = None
 
   ############################################################################
   # Run
@@ -556,15 +1263,16 @@ class ClearManager:
     - Parse script arguments.
     - Optionally print or update database tables.
     - Get all configuration settings from database.
-    - Optionally parse directory for file extraction.
-    - Recursively parse source directory for files matching
-      supported format list.
-    - Call renamer.TVRenamer with file list.
+    - Process source directory once or, in watch mode, each time
+      it changes until stopped (see _ProcessSourceDir).
+    - Log web lookup counters (debug only).
+    - Optionally log database query statistics.
+    - Close database connection.
     """
     self._GetArgs()
 
     goodlogging.Log.Info("CLEAR", "Using database: {0}".format(self._databasePath))
-    self._db = database.RenamerDB(self._databasePath)
+    self._db = database.RenamerDB(self._databasePath, cacheTables = self._dbCacheTables, profile = self._dbProfile)
 
     if self._dbPrint or self._dbUpdate:
       goodlogging.Log.Seperator()
@@ -576,35 +1284,19 @@ class ClearManager:
 
     self._GetDatabaseConfig()
 
-    if self._enableExtract:
-      goodlogging.Log.Seperator()
+    if self._watchMode:
+      self._WatchSourceDir()
+    else:
+      self._ProcessSourceDir()
 
-      extractFileList = []
-      goodlogging.Log.Info("CLEAR", "Parsing source directory for compressed files")
-      goodlogging.Log.IncreaseIndent()
-      extract.GetCompressedFilesInDir(self._sourceDir, extractFileList, self._ignoredDirsList)
-      goodlogging.Log.DecreaseIndent()
+    webStats = util.GetWebLookupStats()
+    goodlogging.Log.Info("CLEAR", "Web lookups: {0} request(s), {1} bytes, {2:.2f}s total, {3:.2f}s max".format(webStats['requests'], webStats['bytes'], webStats['seconds'], webStats['maxSeconds']), verbosity=goodlogging.Verbosity.MINIMAL)
 
+    if self._dbProfile:
       goodlogging.Log.Seperator()
-      extract.Extract(extractFileList, self._supportedFormatsList, self._archiveDir, self._skipUserInputExtract)
-
-    goodlogging.Log.Seperator()
-
-    tvFileList = []
-    goodlogging.Log.Info("CLEAR", "Parsing source directory for compatible files")
-    goodlogging.Log.IncreaseIndent()
-    self._GetSupportedFilesInDir(self._sourceDir, tvFileList, self._supportedFormatsList, self._ignoredDirsList)
-    goodlogging.Log.DecreaseIndent()
+      self._db.LogQueryStats()
 
-    tvRenamer = renamer.TVRenamer(self._db,
-                                  tvFileList,
-                                  self._archiveDir,
-                                  guideName = 'EPGUIDES',
-                                  tvDir = self._tvDir,
-                                  inPlaceRename = self._inPlaceRename,
-                                  forceCopy = self._crossSystemCopyEnabled,
-                                  skipUserInput = self._skipUserInputRename)
-    tvRenamer.Run()
+    self._db.close()
 
 ############################################################################
 # main
@@ -1,9 +1,12 @@
 """ SQLite database control """
 
 # Python default package imports
+import contextlib
 import sqlite3
 import os
+import random
 import re
+import time
 
 # Third-party package imports
 import goodlogging
@@ -27,11 +30,41 @@ class RenamerDB:
     _dbPath : string
       Path to sqlite database file.
 
+    _connection : sqlite3.Connection
+      Database connection shared by every command. This is opened
+      on first use and kept until close is called.
+
+    _transactionDepth : int
+      Number of nested Transaction contexts currently open. While this
+      is non-zero individual commands are not committed.
+
+    _cacheTables : boolean
+      If set the TVLibrary, FileName and SeasonDir tables are mirrored
+      in memory.
+
+    _tableCache : dict or None
+      In memory mirror of the cached tables. This is loaded on first
+      use and discarded (to be reloaded) after any change which is not
+      written through, such as a purge, manual update or rollback, or
+      if another connection has changed the database since it was
+      loaded.
+
+    _tableCacheVersion : int
+      Database data_version when the table cache was loaded.
+
+    _queryStats : dict or None
+      Statistics for each SQL statement template run by _ActionDatabase.
+      None unless profiling is enabled.
+
     _tableDict : dict
       A dictionary mapping database table
       names with the column names of that
       table.
 
+    _migrationList : list
+      Schema migration methods. The method at index N upgrades the
+      schema from version N to version N+1.
+
   Notes
   ----------
   Database tables:
@@ -60,13 +93,43 @@ class RenamerDB:
     SeasonDir (ShowID, Season, SeasonDir)
       Match a unique show id and season number
       combination to a season directory name.
+
+    ScanRoot (RootDir, ScanKey)
+    ScanDir (RootDir, DirPath, ParentDir, MTime, Inode, Settled)
+    ScanFile (RootDir, FilePath, DirPath, Size, MTime, State)
+      Source directory scan state from the last run
+      (added in schema version 1). These are not
+      included in the print or manual update of
+      tables.
+
+    ExtractArchive (ArchivePath, VolumeCount, Size, MTime, Complete)
+    ExtractFile (ArchivePath, MemberName, FilePath)
+      Ledger of RAR archive sets which have been
+      extracted (fully or in part) but not yet
+      moved to the archive directory, with the
+      path each archive member was extracted to
+      (added in schema version 2). These are not
+      included in the print or manual update of
+      tables.
+
+  Schema versions:
+    The schema version is stored in the database user_version. Version 0
+    is the original set of tables created by _CreateDatabase. Each later
+    version is applied in turn by a method in _migrationList when the
+    database is opened, so existing databases are upgraded in place.
   """
   logVerbosity = goodlogging.Verbosity.MINIMAL
 
+  BUSY_TIMEOUT = 30
+  JOURNAL_MODE = 'WAL'
+  SYNCHRONOUS_MODE = 'NORMAL'
+  LOCK_RETRY_COUNT = 5
+  LOCK_RETRY_DELAY = 0.2
+
   ############################################################################
   # constructor
   ############################################################################
-  def __init__(self, dbPath):
+  def __init__(self, dbPath, cacheTables = False, profile = False):
     """
     Constructor. Initialise object values.
 
@@ -77,8 +140,29 @@ class RenamerDB:
     ----------
       dbPath : string
         Path to sqlite database file.
+
+      cacheTables : boolean [optional : default = False]
+        If True the TVLibrary, FileName and SeasonDir tables are each
+        loaded once and the search methods for these tables are answered
+        from memory. Changes made through this object are written through
+        to the cache. Each cached read checks the database data_version
+        and reloads the cache if another connection has changed the
+        database.
+
+      profile : boolean [optional : default = False]
+        If True record the number of calls, time taken and rows returned
+        for each SQL statement (see GetQueryStats and LogQueryStats).
     """
     self._dbPath = dbPath
+    self._connection = None
+    self._transactionDepth = 0
+    self._cacheTables = cacheTables
+    self._tableCache = None
+    self._tableCacheVersion = None
+    if profile is True:
+      self._queryStats = {}
+    else:
+      self._queryStats = None
 
     self._tableDict = {"Config": ('Name', 'Value'),
                        "IgnoredDir": ('DirName',),
@@ -87,56 +171,307 @@ class RenamerDB:
                        "FileName": ('FileName', 'ShowID'),
                        "SeasonDir": ('ShowID', 'Season', 'SeasonDir')}
 
+    self._migrationList = [self._MigrateToVersion1, self._MigrateToVersion2]
+
     if not os.path.exists(self._dbPath):
       self._CreateDatabase()
     elif not os.path.isfile(self._dbPath):
       goodlogging.Log.Fatal("DB", "Database path exists but it is not a file: {0}".format(self._dbPath))
 
+    self._UpgradeDatabase()
+
+  ############################################################################
+  # context manager
+  ############################################################################
+  def __enter__(self):
+    return self
+
+  def __exit__(self, excType, excValue, traceback):
+    self.close()
+
+  ############################################################################
+  # _GetConnection
+  ############################################################################
+  def _GetConnection(self):
+    """
+    Return the database connection, opening it if required.
+
+    The connection waits up to BUSY_TIMEOUT seconds for a lock held by
+    another connection. WAL journal mode lets readers continue while a
+    write is in progress and with NORMAL synchronous mode a commit does
+    not need to wait for the journal to be synced to disk.
+
+    Returns
+    ----------
+      sqlite3.Connection
+        Open database connection.
+    """
+    if self._connection is None:
+      util.LogInfo("DB", "Opening database connection: {0}", self._dbPath, verbosity=self.logVerbosity)
+      self._connection = sqlite3.connect(self._dbPath, timeout=self.BUSY_TIMEOUT)
+      self._connection.execute("PRAGMA busy_timeout={0}".format(int(self.BUSY_TIMEOUT*1000)))
+      journalMode = self._connection.execute("PRAGMA journal_mode={0}".format(self.JOURNAL_MODE)).fetchone()[0]
+      if journalMode.upper() != self.JOURNAL_MODE:
+        util.LogInfo("DB", "Database journal mode {0} not supported - using {1}", self.JOURNAL_MODE, journalMode, verbosity=self.logVerbosity)
+      self._connection.execute("PRAGMA synchronous={0}".format(self.SYNCHRONOUS_MODE))
+    return self._connection
+
+  ############################################################################
+  # close
+  ############################################################################
+  def close(self):
+    """ Close the database connection if it is open. """
+    if self._connection is not None:
+      goodlogging.Log.Info("DB", "Closing database connection", verbosity=self.logVerbosity)
+      self._connection.close()
+      self._connection = None
+
+  ############################################################################
+  # _IsLockError
+  ############################################################################
+  def _IsLockError(self, ex):
+    """
+    Check if a database exception was caused by another connection holding
+    a lock on the database.
+
+    Parameters
+    ----------
+      ex : sqlite3.OperationalError
+        Database exception.
+
+    Returns
+    ----------
+      boolean
+        True if exception was caused by a locked or busy database.
+    """
+    errorMessage = str(ex).lower()
+    return 'locked' in errorMessage or 'busy' in errorMessage
+
+  ############################################################################
+  # _LockRetryWait
+  ############################################################################
+  def _LockRetryWait(self, attempt, ex):
+    """
+    Wait before retrying a command which failed as the database was locked.
+    The wait is a random time up to LOCK_RETRY_DELAY doubled for each
+    previous attempt so competing connections do not retry in step.
+
+    Parameters
+    ----------
+      attempt : int
+        Number of previous attempts.
+
+      ex : sqlite3.OperationalError
+        Database exception.
+    """
+    retryDelay = random.uniform(0, self.LOCK_RETRY_DELAY * 2**attempt)
+    util.LogInfo("DB", "Database locked ({0}) - retrying in {1:.2f}s", ex, retryDelay, verbosity=self.logVerbosity)
+    time.sleep(retryDelay)
+
+  ############################################################################
+  # Transaction
+  ############################################################################
+  @contextlib.contextmanager
+  def Transaction(self, immediate = False):
+    """
+    Context manager which groups all database changes made inside it into
+    a single transaction. This is committed when the context exits or
+    rolled back if it exits with an exception (including a fatal error
+    or keyboard interrupt).
+
+    Transactions can be nested, in which case only the outermost context
+    begins, commits or rolls back.
+
+    Parameters
+    ----------
+      immediate : boolean [optional : default = False]
+        If True the database write lock is taken when the transaction
+        begins (BEGIN IMMEDIATE). Use this for transactions which read
+        then write so no other connection can change the database between
+        the read and the write. If the lock is still held by another
+        connection after the busy timeout the begin is retried up to
+        LOCK_RETRY_COUNT times.
+
+    Yields
+    ----------
+      RenamerDB
+        This database object.
+    """
+    db = self._GetConnection()
+    if self._transactionDepth == 0:
+      goodlogging.Log.Info("DB", "Starting database transaction", verbosity=self.logVerbosity)
+      if immediate is True:
+        beginCmd = "BEGIN IMMEDIATE"
+      else:
+        beginCmd = "BEGIN"
+
+      attempt = 0
+      while True:
+        try:
+          db.execute(beginCmd)
+        except sqlite3.OperationalError as ex:
+          if not self._IsLockError(ex) or attempt >= self.LOCK_RETRY_COUNT:
+            raise
+          self._LockRetryWait(attempt, ex)
+          attempt = attempt + 1
+        else:
+          break
+
+    self._transactionDepth = self._transactionDepth + 1
+    try:
+      yield self
+    except BaseException:
+      self._transactionDepth = self._transactionDepth - 1
+      if self._transactionDepth == 0:
+        goodlogging.Log.Info("DB", "Rolling back database transaction", verbosity=self.logVerbosity)
+        db.rollback()
+        self._tableCache = None
+      raise
+    else:
+      self._transactionDepth = self._transactionDepth - 1
+      if self._transactionDepth == 0:
+        goodlogging.Log.Info("DB", "Committing database transaction", verbosity=self.logVerbosity)
+        db.commit()
+
   ############################################################################
   # _CreateDatabase
   ############################################################################
   def _CreateDatabase(self):
-    """ Create all database tables. """
+    """
+    Create all database tables. Tables which already exist are left
+    unchanged in case another process has created the database first.
+    """
     goodlogging.Log.Info("DB", "Initialising new database", verbosity=self.logVerbosity)
 
-    with sqlite3.connect(self._dbPath) as db:
+    db = self._GetConnection()
+    with self.Transaction(immediate = True):
       # Configuration tables
-      db.execute("CREATE TABLE Config ("
+      db.execute("CREATE TABLE IF NOT EXISTS Config ("
                   "Name TEXT UNIQUE NOT NULL, "
                   "Value TEXT)")
 
-      db.execute("CREATE TABLE IgnoredDir ("
+      db.execute("CREATE TABLE IF NOT EXISTS IgnoredDir ("
                   "DirName TEXT UNIQUE NOT NULL)")
 
-      db.execute("CREATE TABLE SupportedFormat ("
+      db.execute("CREATE TABLE IF NOT EXISTS SupportedFormat ("
                   "FileFormat TEXT UNIQUE NOT NULL)")
 
       # Look-up tables
-      db.execute("CREATE TABLE TVLibrary ("
+      db.execute("CREATE TABLE IF NOT EXISTS TVLibrary ("
                   "ShowID INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT, "
                   "ShowName TEXT UNIQUE NOT NULL, "
                   "ShowDir TEXT UNIQUE)")
 
-      db.execute("CREATE TABLE FileName ("
+      db.execute("CREATE TABLE IF NOT EXISTS FileName ("
                   "FileName TEXT UNIQUE NOT NULL, "
                   "ShowID INTEGER, "
                   "FOREIGN KEY (ShowID) REFERENCES ShowName(ShowID))")
 
-      db.execute("CREATE TABLE SeasonDir ("
+      db.execute("CREATE TABLE IF NOT EXISTS SeasonDir ("
                   "ShowID INTEGER, "
                   "Season INTEGER NOT NULL, "
                   "SeasonDir TEXT NOT NULL, "
                   "FOREIGN KEY (ShowID) REFERENCES ShowName(ShowID),"
                   "CONSTRAINT SeasonDirPK PRIMARY KEY (ShowID,Season))")
 
-      db.commit()
-
     goodlogging.Log.Info("DB", "Database initialisation complete", verbosity=self.logVerbosity)
 
+  ############################################################################
+  # _GetSchemaVersion
+  ############################################################################
+  def _GetSchemaVersion(self):
+    """
+    Get schema version of database.
+
+    Returns
+    ----------
+      int
+        Value of database user_version.
+    """
+    return self._ActionDatabase("PRAGMA user_version")[0][0]
+
+  ############################################################################
+  # _UpgradeDatabase
+  ############################################################################
+  def _UpgradeDatabase(self):
+    """
+    Upgrade database schema to the latest version by applying each
+    migration from the current database version onwards. Each migration
+    and its version change are done in a single transaction so a failed
+    migration leaves the database at the previous version.
+
+    If the database version is newer than the latest known version a
+    fatal error is raised.
+    """
+    latestVersion = len(self._migrationList)
+    dbVersion = self._GetSchemaVersion()
+
+    if dbVersion > latestVersion:
+      goodlogging.Log.Fatal("DB", "Database schema version {0} is newer than supported version {1}".format(dbVersion, latestVersion))
+
+    while dbVersion < latestVersion:
+      with self.Transaction(immediate = True):
+        # Check version again in case another connection has upgraded it
+        dbVersion = self._GetSchemaVersion()
+        if dbVersion < latestVersion:
+          util.LogInfo("DB", "Upgrading database schema from version {0} to {1}", dbVersion, dbVersion+1, verbosity=self.logVerbosity)
+          self._migrationList[dbVersion]()
+          dbVersion = dbVersion + 1
+          self._ActionDatabase("PRAGMA user_version={0}".format(dbVersion))
+
+  ############################################################################
+  # _MigrateToVersion1
+  ############################################################################
+  def _MigrateToVersion1(self):
+    """
+    Schema version 1: add tables to store the source directory scan state.
+    """
+    self._ActionDatabase("CREATE TABLE IF NOT EXISTS ScanRoot ("
+                          "RootDir TEXT NOT NULL PRIMARY KEY, "
+                          "ScanKey TEXT NOT NULL)")
+
+    self._ActionDatabase("CREATE TABLE IF NOT EXISTS ScanDir ("
+                          "RootDir TEXT NOT NULL, "
+                          "DirPath TEXT NOT NULL, "
+                          "ParentDir TEXT, "
+                          "MTime INTEGER NOT NULL, "
+                          "Inode INTEGER NOT NULL, "
+                          "Settled INTEGER NOT NULL, "
+                          "CONSTRAINT ScanDirPK PRIMARY KEY (RootDir,DirPath))")
+
+    self._ActionDatabase("CREATE TABLE IF NOT EXISTS ScanFile ("
+                          "RootDir TEXT NOT NULL, "
+                          "FilePath TEXT NOT NULL, "
+                          "DirPath TEXT NOT NULL, "
+                          "Size INTEGER NOT NULL, "
+                          "MTime INTEGER NOT NULL, "
+                          "State TEXT NOT NULL, "
+                          "CONSTRAINT ScanFilePK PRIMARY KEY (RootDir,FilePath))")
+
+  ############################################################################
+  # _MigrateToVersion2
+  ############################################################################
+  def _MigrateToVersion2(self):
+    """
+    Schema version 2: add tables to store the extraction ledger.
+    """
+    self._ActionDatabase("CREATE TABLE IF NOT EXISTS ExtractArchive ("
+                          "ArchivePath TEXT NOT NULL PRIMARY KEY, "
+                          "VolumeCount INTEGER NOT NULL, "
+                          "Size INTEGER NOT NULL, "
+                          "MTime INTEGER NOT NULL, "
+                          "Complete INTEGER NOT NULL)")
+
+    self._ActionDatabase("CREATE TABLE IF NOT EXISTS ExtractFile ("
+                          "ArchivePath TEXT NOT NULL, "
+                          "MemberName TEXT NOT NULL, "
+                          "FilePath TEXT NOT NULL, "
+                          "CONSTRAINT ExtractFilePK PRIMARY KEY (ArchivePath,MemberName))")
+
   ############################################################################
   # _ActionDatabase
   ############################################################################
-  def _ActionDatabase(self, cmd, args = None, commit = True, error = True):
+  def _ActionDatabase(self, cmd, args = None, commit = True, error = True, many = False):
     """
     Do action on database.
 
@@ -150,33 +485,213 @@ class RenamerDB:
         e.g. cmd="SELECT Value FROM Config WHERE Name=?" args=(fieldName, )
 
       commit : boolean [optional : default = True]
-        If true commit database changes after command is executed.
+        If true commit database changes after command is executed. This is
+        ignored inside a Transaction context, which commits on exit.
 
       error : boolean [optional : default = True]
         If False then any sqlite3.OperationalError exceptions will cause this
         function to return None, otherwise the exception will be raised.
 
+      many : boolean [optional : default = False]
+        If true args is a list of argument tuples and the command is
+        executed once for each tuple (using a single executemany call).
+
     Returns
     ----------
       If a valid result is obtained from the database this will be returned.
       If an error occurs and the error argument is set to False then the
-      return value will be None.
+      return value will be None. An error caused by the database being locked
+      by another connection is retried up to LOCK_RETRY_COUNT times (outside
+      of a transaction) and is always raised if it persists.
     """
-    goodlogging.Log.Info("DB", "Database Command: {0} {1}".format(cmd, args), verbosity=self.logVerbosity)
-    with sqlite3.connect(self._dbPath) as db:
-      try:
-        if args is None:
-          result = db.execute(cmd)
-        else:
-          result = db.execute(cmd, args)
-      except sqlite3.OperationalError:
-        if error is True:
+    util.LogInfo("DB", "Database Command: {0} {1}", cmd, args, verbosity=self.logVerbosity)
+    db = self._GetConnection()
+    if self._queryStats is not None:
+      startTime = time.perf_counter()
+    resultList = None
+    try:
+      attempt = 0
+      while True:
+        try:
+          if args is None:
+            result = db.execute(cmd)
+          elif many is True:
+            result = db.executemany(cmd, args)
+          else:
+            result = db.execute(cmd, args)
+          resultList = result.fetchall()
+          if commit is True and self._transactionDepth == 0:
+            db.commit()
+        except sqlite3.OperationalError as ex:
+          if self._transactionDepth == 0:
+            db.rollback()
+          if self._IsLockError(ex):
+            # A single command can be retried but a command inside a transaction
+            # can not (the transaction must be restarted from the beginning)
+            if self._transactionDepth == 0 and attempt < self.LOCK_RETRY_COUNT:
+              self._LockRetryWait(attempt, ex)
+              attempt = attempt + 1
+              continue
+            raise
+          if error is True:
+            raise
+          return None
+        except BaseException:
+          if self._transactionDepth == 0:
+            db.rollback()
           raise
-        return None
-      else:
-        if commit is True:
-          db.commit()
-        return result.fetchall()
+        else:
+          return resultList
+    finally:
+      if self._queryStats is not None:
+        self._RecordQueryStats(cmd, time.perf_counter() - startTime, resultList)
+
+  ############################################################################
+  # _RecordQueryStats
+  ############################################################################
+  def _RecordQueryStats(self, cmd, seconds, resultList):
+    """
+    Add a database command to the query statistics.
+
+    Parameters
+    ----------
+      cmd : string
+        SQL command (statement template).
+
+      seconds : float
+        Time taken by command (including any retries).
+
+      resultList : list or None
+        Rows returned by command or None if it failed.
+    """
+    queryStats = self._queryStats.setdefault(cmd, {'count': 0, 'seconds': 0.0, 'maxSeconds': 0.0, 'rows': 0})
+    queryStats['count'] = queryStats['count'] + 1
+    queryStats['seconds'] = queryStats['seconds'] + seconds
+    queryStats['maxSeconds'] = max(queryStats['maxSeconds'], seconds)
+    if resultList is not None:
+      queryStats['rows'] = queryStats['rows'] + len(resultList)
+
+  ############################################################################
+  # GetQueryStats
+  ############################################################################
+  def GetQueryStats(self):
+    """
+    Get database query statistics. These are only recorded if the database
+    object was created with profile set.
+
+    Returns
+    ----------
+      dict or None
+        None if profiling is disabled, otherwise a dictionary matching each
+        SQL statement template to a dictionary with the number of calls
+        ('count'), total and maximum time in seconds ('seconds' and
+        'maxSeconds') and the number of rows returned ('rows').
+    """
+    if self._queryStats is None:
+      return None
+    return {cmd: dict(queryStats) for cmd, queryStats in self._queryStats.items()}
+
+  ############################################################################
+  # LogQueryStats
+  ############################################################################
+  def LogQueryStats(self):
+    """ Log summary of database query statistics, slowest statements first. """
+    if self._queryStats is None:
+      return
+
+    totalCount = sum(queryStats['count'] for queryStats in self._queryStats.values())
+    totalSeconds = sum(queryStats['seconds'] for queryStats in self._queryStats.values())
+    goodlogging.Log.Info("DB", "Database queries: {0} call(s), {1:.3f}s total".format(totalCount, totalSeconds))
+    goodlogging.Log.IncreaseIndent()
+    for cmd, queryStats in sorted(self._queryStats.items(), key=lambda item: item[1]['seconds'], reverse=True):
+      goodlogging.Log.Info("DB", "{0} call(s), {1:.3f}s total, {2:.3f}s max, {3} row(s): {4}".format(queryStats['count'], queryStats['seconds'], queryStats['maxSeconds'], queryStats['rows'], cmd))
+    goodlogging.Log.DecreaseIndent()
+
+  ############################################################################
+  # _GetTableCache
+  ############################################################################
+  def _GetTableCache(self):
+    """
+    Get in memory mirror of the TVLibrary, FileName and SeasonDir tables,
+    loading it with one query per table if required. The cache is reloaded
+    if another connection has changed the database since it was loaded.
+
+    Returns
+    ----------
+      dict or None
+        None if table caching is disabled, otherwise a dictionary with keys:
+          'TVLibrary' : dict matching show id to table row
+          'ShowName' : dict matching show name to show id
+          'ShowDir' : dict matching show directory to show id
+          'FileName' : dict matching file name to show id
+          'SeasonDir' : dict matching (show id, season) to season directory
+    """
+    if self._cacheTables is False:
+      return None
+
+    self._CheckTableCacheVersion()
+
+    if self._tableCache is None:
+      goodlogging.Log.Info("DB", "Loading database table cache", verbosity=self.logVerbosity)
+      tableCache = {'TVLibrary': {}, 'ShowName': {}, 'ShowDir': {}, 'FileName': {}, 'SeasonDir': {}}
+      tableCacheVersion = self._ActionDatabase("PRAGMA data_version")[0][0]
+
+      for row in self._ActionDatabase("SELECT ShowID, ShowName, ShowDir FROM TVLibrary ORDER BY ShowID"):
+        tableCache['TVLibrary'][row[0]] = row
+        tableCache['ShowName'][row[1]] = row[0]
+        if row[2] is not None:
+          tableCache['ShowDir'][row[2]] = row[0]
+
+      for fileName, showID in self._ActionDatabase("SELECT FileName, ShowID FROM FileName"):
+        tableCache['FileName'][fileName] = showID
+
+      for showID, seasonNum, seasonDir in self._ActionDatabase("SELECT ShowID, Season, SeasonDir FROM SeasonDir"):
+        tableCache['SeasonDir'][(showID, seasonNum)] = seasonDir
+
+      self._tableCache = tableCache
+      self._tableCacheVersion = tableCacheVersion
+
+    return self._tableCache
+
+  ############################################################################
+  # _CheckTableCacheVersion
+  ############################################################################
+  def _CheckTableCacheVersion(self):
+    """
+    Discard the table cache if another connection has changed the database
+    since it was loaded. The data_version only changes for commits made by
+    other connections so changes written through by this object do not
+    discard the cache.
+    """
+    if self._tableCache is not None:
+      if self._ActionDatabase("PRAGMA data_version")[0][0] != self._tableCacheVersion:
+        goodlogging.Log.Info("DB", "Database changed by another connection - discarding table cache", verbosity=self.logVerbosity)
+        self._tableCache = None
+
+  ############################################################################
+  # _GetIntegerKey
+  ############################################################################
+  def _GetIntegerKey(self, value):
+    """
+    Convert a value to match how it is stored in an INTEGER table column, so
+    cache lookups match the database (e.g. a season number of '01' is
+    stored and matched as 1).
+
+    Parameters
+    ----------
+      value : int or string
+        Value to convert.
+
+    Returns
+    ----------
+      int or string
+        Integer value if the value can be converted, otherwise the
+        unchanged value.
+    """
+    try:
+      return int(value)
+    except (TypeError, ValueError):
+      return value
 
   ############################################################################
   # _PurgeTable
@@ -190,7 +705,8 @@ class RenamerDB:
       tableName : string
         Name of table.
     """
-    goodlogging.Log.Info("DB", "Deleting all entries from table {0}".format(tableName), verbosity=self.logVerbosity)
+    util.LogInfo("DB", "Deleting all entries from table {0}", tableName, verbosity=self.logVerbosity)
+    self._tableCache = None
     self._ActionDatabase("DELETE FROM {0}".format(tableName))
 
   ############################################################################
@@ -219,7 +735,7 @@ class RenamerDB:
     elif len(result) == 0:
       return None
     elif len(result) == 1:
-      goodlogging.Log.Info("DB", "Found database match in config table {0}={1}".format(fieldName, result[0][0]), verbosity=self.logVerbosity)
+      util.LogInfo("DB", "Found database match in config table {0}={1}", fieldName, result[0][0], verbosity=self.logVerbosity)
       return result[0][0]
     elif len(result) > 1:
       goodlogging.Log.Fatal("DB", "Database corrupted - multiple matches found in config table {0}={1}".format(fieldName, result))
@@ -242,23 +758,24 @@ class RenamerDB:
       value : string
         Entry to be inserted or updated in Value column of Config table.
     """
-    currentConfigValue = self.GetConfigValue(fieldName)
+    with self.Transaction(immediate = True):
+      currentConfigValue = self.GetConfigValue(fieldName)
 
-    if currentConfigValue is None:
-      goodlogging.Log.Info("DB", "Adding {0}={1} to database config table".format(fieldName, value), verbosity=self.logVerbosity)
-      self._ActionDatabase("INSERT INTO Config VALUES (?,?)", (fieldName, value))
-    else:
-      goodlogging.Log.Info("DB", "Updating {0} in database config table from {1} to {2}".format(fieldName, currentConfigValue, value), verbosity=self.logVerbosity)
-      self._ActionDatabase("UPDATE Config SET Value=? WHERE Name=?", (value, fieldName))
+      if currentConfigValue is None:
+        util.LogInfo("DB", "Adding {0}={1} to database config table", fieldName, value, verbosity=self.logVerbosity)
+        self._ActionDatabase("INSERT INTO Config VALUES (?,?)", (fieldName, value))
+      else:
+        util.LogInfo("DB", "Updating {0} in database config table from {1} to {2}", fieldName, currentConfigValue, value, verbosity=self.logVerbosity)
+        self._ActionDatabase("UPDATE Config SET Value=? WHERE Name=?", (value, fieldName))
 
   ############################################################################
   # _AddToSingleColumnTable
   ############################################################################
   def _AddToSingleColumnTable(self, tableName, columnHeading, newValue):
     """
-    Add an entry to a table containing a single column. Checks existing
-    table entries to avoid duplicate entries if the given value already
-    exists in the table.
+    Add an entry to a table containing a single column. The value is
+    ignored if it already exists in the table (this relies on the UNIQUE
+    constraint of the column).
 
     Parameters
     ----------
@@ -271,19 +788,59 @@ class RenamerDB:
       newValue : string
         New value to add to table.
     """
-    match = None
-    currentTable = self._GetFromSingleColumnTable(tableName)
+    with self.Transaction(immediate = True):
+      self._ActionDatabase("INSERT OR IGNORE INTO {0} ({1}) VALUES (?)".format(tableName, columnHeading), (newValue, ))
 
-    if currentTable is not None:
-      for currentValue in currentTable:
-        if currentValue == newValue:
-          match = True
+      if self._ActionDatabase("SELECT changes()")[0][0] > 0:
+        util.LogInfo("DB", "Added {0} to {1} table", newValue, tableName, verbosity=self.logVerbosity)
+      else:
+        util.LogInfo("DB", "{0} already exists in {1} table", newValue, tableName, verbosity=self.logVerbosity)
 
-    if match is None:
-      goodlogging.Log.Info("DB", "Adding {0} to {1} table".format(newValue, tableName), verbosity=self.logVerbosity)
-      self._ActionDatabase("INSERT INTO {0} VALUES (?)".format(tableName), (newValue, ))
-    else:
-      goodlogging.Log.Info("DB", "{0} already exists in {1} table".format(newValue, tableName), verbosity=self.logVerbosity)
+  ############################################################################
+  # _AddManyToSingleColumnTable
+  ############################################################################
+  def _AddManyToSingleColumnTable(self, tableName, columnHeading, valueList):
+    """
+    Add a list of entries to a table containing a single column with a
+    single statement. Any values which already exist in the table are
+    ignored (this relies on the UNIQUE constraint of the column).
+
+    Parameters
+    ----------
+      tableName : string
+        Name of table to add entries to.
+
+      columnHeading : string
+        Name of column heading.
+
+      valueList : list
+        List of new values to add to table.
+    """
+    util.LogInfo("DB", "Adding {0} to {1} table", valueList, tableName, verbosity=self.logVerbosity)
+    self._ActionDatabase("INSERT OR IGNORE INTO {0} ({1}) VALUES (?)".format(tableName, columnHeading), [(value, ) for value in valueList], many = True)
+
+  ############################################################################
+  # _ReplaceSingleColumnTable
+  ############################################################################
+  def _ReplaceSingleColumnTable(self, tableName, columnHeading, valueList):
+    """
+    Replace all entries of a table containing a single column with a new
+    list of entries. This is done in a single transaction.
+
+    Parameters
+    ----------
+      tableName : string
+        Name of table to replace entries in.
+
+      columnHeading : string
+        Name of column heading.
+
+      valueList : list
+        List of values which the table will contain.
+    """
+    with self.Transaction(immediate = True):
+      self._PurgeTable(tableName)
+      self._AddManyToSingleColumnTable(tableName, columnHeading, valueList)
 
   ############################################################################
   # _GetFromSingleColumnTable
@@ -328,6 +885,36 @@ class RenamerDB:
     newFileFormat = fileFormat.lower()
     self._AddToSingleColumnTable("SupportedFormat", "FileFormat", newFileFormat)
 
+  ############################################################################
+  # AddSupportedFormats
+  ############################################################################
+  def AddSupportedFormats(self, formatList):
+    """
+    Add list of entries to SupportedFormat table. Input file formats are
+    forced to be lowercase before they are added.
+
+    Parameters
+    ----------
+      formatList : list
+        List of file formats to add to table.
+    """
+    self._AddManyToSingleColumnTable("SupportedFormat", "FileFormat", [fileFormat.lower() for fileFormat in formatList])
+
+  ############################################################################
+  # SetSupportedFormats
+  ############################################################################
+  def SetSupportedFormats(self, formatList):
+    """
+    Replace all entries in SupportedFormat table. Input file formats are
+    forced to be lowercase before they are added.
+
+    Parameters
+    ----------
+      formatList : list
+        List of file formats which the table will contain.
+    """
+    self._ReplaceSingleColumnTable("SupportedFormat", "FileFormat", [fileFormat.lower() for fileFormat in formatList])
+
   ############################################################################
   # GetSupportedFormats
   ############################################################################
@@ -364,6 +951,34 @@ class RenamerDB:
     """
     self._AddToSingleColumnTable("IgnoredDir", "DirName", ignoredDir)
 
+  ############################################################################
+  # AddIgnoredDirs
+  ############################################################################
+  def AddIgnoredDirs(self, dirList):
+    """
+    Add list of entries to IgnoredDir table.
+
+    Parameters
+    ----------
+      dirList : list
+        List of directory names to add to table.
+    """
+    self._AddManyToSingleColumnTable("IgnoredDir", "DirName", dirList)
+
+  ############################################################################
+  # SetIgnoredDirs
+  ############################################################################
+  def SetIgnoredDirs(self, dirList):
+    """
+    Replace all entries in IgnoredDir table.
+
+    Parameters
+    ----------
+      dirList : list
+        List of directory names which the table will contain.
+    """
+    self._ReplaceSingleColumnTable("IgnoredDir", "DirName", dirList)
+
   ############################################################################
   # GetIgnoredDirs
   ############################################################################
@@ -391,8 +1006,9 @@ class RenamerDB:
   ############################################################################
   def AddShowToTVLibrary(self, showName):
     """
-    Add show to TVLibrary table. If the show already exists in the table
-    a fatal error is raised.
+    Add show to TVLibrary table. If the show already exists in the table,
+    for example if it has just been added by another connection, the
+    existing show id is returned.
 
     Parameters
     ----------
@@ -405,16 +1021,26 @@ class RenamerDB:
         Unique show id generated for show when it is added to the table. Used
         across the database to reference this show.
     """
-    goodlogging.Log.Info("DB", "Adding {0} to TV library".format(showName), verbosity=self.logVerbosity)
-
-    currentShowValues = self.SearchTVLibrary(showName = showName)
-
-    if currentShowValues is None:
-      self._ActionDatabase("INSERT INTO TVLibrary (ShowName) VALUES (?)", (showName, ))
-      showID = self._ActionDatabase("SELECT (ShowID) FROM TVLibrary WHERE ShowName=?", (showName, ))[0][0]
-      return showID
-    else:
-      goodlogging.Log.Fatal("DB", "An entry for {0} already exists in the TV library".format(showName))
+    util.LogInfo("DB", "Adding {0} to TV library", showName, verbosity=self.logVerbosity)
+
+    # Look up the show first so a show which already exists does not use up
+    # an AUTOINCREMENT show id through an ignored insert
+    queryString = "SELECT ShowID, ShowName, ShowDir FROM TVLibrary WHERE ShowName=?"
+    with self.Transaction(immediate = True):
+      result = self._ActionDatabase(queryString, (showName, ))
+      if not result:
+        self._ActionDatabase("INSERT OR IGNORE INTO TVLibrary (ShowName) VALUES (?)", (showName, ))
+        result = self._ActionDatabase(queryString, (showName, ))
+      else:
+        goodlogging.Log.Info("DB", "An entry for {0} already exists in the TV library".format(showName), verbosity=self.logVerbosity)
+      showRow = result[0]
+      tableCache = self._GetTableCache()
+      if tableCache is not None:
+        tableCache['TVLibrary'][showRow[0]] = showRow
+        tableCache['ShowName'][showName] = showRow[0]
+        if showRow[2] is not None:
+          tableCache['ShowDir'][showRow[2]] = showRow[0]
+      return showRow[0]
 
   ############################################################################
   # UpdateShowDirInTVLibrary
@@ -433,6 +1059,16 @@ class RenamerDB:
     """
     goodlogging.Log.Info("DB", "Updating TV library for ShowID={0}: ShowDir={1}".format(showID, showDir))
     self._ActionDatabase("UPDATE TVLibrary SET ShowDir=? WHERE ShowID=?", (showDir, showID))
+    tableCache = self._GetTableCache()
+    if tableCache is not None:
+      showID = self._GetIntegerKey(showID)
+      if showID in tableCache['TVLibrary']:
+        oldShowDir = tableCache['TVLibrary'][showID][2]
+        if tableCache['ShowDir'].get(oldShowDir) == showID:
+          del tableCache['ShowDir'][oldShowDir]
+        tableCache['TVLibrary'][showID] = (showID, tableCache['TVLibrary'][showID][1], showDir)
+        if showDir is not None:
+          tableCache['ShowDir'][showDir] = showID
 
   ############################################################################
   # SearchTVLibrary
@@ -473,32 +1109,44 @@ class RenamerDB:
       queryTuple = None
       unique = False
     elif showDir is not None:
-      goodlogging.Log.Info("DB", "Looking up from TV library where ShowDir is {0}".format(showDir), verbosity=self.logVerbosity)
+      util.LogInfo("DB", "Looking up from TV library where ShowDir is {0}", showDir, verbosity=self.logVerbosity)
       queryString = "SELECT * FROM TVLibrary WHERE ShowDir=?"
       queryTuple = (showDir, )
     elif showID is not None:
-      goodlogging.Log.Info("DB", "Looking up from TV library where ShowID is {0}".format(showID), verbosity=self.logVerbosity)
+      util.LogInfo("DB", "Looking up from TV library where ShowID is {0}", showID, verbosity=self.logVerbosity)
       queryString = "SELECT * FROM TVLibrary WHERE ShowID=?"
       queryTuple = (showID, )
     elif showName is not None:
-      goodlogging.Log.Info("DB", "Looking up from TV library where ShowName is {0}".format(showName), verbosity=self.logVerbosity)
+      util.LogInfo("DB", "Looking up from TV library where ShowName is {0}", showName, verbosity=self.logVerbosity)
       queryString = "SELECT * FROM TVLibrary WHERE ShowName=?"
       queryTuple = (showName, )
 
-    result = self._ActionDatabase(queryString, queryTuple, error = False)
+    tableCache = self._GetTableCache()
+    if tableCache is None:
+      result = self._ActionDatabase(queryString, queryTuple, error = False)
+    else:
+      if queryTuple is None:
+        showIDList = sorted(tableCache['TVLibrary'])
+      elif showDir is not None:
+        showIDList = [tableCache['ShowDir'].get(showDir)]
+      elif showID is not None:
+        showIDList = [self._GetIntegerKey(showID)]
+      else:
+        showIDList = [tableCache['ShowName'].get(showName)]
+      result = [tableCache['TVLibrary'][i] for i in showIDList if i in tableCache['TVLibrary']]
 
     if result is None:
       return None
     elif len(result) == 0:
       return None
     elif len(result) == 1:
-      goodlogging.Log.Info("DB", "Found match in TVLibrary: {0}".format(result), verbosity=self.logVerbosity)
+      util.LogInfo("DB", "Found match in TVLibrary: {0}", result, verbosity=self.logVerbosity)
       return result
     elif len(result) > 1:
       if unique is True:
         goodlogging.Log.Fatal("DB", "Database corrupted - multiple matches found in TV Library: {0}".format(result))
       else:
-        goodlogging.Log.Info("DB", "Found multiple matches in TVLibrary: {0}".format(result), verbosity=self.logVerbosity)
+        util.LogInfo("DB", "Found multiple matches in TVLibrary: {0}", result, verbosity=self.logVerbosity)
         return result
 
   ############################################################################
@@ -521,20 +1169,26 @@ class RenamerDB:
         If a match is found in the database table the show id for this
         entry is returned, otherwise this returns None.
     """
-    goodlogging.Log.Info("DB", "Looking up filename string '{0}' in database".format(fileName), verbosity=self.logVerbosity)
+    util.LogInfo("DB", "Looking up filename string '{0}' in database", fileName, verbosity=self.logVerbosity)
 
     queryString = "SELECT ShowID FROM FileName WHERE FileName=?"
     queryTuple = (fileName, )
 
-    result = self._ActionDatabase(queryString, queryTuple, error = False)
+    tableCache = self._GetTableCache()
+    if tableCache is None:
+      result = self._ActionDatabase(queryString, queryTuple, error = False)
+    elif fileName in tableCache['FileName']:
+      result = [(tableCache['FileName'][fileName], )]
+    else:
+      result = []
 
     if result is None:
-      goodlogging.Log.Info("DB", "No match found in database for '{0}'".format(fileName), verbosity=self.logVerbosity)
+      util.LogInfo("DB", "No match found in database for '{0}'", fileName, verbosity=self.logVerbosity)
       return None
     elif len(result) == 0:
       return None
     elif len(result) == 1:
-      goodlogging.Log.Info("DB", "Found file name match: {0}".format(result), verbosity=self.logVerbosity)
+      util.LogInfo("DB", "Found file name match: {0}", result, verbosity=self.logVerbosity)
       return result[0][0]
     elif len(result) > 1:
       goodlogging.Log.Fatal("DB", "Database corrupted - multiple matches found in database table for: {0}".format(result))
@@ -555,14 +1209,18 @@ class RenamerDB:
       showID : int
         Show id.
     """
-    goodlogging.Log.Info("DB", "Adding filename string match '{0}'={1} to database".format(fileName, showID), verbosity=self.logVerbosity)
+    util.LogInfo("DB", "Adding filename string match '{0}'={1} to database", fileName, showID, verbosity=self.logVerbosity)
 
-    currentValues = self.SearchFileNameTable(fileName)
+    with self.Transaction(immediate = True):
+      currentValues = self.SearchFileNameTable(fileName)
 
-    if currentValues is None:
-      self._ActionDatabase("INSERT INTO FileName (FileName, ShowID) VALUES (?,?)", (fileName, showID))
-    else:
-      goodlogging.Log.Fatal("DB", "An entry for '{0}' already exists in the FileName table".format(fileName))
+      if currentValues is None:
+        self._ActionDatabase("INSERT INTO FileName (FileName, ShowID) VALUES (?,?)", (fileName, showID))
+        tableCache = self._GetTableCache()
+        if tableCache is not None:
+          tableCache['FileName'][fileName] = self._GetIntegerKey(showID)
+      else:
+        goodlogging.Log.Fatal("DB", "An entry for '{0}' already exists in the FileName table".format(fileName))
 
   ############################################################################
   # SearchSeasonDirTable
@@ -588,12 +1246,20 @@ class RenamerDB:
         then the season directory name value is returned. If multiple matches
         are found a fatal error is raised.
     """
-    goodlogging.Log.Info("DB", "Looking up directory for ShowID={0} Season={1} in database".format(showID, seasonNum), verbosity=self.logVerbosity)
+    util.LogInfo("DB", "Looking up directory for ShowID={0} Season={1} in database", showID, seasonNum, verbosity=self.logVerbosity)
 
     queryString = "SELECT SeasonDir FROM SeasonDir WHERE ShowID=? AND Season=?"
     queryTuple = (showID, seasonNum)
 
-    result = self._ActionDatabase(queryString, queryTuple, error = False)
+    tableCache = self._GetTableCache()
+    if tableCache is None:
+      result = self._ActionDatabase(queryString, queryTuple, error = False)
+    else:
+      seasonKey = (self._GetIntegerKey(showID), self._GetIntegerKey(seasonNum))
+      if seasonKey in tableCache['SeasonDir']:
+        result = [(tableCache['SeasonDir'][seasonKey], )]
+      else:
+        result = []
 
     if result is None:
       goodlogging.Log.Info("DB", "No match found in database", verbosity=self.logVerbosity)
@@ -601,7 +1267,7 @@ class RenamerDB:
     elif len(result) == 0:
       return None
     elif len(result) == 1:
-      goodlogging.Log.Info("DB", "Found database match: {0}".format(result), verbosity=self.logVerbosity)
+      util.LogInfo("DB", "Found database match: {0}", result, verbosity=self.logVerbosity)
       return result[0][0]
     elif len(result) > 1:
       goodlogging.Log.Fatal("DB", "Database corrupted - multiple matches found in database table for: {0}".format(result))
@@ -626,17 +1292,225 @@ class RenamerDB:
       seasonDir : string
         Season directory name.
     """
-    goodlogging.Log.Info("DB", "Adding season directory ({0}) to database for ShowID={1}, Season={2}".format(seasonDir, showID, seasonNum), verbosity=self.logVerbosity)
+    util.LogInfo("DB", "Adding season directory ({0}) to database for ShowID={1}, Season={2}", seasonDir, showID, seasonNum, verbosity=self.logVerbosity)
 
-    currentValue = self.SearchSeasonDirTable(showID, seasonNum)
+    with self.Transaction(immediate = True):
+      currentValue = self.SearchSeasonDirTable(showID, seasonNum)
 
-    if currentValue is None:
-      self._ActionDatabase("INSERT INTO SeasonDir (ShowID, Season, SeasonDir) VALUES (?,?,?)", (showID, seasonNum, seasonDir))
-    else:
-      if currentValue == seasonDir:
-        goodlogging.Log.Info("DB", "A matching entry already exists in the SeasonDir table", verbosity=self.logVerbosity)
+      if currentValue is None:
+        self._ActionDatabase("INSERT INTO SeasonDir (ShowID, Season, SeasonDir) VALUES (?,?,?)", (showID, seasonNum, seasonDir))
+        tableCache = self._GetTableCache()
+        if tableCache is not None:
+          tableCache['SeasonDir'][(self._GetIntegerKey(showID), self._GetIntegerKey(seasonNum))] = seasonDir
+      else:
+        if currentValue == seasonDir:
+          goodlogging.Log.Info("DB", "A matching entry already exists in the SeasonDir table", verbosity=self.logVerbosity)
+        else:
+          goodlogging.Log.Fatal("DB", "A different entry already exists in the SeasonDir table")
+
+  ############################################################################
+  # GetScanState
+  ############################################################################
+  def GetScanState(self, rootDir, scanKey):
+    """
+    Get the saved scan state for a source directory. If no state has been
+    saved or it was saved with a different scan key (e.g. the supported
+    formats or ignored directories have since changed) no state is returned.
+
+    Parameters
+    ----------
+      rootDir : string
+        Root of source directory.
+
+      scanKey : string
+        Key describing the scan settings the state must match.
+
+    Returns
+    ----------
+      tuple (dict, dict)
+        Directory state dictionary {dirPath: (parentDir, mTime, inode, settled)}
+        and file state dictionary {filePath: (dirPath, size, mTime, state)}.
+        Both are empty if there is no matching saved state.
+    """
+    util.LogInfo("DB", "Looking up scan state for {0} in database", rootDir, verbosity=self.logVerbosity)
+    dirStateDict = {}
+    fileStateDict = {}
+
+    with self.Transaction():
+      result = self._ActionDatabase("SELECT ScanKey FROM ScanRoot WHERE RootDir=?", (rootDir, ))
+
+      if len(result) == 0 or result[0][0] != scanKey:
+        goodlogging.Log.Info("DB", "No matching scan state found in database", verbosity=self.logVerbosity)
       else:
-        goodlogging.Log.Fatal("DB", "A different entry already exists in the SeasonDir table")
+        for row in self._ActionDatabase("SELECT DirPath, ParentDir, MTime, Inode, Settled FROM ScanDir WHERE RootDir=?", (rootDir, )):
+          dirStateDict[row[0]] = (row[1], row[2], row[3], bool(row[4]))
+        for row in self._ActionDatabase("SELECT FilePath, DirPath, Size, MTime, State FROM ScanFile WHERE RootDir=?", (rootDir, )):
+          fileStateDict[row[0]] = tuple(row[1:])
+
+    return (dirStateDict, fileStateDict)
+
+  ############################################################################
+  # SetScanState
+  ############################################################################
+  def SetScanState(self, rootDir, scanKey, dirStateDict, fileStateDict, savedState = None):
+    """
+    Replace the saved scan state for a source directory. This is done in a
+    single transaction and only changes the state for the given directory.
+
+    If the state previously returned by GetScanState is given only rows
+    which have changed since are written, otherwise all rows for the
+    directory are replaced.
+
+    Parameters
+    ----------
+      rootDir : string
+        Root of source directory.
+
+      scanKey : string
+        Key describing the scan settings used.
+
+      dirStateDict : dict
+        Directory state dictionary {dirPath: (parentDir, mTime, inode, settled)}.
+
+      fileStateDict : dict
+        File state dictionary {filePath: (dirPath, size, mTime, state)}.
+
+      savedState : tuple [optional : default = None]
+        Directory and file state dictionaries returned by GetScanState for
+        the same root directory and scan key. If this is None or empty all
+        rows are replaced.
+    """
+    util.LogInfo("DB", "Saving scan state for {0} ({1} directories, {2} files) to database", rootDir, len(dirStateDict), len(fileStateDict), verbosity=self.logVerbosity)
+
+    if savedState is None or len(savedState[0]) == 0:
+      savedDirStateDict, savedFileStateDict = None, None
+    else:
+      savedDirStateDict, savedFileStateDict = savedState
+
+    with self.Transaction(immediate = True):
+      self._ActionDatabase("INSERT OR REPLACE INTO ScanRoot (RootDir, ScanKey) VALUES (?,?)", (rootDir, scanKey))
+      self._SetScanTableState("ScanDir", "DirPath", ('ParentDir', 'MTime', 'Inode', 'Settled'), rootDir, dirStateDict, savedDirStateDict)
+      self._SetScanTableState("ScanFile", "FilePath", ('DirPath', 'Size', 'MTime', 'State'), rootDir, fileStateDict, savedFileStateDict)
+
+  ############################################################################
+  # _SetScanTableState
+  ############################################################################
+  def _SetScanTableState(self, tableName, pathHeading, columnHeadingList, rootDir, stateDict, savedStateDict):
+    """
+    Write scan state for a source directory to a scan table. Must be called
+    inside a transaction.
+
+    Parameters
+    ----------
+      tableName : string
+        Name of scan table.
+
+      pathHeading : string
+        Name of path column heading.
+
+      columnHeadingList : list
+        Names of state column headings.
+
+      rootDir : string
+        Root of source directory.
+
+      stateDict : dict
+        New state dictionary {path: state}.
+
+      savedStateDict : dict
+        Currently saved state dictionary {path: state} or None to replace
+        all rows.
+    """
+    if savedStateDict is None:
+      self._ActionDatabase("DELETE FROM {0} WHERE RootDir=?".format(tableName), (rootDir, ))
+      changedPathList = list(stateDict)
+    else:
+      deletedRowList = [(rootDir, path) for path in savedStateDict if path not in stateDict]
+      if len(deletedRowList) > 0:
+        self._ActionDatabase("DELETE FROM {0} WHERE RootDir=? AND {1}=?".format(tableName, pathHeading), deletedRowList, many = True)
+      changedPathList = [path for path, state in stateDict.items() if savedStateDict.get(path) != state]
+
+    if len(changedPathList) > 0:
+      cmd = "INSERT OR REPLACE INTO {0} (RootDir, {1}, {2}) VALUES ({3})".format(tableName, pathHeading, ', '.join(columnHeadingList), ','.join(['?']*(len(columnHeadingList)+2)))
+      self._ActionDatabase(cmd, [(rootDir, path) + tuple(stateDict[path]) for path in changedPathList], many = True)
+
+  ############################################################################
+  # GetExtractState
+  ############################################################################
+  def GetExtractState(self, archivePath):
+    """
+    Get the extraction ledger entry for a RAR archive set.
+
+    Parameters
+    ----------
+      archivePath : string
+        Path to first volume of archive set.
+
+    Returns
+    ----------
+      tuple or None
+        None if there is no entry for the archive set, otherwise a tuple
+        of the archive fingerprint (volumeCount, size, mTime), a boolean
+        which is True if extraction was completed and a dictionary
+        {memberName: filePath} of each archive member extracted so far.
+    """
+    util.LogInfo("DB", "Looking up extraction state for {0} in database", archivePath, verbosity=self.logVerbosity)
+    with self.Transaction():
+      result = self._ActionDatabase("SELECT VolumeCount, Size, MTime, Complete FROM ExtractArchive WHERE ArchivePath=?", (archivePath, ))
+
+      if len(result) == 0:
+        return None
+
+      extractedFileDict = {}
+      for row in self._ActionDatabase("SELECT MemberName, FilePath FROM ExtractFile WHERE ArchivePath=?", (archivePath, )):
+        extractedFileDict[row[0]] = row[1]
+
+    return (tuple(result[0][:3]), bool(result[0][3]), extractedFileDict)
+
+  ############################################################################
+  # SetExtractState
+  ############################################################################
+  def SetExtractState(self, archivePath, fingerprint, complete, extractedFileDict):
+    """
+    Replace the extraction ledger entry for a RAR archive set.
+
+    Parameters
+    ----------
+      archivePath : string
+        Path to first volume of archive set.
+
+      fingerprint : tuple
+        Archive fingerprint (volumeCount, size, mTime).
+
+      complete : boolean
+        True if extraction was completed.
+
+      extractedFileDict : dict
+        Dictionary {memberName: filePath} of each archive member extracted.
+    """
+    util.LogInfo("DB", "Saving extraction state for {0} ({1} files extracted) to database", archivePath, len(extractedFileDict), verbosity=self.logVerbosity)
+    with self.Transaction(immediate = True):
+      self._ActionDatabase("INSERT OR REPLACE INTO ExtractArchive (ArchivePath, VolumeCount, Size, MTime, Complete) VALUES (?,?,?,?,?)", (archivePath, ) + tuple(fingerprint) + (int(complete), ))
+      self._ActionDatabase("DELETE FROM ExtractFile WHERE ArchivePath=?", (archivePath, ))
+      if len(extractedFileDict) > 0:
+        self._ActionDatabase("INSERT INTO ExtractFile (ArchivePath, MemberName, FilePath) VALUES (?,?,?)", [(archivePath, memberName, filePath) for memberName, filePath in extractedFileDict.items()], many = True)
+
+  ############################################################################
+  # DeleteExtractState
+  ############################################################################
+  def DeleteExtractState(self, archivePath):
+    """
+    Remove the extraction ledger entry for a RAR archive set (if any).
+
+    Parameters
+    ----------
+      archivePath : string
+        Path to first volume of archive set.
+    """
+    util.LogInfo("DB", "Removing extraction state for {0} from database", archivePath, verbosity=self.logVerbosity)
+    with self.Transaction(immediate = True):
+      self._ActionDatabase("DELETE FROM ExtractArchive WHERE ArchivePath=?", (archivePath, ))
+      self._ActionDatabase("DELETE FROM ExtractFile WHERE ArchivePath=?", (archivePath, ))
 
   ############################################################################
   # _PrintDatabaseTable
@@ -796,6 +1670,7 @@ class RenamerDB:
       dbQueryParams = [j for i, j in rowSelect]
 
       self._ActionDatabase(dbQuery, dbQueryParams)
+      self._tableCache = None
 
       goodlogging.Log.Info("DB", "Deleted {0} row(s) from database table {0}:".format(rowCount, tableName))
 
@@ -814,6 +1689,7 @@ class RenamerDB:
       dbQueryParams = [j for i, j in rowSelect]
 
       self._ActionDatabase(dbQuery, dbQueryParams)
+      self._tableCache = None
 
       goodlogging.Log.Info("DB", "Added row to database table {0}:".format(tableName))
 
@@ -5,13 +5,21 @@ import os
 import glob
 import csv
 import datetime
+import json
+import time
+import concurrent.futures
 
 # Third-party package imports
+import requests
 import goodlogging
 
 # Local file imports
 import clear.util as util
 
+# Web lookup errors (raised once any retries have failed) which are treated
+# as a failed lookup rather than ending the program
+WEB_LOOKUP_ERRORS = (requests.exceptions.Timeout, requests.exceptions.ConnectionError)
+
 #################################################
 # EPGuidesLookup
 #################################################
@@ -40,6 +48,22 @@ class EPGuidesLookup:
       Parameter used with EPISODE_LOOKUP_URL to
       select specific show to lookup.
 
+    END_DATE_TAG : string
+      Column reference to look up show end date
+      from epguides allshow list.
+
+    EPISODE_CACHE_DIR : string
+      Name of directory (relative to _saveDir) where
+      parsed show info is cached between runs.
+
+    EPISODE_CACHE_TTL : int
+      Default number of hours for which cached show
+      info is reused before it is looked up again.
+
+    PREFETCH_WORKER_COUNT : int
+      Default maximum number of concurrent show info
+      lookups done by PrefetchShowInfo.
+
     logVerbosity : goodlogging.Verbosity type
       Define the logging verbosity for the class.
 
@@ -47,14 +71,29 @@ class EPGuidesLookup:
       Contents of allshows lookup.
 
     _showInfoDict : dict
-      Dictionary matching show ID to csv
-      contents of lookup for specific show.
+      Dictionary matching show ID to a dictionary
+      of episode titles keyed by (season, episode)
+      for that show.
 
     _showTitleList : list
       List of show titles from allshows content.
 
-    _showIDList : list
-      List of show ids from allshows content.
+    _showTitleIndex : tuple
+      Match index of _showTitleList (generated by
+      util.BuildMatchIndex).
+
+    _showIDDict : dict
+      Dictionary matching show title to show id
+      from allshows content.
+
+    _endedShowIDSet : set
+      Set of show ids which have an end date in
+      the allshows content. Cached show info for
+      these shows never expires.
+
+    _cacheTTL : int
+      Number of hours for which cached show info is
+      reused. If this is 0 the cache is disabled.
 
     _saveDir : string
       Directory where allshows csv file can be
@@ -65,18 +104,33 @@ class EPGuidesLookup:
   EPISODE_LOOKUP_URL = 'http://epguides.com/common/exportToCSVmaze.asp'
   ID_LOOKUP_TAG = 'TVmaze'
   EP_LOOKUP_TAG = 'maze'
+  END_DATE_TAG = 'end date'
+  EPISODE_CACHE_DIR = '_epguides_cache'
+  EPISODE_CACHE_TTL = 24
+  PREFETCH_WORKER_COUNT = 8
 
   logVerbosity = goodlogging.Verbosity.MINIMAL
 
   #################################################
   # constructor
   #################################################
-  def __init__(self):
-    """ Constructor. Initialise object values. """
+  def __init__(self, cacheTTL = EPISODE_CACHE_TTL):
+    """
+    Constructor. Initialise object values.
+
+    Parameters
+    ----------
+      cacheTTL : int [optional : default = EPISODE_CACHE_TTL]
+        Number of hours for which cached show info is reused before
+        it is looked up again. Set to 0 to disable the cache.
+    """
     self._allShowList = None
     self._showInfoDict = {}
     self._showTitleList = None
-    self._showIDList = None
+    self._showTitleIndex = None
+    self._showIDDict = None
+    self._endedShowIDSet = None
+    self._cacheTTL = cacheTTL
     self._saveDir = os.getcwd()
 
   # *** INTERNAL CLASSES *** #
@@ -85,7 +139,12 @@ class EPGuidesLookup:
   ############################################################################
   def _ParseShowList(self, checkOnly=False):
     """
-    Read self._allShowList as csv file and make list of titles and IDs.
+    Read self._allShowList as csv file and make list of titles and a
+    dictionary matching each title to its ID.
+
+    If a title appears more than once the first ID found is kept. The
+    IDs of any shows with an end date are also recorded and a match index
+    is built over the title list.
 
     Parameters
     ----------
@@ -94,7 +153,9 @@ class EPGuidesLookup:
           headers can be extracted correctly.
     """
     showTitleList = []
-    showIDList = []
+    showIDDict = {}
+    endedShowIDSet = set()
+    endDateIndex = None
 
     csvReader = csv.reader(self._allShowList.splitlines())
     for rowCnt, row in enumerate(csvReader):
@@ -105,17 +166,25 @@ class EPGuidesLookup:
             titleIndex = colCnt
           if column == self.ID_LOOKUP_TAG:
             lookupIndex = colCnt
+          if column == self.END_DATE_TAG:
+            endDateIndex = colCnt
       else:
         try:
-          showTitleList.append(row[titleIndex])
-          showIDList.append(row[lookupIndex])
+          showTitle = row[titleIndex]
+          showID = row[lookupIndex]
         except UnboundLocalError:
           goodlogging.Log.Fatal("EPGUIDE", "Error detected in EPGUIDES allshows csv content")
         else:
           if checkOnly and rowCnt > 1:
             return True
+          showTitleList.append(showTitle)
+          showIDDict.setdefault(showTitle, showID)
+          if endDateIndex is not None and endDateIndex < len(row) and row[endDateIndex].strip() != '':
+            endedShowIDSet.add(showID)
     self._showTitleList = showTitleList
-    self._showIDList = showIDList
+    self._showTitleIndex = util.BuildMatchIndex(showTitleList)
+    self._showIDDict = showIDDict
+    self._endedShowIDSet = endedShowIDSet
     return True
 
   ############################################################################
@@ -144,7 +213,7 @@ class EPGuidesLookup:
       if self._ParseShowList(checkOnly=True):
         # Save to file to avoid multiple url requests in same day
         with open(saveFilePath, 'w') as allShowsFile:
-          goodlogging.Log.Info("EPGUIDE", "Adding new EPGUIDES file: {0}".format(saveFilePath), verbosity=self.logVerbosity)
+          util.LogInfo("EPGUIDE", "Adding new EPGUIDES file: {0}", saveFilePath, verbosity=self.logVerbosity)
           allShowsFile.write(self._allShowList)
 
         # Delete old copies of this file
@@ -152,14 +221,14 @@ class EPGuidesLookup:
         globFilePath = os.path.join(self._saveDir, globPattern)
         for filePath in glob.glob(globFilePath):
           if filePath != saveFilePath:
-            goodlogging.Log.Info("EPGUIDE", "Removing old EPGUIDES file: {0}".format(filePath), verbosity=self.logVerbosity)
+            util.LogInfo("EPGUIDE", "Removing old EPGUIDES file: {0}", filePath, verbosity=self.logVerbosity)
             os.remove(filePath)
 
   ############################################################################
   # _GetTitleAndIDList
   ############################################################################
   def _GetTitleAndIDList(self):
-    """ Get title and id lists from epguides all show info. """
+    """ Get title list and id dictionary from epguides all show info. """
     # Populate self._allShowList if it does not already exist
     if self._allShowList is None:
       self._GetAllShowList()
@@ -174,11 +243,11 @@ class EPGuidesLookup:
       self._GetTitleAndIDList()
 
   ############################################################################
-  # _GetIDList
+  # _GetIDDict
   ############################################################################
-  def _GetIDList(self):
-    """ Generate epguides show id list if it does not already exist. """
-    if self._showIDList is None:
+  def _GetIDDict(self):
+    """ Generate epguides show id dictionary if it does not already exist. """
+    if self._showIDDict is None:
       self._GetTitleAndIDList()
 
   ############################################################################
@@ -188,9 +257,8 @@ class EPGuidesLookup:
     """
     Get epguides show id for a given show name.
 
-    Attempts to match the given show name against a show title in
-    self._showTitleList and, if found, returns the corresponding index
-    in self._showIDList.
+    Looks up the given show name in self._showIDDict and, if found,
+    returns the corresponding show id.
 
     Parameters
     ----------
@@ -202,13 +270,8 @@ class EPGuidesLookup:
       int or None
         If a show id is found this will be returned, otherwise None is returned.
     """
-    self._GetTitleList()
-    self._GetIDList()
-
-    for index, showTitle in enumerate(self._showTitleList):
-      if showName == showTitle:
-        return self._showIDList[index]
-    return None
+    self._GetIDDict()
+    return self._showIDDict.get(showName)
 
   ############################################################################
   # _ExtractDataFromShowHtml
@@ -245,31 +308,29 @@ class EPGuidesLookup:
       raise Exception("Show content not found - check EPGuides html formatting")
 
   ############################################################################
-  # _GetEpisodeName
+  # _ParseShowInfo
   ############################################################################
-  def _GetEpisodeName(self, showID, season, episode):
+  def _ParseShowInfo(self, showData):
     """
-    Get episode name from epguides show info.
+    Parse csv show data into a dictionary of episode titles.
+
+    Rows which don't provide integer season or episode numbers are skipped.
+    If a season and episode combination appears more than once the first
+    title found is kept.
 
     Parameters
     ----------
-      showID : string
-        Identifier matching show in epguides.
-
-      season : int
-        Season number.
-
-      epiosde : int
-        Epiosde number.
+      showData : string
+        Show data in csv format (as returned by _ExtractDataFromShowHtml).
 
     Returns
     ----------
-      int or None
-        If an episode name is found this is returned, otherwise the return
-        value is None.
+      dict
+        Dictionary matching (season, episode) integer tuples to
+        episode titles.
     """
-    # Load data for showID from dictionary
-    showInfo = csv.reader(self._showInfoDict[showID].splitlines())
+    episodeDict = {}
+    showInfo = csv.reader(showData.splitlines())
     for rowCnt, row in enumerate(showInfo):
       if rowCnt == 0:
         # Get header column index
@@ -281,18 +342,172 @@ class EPGuidesLookup:
           if column == 'title':
             titleIndex = colCnt
       else:
-        # Iterate rows until matching season and episode found
         try:
-          int(row[seasonIndex])
-          int(row[episodeIndex])
+          seasonNum = int(row[seasonIndex])
+          episodeNum = int(row[episodeIndex])
         except ValueError:
           # Skip rows which don't provide integer season or episode numbers
           pass
         else:
-          if int(row[seasonIndex]) == int(season) and int(row[episodeIndex]) == int(episode):
-            goodlogging.Log.Info("EPGUIDE", "Episode name is {0}".format(row[titleIndex]), verbosity=self.logVerbosity)
-            return row[titleIndex]
-    return None
+          episodeDict.setdefault((seasonNum, episodeNum), row[titleIndex])
+    return episodeDict
+
+  ############################################################################
+  # _GetShowInfoCachePath
+  ############################################################################
+  def _GetShowInfoCachePath(self, showID):
+    """
+    Get path of cache file for given show id.
+
+    Parameters
+    ----------
+      showID : string
+        Identifier matching show in epguides.
+
+    Returns
+    ----------
+      string
+        Path to show info cache file.
+    """
+    return os.path.join(self._saveDir, self.EPISODE_CACHE_DIR, '{0}.json'.format(showID))
+
+  ############################################################################
+  # _LoadShowInfoCache
+  ############################################################################
+  def _LoadShowInfoCache(self, showID):
+    """
+    Load show info previously saved to the cache by _SaveShowInfoCache.
+
+    Cached show info is ignored if it is older than the cache TTL, unless
+    the show has an end date in the allshows content in which case it is
+    always reused.
+
+    Parameters
+    ----------
+      showID : string
+        Identifier matching show in epguides.
+
+    Returns
+    ----------
+      dict or None
+        Dictionary matching (season, episode) integer tuples to episode
+        titles. If the cache is disabled or no valid cache entry exists
+        this returns None.
+    """
+    if self._cacheTTL == 0:
+      return None
+
+    cachePath = self._GetShowInfoCachePath(showID)
+
+    try:
+      with open(cachePath, 'r') as cacheFile:
+        cacheData = json.load(cacheFile)
+      fetchTime = cacheData['fetched']
+      episodeList = cacheData['episodes']
+    except (OSError, ValueError, KeyError, TypeError):
+      return None
+
+    if self._endedShowIDSet is None or showID not in self._endedShowIDSet:
+      if time.time() - fetchTime > self._cacheTTL * 60 * 60:
+        util.LogInfo("EPGUIDE", "Cached show info has expired: {0}", cachePath, verbosity=self.logVerbosity)
+        return None
+
+    util.LogInfo("EPGUIDE", "Loading cached show info: {0}", cachePath, verbosity=self.logVerbosity)
+    return {(seasonNum, episodeNum): title for seasonNum, episodeNum, title in episodeList}
+
+  ############################################################################
+  # _SaveShowInfoCache
+  ############################################################################
+  def _SaveShowInfoCache(self, showID, episodeDict):
+    """
+    Save parsed show info to the cache along with the current time.
+
+    The cache file is written to a temporary path and then moved into
+    place so a partially written file is never read back.
+
+    Parameters
+    ----------
+      showID : string
+        Identifier matching show in epguides.
+
+      episodeDict : dict
+        Dictionary matching (season, episode) integer tuples to
+        episode titles.
+    """
+    if self._cacheTTL == 0:
+      return
+
+    cachePath = self._GetShowInfoCachePath(showID)
+    tmpPath = '{0}.{1}.tmp'.format(cachePath, os.getpid())
+    cacheData = {'fetched': time.time(),
+                 'episodes': [[seasonNum, episodeNum, title] for (seasonNum, episodeNum), title in episodeDict.items()]}
+
+    try:
+      os.makedirs(os.path.dirname(cachePath), exist_ok=True)
+      with open(tmpPath, 'w') as cacheFile:
+        json.dump(cacheData, cacheFile)
+      os.replace(tmpPath, cachePath)
+    except OSError as ex:
+      util.LogInfo("EPGUIDE", "Unable to save show info cache {0}: {1}", cachePath, ex, verbosity=self.logVerbosity)
+    else:
+      util.LogInfo("EPGUIDE", "Saved show info cache: {0}", cachePath, verbosity=self.logVerbosity)
+
+  ############################################################################
+  # _FetchShowInfo
+  ############################################################################
+  def _FetchShowInfo(self, showID):
+    """
+    Look up show info from epguides, parse it and save it to the cache.
+
+    This does not update self._showInfoDict so it can be safely called
+    from worker threads.
+
+    Parameters
+    ----------
+      showID : string
+        Identifier matching show in epguides.
+
+    Returns
+    ----------
+      dict
+        Dictionary matching (season, episode) integer tuples to
+        episode titles.
+    """
+    urlData = util.WebLookup(self.EPISODE_LOOKUP_URL, {self.EP_LOOKUP_TAG: showID})
+    showData = self._ExtractDataFromShowHtml(urlData)
+    episodeDict = self._ParseShowInfo(showData)
+    self._SaveShowInfoCache(showID, episodeDict)
+    return episodeDict
+
+  ############################################################################
+  # _GetEpisodeName
+  ############################################################################
+  def _GetEpisodeName(self, showID, season, episode):
+    """
+    Get episode name from epguides show info.
+
+    Parameters
+    ----------
+      showID : string
+        Identifier matching show in epguides.
+
+      season : int
+        Season number.
+
+      epiosde : int
+        Epiosde number.
+
+    Returns
+    ----------
+      int or None
+        If an episode name is found this is returned, otherwise the return
+        value is None.
+    """
+    # Load data for showID from dictionary
+    episodeName = self._showInfoDict[showID].get((int(season), int(episode)))
+    if episodeName is not None:
+      util.LogInfo("EPGUIDE", "Episode name is {0}", episodeName, verbosity=self.logVerbosity)
+    return episodeName
 
   # *** EXTERNAL CLASSES *** #
   ############################################################################
@@ -311,14 +526,69 @@ class EPGuidesLookup:
 
     Returns
     ----------
-      string
-        Show name which best matches input string.
+      list
+        Show names which best match input string. This is empty if no
+        match is found or the show title list could not be looked up.
     """
-    goodlogging.Log.Info("EPGUIDES", "Looking up show name match for string '{0}' in guide".format(string), verbosity=self.logVerbosity)
-    self._GetTitleList()
-    showName = util.GetBestMatch(string, self._showTitleList)
+    util.LogInfo("EPGUIDES", "Looking up show name match for string '{0}' in guide", string, verbosity=self.logVerbosity)
+    try:
+      self._GetTitleList()
+    except WEB_LOOKUP_ERRORS as ex:
+      goodlogging.Log.Info("EPGUIDE", "Show title list lookup failed - Exception: {0}".format(ex))
+      return []
+    showName = util.GetBestMatch(string, self._showTitleList, self._showTitleIndex)
     return(showName)
 
+  ############################################################################
+  # PrefetchShowInfo
+  ############################################################################
+  def PrefetchShowInfo(self, showNameList, workerCount = PREFETCH_WORKER_COUNT):
+    """
+    Populate show info for every show in the given list so subsequent
+    calls to EpisodeNameLookUp don't need to wait on a web lookup.
+
+    Shows which already have show info loaded, or which have valid show
+    info in the cache, are not looked up again. All remaining shows are
+    looked up concurrently using a pool of worker threads. Any lookup
+    which fails is skipped here and will be retried by EpisodeNameLookUp.
+
+    Parameters
+    ----------
+      showNameList : list
+        List of show names. Each must match an entry in the epguides
+        title list (this can be achieved by calling ShowNameLookUp first).
+
+      workerCount : int [optional : default = PREFETCH_WORKER_COUNT]
+        Maximum number of concurrent web lookups.
+    """
+    fetchIDList = []
+    try:
+      for showName in showNameList:
+        showID = self._GetShowID(showName)
+        if showID is None or showID in self._showInfoDict or showID in fetchIDList:
+          continue
+        episodeDict = self._LoadShowInfoCache(showID)
+        if episodeDict is None:
+          fetchIDList.append(showID)
+        else:
+          self._showInfoDict[showID] = episodeDict
+    except WEB_LOOKUP_ERRORS as ex:
+      goodlogging.Log.Info("EPGUIDE", "Show title list lookup failed - Exception: {0}".format(ex))
+      return
+
+    if len(fetchIDList) == 0:
+      return
+
+    util.LogInfo("EPGUIDE", "Prefetching info for {0} show(s)", len(fetchIDList), verbosity=self.logVerbosity)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, min(workerCount, len(fetchIDList)))) as executor:
+      futureDict = {executor.submit(self._FetchShowInfo, showID): showID for showID in fetchIDList}
+      for future in concurrent.futures.as_completed(futureDict):
+        showID = futureDict[future]
+        try:
+          self._showInfoDict[showID] = future.result()
+        except Exception as ex:
+          util.LogInfo("EPGUIDE", "Prefetch failed for show ID {0} - Exception: {1}", showID, ex, verbosity=self.logVerbosity)
+
   ############################################################################
   # EpisodeNameLookUp
   ############################################################################
@@ -345,20 +615,25 @@ class EPGuidesLookup:
         If an episode name can be found it is returned, otherwise the return
         value is None.
     """
-    goodlogging.Log.Info("EPGUIDE", "Looking up episode name for {0} S{1}E{2}".format(showName, season, episode), verbosity=self.logVerbosity)
+    util.LogInfo("EPGUIDE", "Looking up episode name for {0} S{1}E{2}", showName, season, episode, verbosity=self.logVerbosity)
     goodlogging.Log.IncreaseIndent()
-    showID = self._GetShowID(showName)
-    if showID is not None:
-      try:
-        self._showInfoDict[showID]
-      except KeyError:
-        goodlogging.Log.Info("EPGUIDE", "Looking up info for new show: {0}(ID:{1})".format(showName, showID), verbosity=self.logVerbosity)
-        urlData = util.WebLookup(self.EPISODE_LOOKUP_URL, {self.EP_LOOKUP_TAG: showID})
-        self._showInfoDict[showID] = self._ExtractDataFromShowHtml(urlData)
+    try:
+      showID = self._GetShowID(showName)
+      if showID is None:
+        return None
+
+      if showID in self._showInfoDict:
+        util.LogInfo("EPGUIDE", "Reusing show info previous obtained for: {0}({1})", showName, showID, verbosity=self.logVerbosity)
       else:
-        goodlogging.Log.Info("EPGUIDE", "Reusing show info previous obtained for: {0}({1})".format(showName, showID), verbosity=self.logVerbosity)
-      finally:
-        episodeName = self._GetEpisodeName(showID, season, episode)
-        goodlogging.Log.DecreaseIndent()
-        return episodeName
-    goodlogging.Log.DecreaseIndent()
+        episodeDict = self._LoadShowInfoCache(showID)
+        if episodeDict is None:
+          util.LogInfo("EPGUIDE", "Looking up info for new show: {0}(ID:{1})", showName, showID, verbosity=self.logVerbosity)
+          episodeDict = self._FetchShowInfo(showID)
+        self._showInfoDict[showID] = episodeDict
+
+      return self._GetEpisodeName(showID, season, episode)
+    except WEB_LOOKUP_ERRORS as ex:
+      goodlogging.Log.Info("EPGUIDE", "Episode name lookup failed for {0} - Exception: {1}".format(showName, ex))
+      return None
+    finally:
+      goodlogging.Log.DecreaseIndent()
@@ -1,10 +1,12 @@
 """ RAR extraction methods """
 
 # Python default package imports
+import concurrent.futures
 import sys
 import os
-import glob
 import re
+import shutil
+import time
 
 # Third-party package imports
 import rarfile
@@ -16,76 +18,84 @@ import clear.util as util
 # Update rarfile variables
 rarfile.PATH_SEP = os.sep
 
+# Compressed archive formats which can be extracted
+COMPRESSED_FORMAT_LIST = ['.rar',]
+
+# Default number of archives to extract at once
+EXTRACT_WORKER_COUNT = 1
+
+# Size of each read when streaming a file out of an archive
+EXTRACT_BUFFER_SIZE = 1024*1024
+
+# Volume of a multi-part RAR archive (e.g. name.part01.rar)
+_MULTIPART_REGEX = re.compile(r'(.+)[.]part([0-9]+)[.]rar$', re.IGNORECASE)
+
 ############################################################################
-# GetCompressedFilesInDir
-# TODO: Add recursive lookup for nested directory tree
+# LogExtractInfo
 ############################################################################
-def GetCompressedFilesInDir(fileDir, fileList, ignoreDirList, supportedFormatList = ['.rar',]):
+def LogExtractInfo(string, logList = None):
   """
-  Get all supported files from given directory folder. Appends to given file list.
+  Log an extraction message, or add it to a list to be logged later. Worker
+  threads use a list so their messages are logged by the main thread without
+  being mixed with the messages of other archives.
 
   Parameters
   ----------
-    fileDir : string
-      File directory to search.
+    string : string
+      Message to log.
 
-    fileList : list
-      List which any file matches will be added to.
-
-    ignoreDirList : list
-      List of directories to ignore in recursive lookup (currently unused).
-
-    supportedFormatList : list [optional : default = ['.rar',]]
-      List of supported file formats to search for.
+    logList : list [optional : default = None]
+      List to add the message to. If None the message is logged at once.
   """
-  goodlogging.Log.Info("EXTRACT", "Parsing file directory: {0}".format(fileDir))
-  if os.path.isdir(fileDir) is True:
-    for globPath in glob.glob(os.path.join(fileDir, '*')):
-      if os.path.splitext(globPath)[1] in supportedFormatList:
-        fileList.append(globPath)
+  if logList is None:
+    goodlogging.Log.Info("EXTRACT", string)
+  else:
+    logList.append(string)
 
 ############################################################################
-# MultipartArchiving
+# GroupArchiveVolumes
 ############################################################################
-def MultipartArchiving(firstPartExtractList, otherPartSkippedList, archiveDir, otherPartFilePath = None):
+def GroupArchiveVolumes(fileList):
   """
-  Archive all parts of multi-part compressed file.
-
-  If file has been extracted (via part1) then move all subsequent parts directly to archive directory.
-  If file has not been extracted then if part >1 add to other part skipped list and only archive
-  when the first part is sent for archiving.
+  Group RAR files into archive sets. All volumes of a multi-part archive
+  (named <base>.partN.rar) are grouped together using a dictionary keyed
+  by base path, any other RAR file is a set on its own.
 
   Parameters
   ----------
-    firstPartExtractList : list
-      File directory to search.
-
-    otherPartSkippedList : list
-      List which any file matches will be added to.
-
-    archiveDir : list
-      List of directories to ignore in recursive lookup (currently unused).
+    fileList : list
+      List of RAR file paths.
 
-    otherPartFilePath : list [optional : default = None]
-      List of supported file formats to search for.
+  Returns
+  ----------
+    list
+      List of (firstVolume, volumeList) tuples in the order each set was
+      first found in fileList. firstVolume is the path of the first volume
+      (or None if the first volume of a multi-part archive is missing) and
+      volumeList is the path of every volume in volume number order.
   """
-  if otherPartFilePath is None:
-    for filePath in list(otherPartSkippedList):
-      MultipartArchiving(firstPartExtractList, otherPartSkippedList, archiveDir, filePath)
-  else:
-    baseFileName = re.findall("(.+?)[.]part.+?rar", otherPartFilePath)[0]
+  volumeDict = {}
+  for filePath in fileList:
+    partMatch = _MULTIPART_REGEX.match(filePath)
+    if partMatch is None:
+      volumeDict.setdefault(filePath, []).append((1, filePath))
+    else:
+      volumeDict.setdefault(partMatch.group(1) + '.part', []).append((int(partMatch.group(2)), filePath))
 
-    if baseFileName in firstPartExtractList:
-      util.ArchiveProcessedFile(otherPartFilePath, archiveDir)
-      if otherPartFilePath in otherPartSkippedList:
-        otherPartSkippedList.remove(otherPartFilePath)
-    elif otherPartFilePath not in otherPartSkippedList:
-      otherPartSkippedList.append(otherPartFilePath)
+  archiveSetList = []
+  for volumeList in volumeDict.values():
+    volumeList.sort()
+    if volumeList[0][0] == 1:
+      firstVolume = volumeList[0][1]
+    else:
+      firstVolume = None
+    archiveSetList.append((firstVolume, [filePath for volumeNumber, filePath in volumeList]))
+  return archiveSetList
 
 ############################################################################
 # DoRarExtraction
 ############################################################################
-def DoRarExtraction(rarArchive, targetFile, dstDir):
+def DoRarExtraction(rarArchive, targetFile, dstDir, logList = None):
   """
   RAR extraction with exception catching
 
@@ -100,6 +110,9 @@ def DoRarExtraction(rarArchive, targetFile, dstDir):
     dstDir : string
       Target directory.
 
+    logList : list [optional : default = None]
+      List to add log messages to (see LogExtractInfo).
+
   Returns
   ----------
     boolean
@@ -108,11 +121,177 @@ def DoRarExtraction(rarArchive, targetFile, dstDir):
   try:
     rarArchive.extract(targetFile, dstDir)
   except BaseException as ex:
-    goodlogging.Log.Info("EXTRACT", "Extract failed - Exception: {0}".format(ex))
+    LogExtractInfo("Extract failed - Exception: {0}".format(ex), logList)
     return False
   else:
     return True
 
+############################################################################
+# GetArchiveFingerprint
+############################################################################
+def GetArchiveFingerprint(volumeList):
+  """
+  Get a fingerprint of an archive set from the size and modification time
+  of its volumes (without opening the archive).
+
+  Parameters
+  ----------
+    volumeList : list
+      Path of every volume in the archive set.
+
+  Returns
+  ----------
+    tuple or None
+      Tuple of (volumeCount, size, mTime) where size is the total size of
+      all volumes and mTime is the latest modification time (in ns), or
+      None if any volume can not be accessed.
+  """
+  size = 0
+  mTime = 0
+  for volumePath in volumeList:
+    try:
+      volumeStat = os.stat(volumePath)
+    except OSError:
+      return None
+    size = size + volumeStat.st_size
+    mTime = max(mTime, volumeStat.st_mtime_ns)
+  return (len(volumeList), size, mTime)
+
+############################################################################
+# ArchiveVolumes
+############################################################################
+def ArchiveVolumes(volumeList, archiveDir):
+  """
+  Move every volume of an archive set to the archive directory.
+
+  Parameters
+  ----------
+    volumeList : list
+      Path of every volume in the archive set.
+
+    archiveDir : string
+      Directory to move RAR files to.
+
+  Returns
+  ----------
+    boolean
+      True if no volume remains at its original path, otherwise False.
+  """
+  for volumePath in volumeList:
+    util.ArchiveProcessedFile(volumePath, archiveDir)
+  return not any(os.path.exists(volumePath) for volumePath in volumeList)
+
+############################################################################
+# DoRarBatchExtraction
+############################################################################
+def DoRarBatchExtraction(rarArchive, targetFileList, dstDir, logList = None):
+  """
+  Extract several files from a RAR archive with a single extraction call
+  (so unrar is only run once and the archive is only read once).
+
+  None of the target files should exist in the target directory beforehand.
+  If extraction fails or is interrupted any file which was extracted is
+  removed, as it may only be partially extracted.
+
+  Parameters
+  ----------
+    rarArchive : RarFile object
+      RarFile object to extract.
+
+    targetFileList : list
+      List of archive members (RarInfo objects) to extract.
+
+    dstDir : string
+      Target directory.
+
+    logList : list [optional : default = None]
+      List to add log messages to (see LogExtractInfo).
+
+  Returns
+  ----------
+    set
+      Set of file names (as given in the archive) of each file which was
+      extracted. Empty if rar extraction failed.
+  """
+  fileExtracted = False
+  try:
+    rarArchive.extractall(dstDir, targetFileList)
+    fileExtracted = True
+  except Exception as ex:
+    LogExtractInfo("Batch extract failed - Exception: {0}".format(ex), logList)
+  finally:
+    # Remove partial files (also if interrupted)
+    if fileExtracted is False:
+      for f in targetFileList:
+        try:
+          os.remove(os.path.join(dstDir, f.filename))
+        except OSError:
+          pass
+
+  if fileExtracted is False:
+    return set()
+  return set(f.filename for f in targetFileList if os.path.isfile(os.path.join(dstDir, f.filename)))
+
+############################################################################
+# StreamRarExtraction
+############################################################################
+def StreamRarExtraction(rarArchive, targetFile, targetPath, logList = None):
+  """
+  Stream a file out of a RAR archive directly to the target path, ignoring
+  any directory structure inside the archive.
+
+  The data is written to a temporary file next to the target which is
+  renamed to the target path once complete, so a partially extracted file
+  is never left at the target path.
+
+  Parameters
+  ----------
+    rarArchive : RarFile object
+      RarFile object to extract from.
+
+    targetFile : RarInfo object
+      Archive member to extract.
+
+    targetPath : string
+      Path to write extracted file to.
+
+    logList : list [optional : default = None]
+      List to add log messages to (see LogExtractInfo).
+
+  Returns
+  ----------
+    boolean
+      False if rar extraction failed, otherwise True.
+  """
+  tempPath = os.path.join(os.path.dirname(targetPath), '.{0}.extract'.format(os.path.basename(targetPath)))
+  fileExtracted = False
+  try:
+    with rarArchive.open(targetFile) as srcFile:
+      with open(tempPath, 'wb') as dstFile:
+        shutil.copyfileobj(srcFile, dstFile, EXTRACT_BUFFER_SIZE)
+    os.replace(tempPath, targetPath)
+    fileExtracted = True
+  except Exception as ex:
+    LogExtractInfo("Extract failed - Exception: {0}".format(ex), logList)
+  finally:
+    # Remove partial file (also if interrupted)
+    if fileExtracted is False:
+      try:
+        os.remove(tempPath)
+      except OSError:
+        pass
+
+  if fileExtracted is False:
+    return False
+
+  # Keep the modification time stored in the archive (as unrar does)
+  try:
+    modTime = time.mktime(tuple(targetFile.date_time) + (0, 0, -1))
+    os.utime(targetPath, (modTime, modTime))
+  except (AttributeError, TypeError, ValueError, OverflowError, OSError):
+    pass
+  return True
+
 ############################################################################
 # GetRarPassword
 ############################################################################
@@ -184,14 +363,156 @@ def CheckPasswordReuse(skipUserInput):
   elif response.lower() == 'a':
     return 2
 
+############################################################################
+# ExtractArchiveFiles
+############################################################################
+def ExtractArchiveFiles(rarArchive, filePath, fileFormatList, extractedFileList = None, extractedFileDict = None, logList = None, cleanupDirList = None):
+  """
+  Extract all files matching the file format list from a RAR archive to the
+  directory containing the archive, ignoring any directory structure inside
+  the archive.
+
+  If more than one file needs extracting they are all extracted with a
+  single call (see DoRarBatchExtraction) and then moved from any directory
+  structure inside the archive to the archive directory. Otherwise, or for
+  any file the batch extraction failed to extract, each file is streamed
+  directly to the archive directory (see StreamRarExtraction). If this fails
+  the file is extracted using its directory structure inside the archive
+  and then moved to the archive directory.
+
+  This does not ask for user input so it can be run in a worker thread. A
+  worker thread should give logList and cleanupDirList so that messages are
+  logged and empty directories are removed by the main thread.
+
+  Any archive member already in extractedFileDict (extracted by a previous
+  run) is skipped without checking for the extracted file, as it may since
+  have been moved by the renamer. Each other member which is extracted (or
+  already exists) is added to extractedFileDict.
+
+  Parameters
+  ----------
+    rarArchive : RarFile object
+      RarFile object to extract (with password set if required).
+
+    filePath : string
+      Path to RAR file.
+
+    fileFormatList : list
+      List of file formats to extract from the RAR archive.
+
+    extractedFileList : list [optional : default = None]
+      List which the path of each extracted file will be added to.
+
+    extractedFileDict : dict [optional : default = None]
+      Dictionary {memberName: filePath} of each archive member extracted.
+
+    logList : list [optional : default = None]
+      List to add log messages to (see LogExtractInfo). If None messages
+      are logged at once.
+
+    cleanupDirList : list [optional : default = None]
+      List to add each directory left by moving an extracted file to. If
+      None the empty directory tree is removed at once.
+
+  Returns
+  ----------
+    boolean
+      True if the last matching file was extracted (or already exists),
+      otherwise False.
+  """
+  dirPath = os.path.dirname(filePath)
+  fileExtracted = False
+
+  memberList = [f for f in rarArchive.infolist() if util.FileExtensionMatch(f.filename, fileFormatList)]
+
+  if extractedFileDict is not None:
+    remainingList = [f for f in memberList if f.filename not in extractedFileDict]
+    if len(remainingList) < len(memberList):
+      LogExtractInfo("Skipping {0} files extracted by a previous run".format(len(memberList) - len(remainingList)), logList)
+      fileExtracted = True
+    memberList = remainingList
+
+  batchExtractedSet = set()
+  if len(memberList) > 1:
+    # Only one file can be moved to each target path
+    pendingDict = {}
+    for f in memberList:
+      if not os.path.isfile(os.path.join(dirPath, os.path.basename(f.filename))) and not os.path.isfile(os.path.join(dirPath, f.filename)):
+        pendingDict.setdefault(os.path.basename(f.filename), f)
+    pendingList = list(pendingDict.values())
+    if len(pendingList) > 1:
+      LogExtractInfo("Extracting {0} files".format(len(pendingList)), logList)
+      batchExtractedSet = DoRarBatchExtraction(rarArchive, pendingList, dirPath, logList)
+
+  for f in memberList:
+    LogExtractInfo("Extracting file: {0}".format(f.filename), logList)
+
+    extractPath = os.path.join(dirPath, f.filename)
+    targetPath = os.path.join(dirPath, os.path.basename(f.filename))
+    targetExists = False
+
+    if f.filename in batchExtractedSet:
+      fileExtracted = True
+    elif os.path.isfile(targetPath):
+      LogExtractInfo("Extraction skipped - file already exists at target: {0}".format(targetPath), logList)
+      fileExtracted = True
+      targetExists = True
+    elif os.path.isfile(extractPath):
+      LogExtractInfo("Extraction skipped - file already exists at extract directory: {0}".format(extractPath), logList)
+      fileExtracted = True
+    else:
+      fileExtracted = StreamRarExtraction(rarArchive, f, targetPath, logList)
+      if fileExtracted is False:
+        LogExtractInfo("Retrying extraction to archive directory structure", logList)
+        fileExtracted = DoRarExtraction(rarArchive, f, dirPath, logList)
+
+    if os.path.isfile(extractPath) and not os.path.isfile(targetPath):
+      os.rename(extractPath, targetPath)
+      if cleanupDirList is None:
+        util.RemoveEmptyDirectoryTree(os.path.dirname(extractPath))
+      else:
+        cleanupDirList.append(os.path.dirname(extractPath))
+
+    if fileExtracted is True and targetExists is False and extractedFileList is not None:
+      extractedFileList.append(targetPath)
+
+    if fileExtracted is True and extractedFileDict is not None:
+      extractedFileDict[f.filename] = targetPath
+
+  return fileExtracted
+
 ############################################################################
 # Extract
 ############################################################################
-def Extract(fileList, fileFormatList, archiveDir, skipUserInput):
+def Extract(fileList, fileFormatList, archiveDir, skipUserInput, extractedFileList = None, workerCount = EXTRACT_WORKER_COUNT, db = None):
   """
   Iterate through given file list and extract all files matching the file
-  format list from each RAR file. After sucessful extraction move RAR files to
-  archive directory.
+  format list from each RAR archive. After sucessful extraction move RAR files
+  to archive directory.
+
+  The files are first grouped into archive sets (see GroupArchiveVolumes) so
+  each multi-part archive is handled as a single unit: only its first volume
+  is opened and all of its volumes are archived once it is extracted. A set
+  without a first volume is skipped.
+
+  Each archive is first opened in turn and any password is requested from
+  the user. The files are then extracted, using up to workerCount archives
+  at once. Worker threads only extract: the messages for each archive are
+  logged and its RAR files archived in this thread as it completes, and
+  directories left empty by moving extracted files are removed once every
+  archive has completed. If this is interrupted any archive not yet started
+  is cancelled and running archives are not waited for.
+
+  The path of every file extracted (or moved from the archive's internal
+  directory to the archive directory) is appended to extractedFileList.
+
+  If a database is given each archive set which is extracted but can not
+  be moved to the archive directory is recorded in its extraction ledger
+  along with the size and modification time of its volumes (see
+  GetArchiveFingerprint). On later runs a set with a matching fingerprint
+  is not opened again: if it was completely extracted only moving it to
+  the archive directory is retried, otherwise extraction resumes from the
+  first archive member which was not extracted.
 
   Parameters
   ----------
@@ -207,6 +528,15 @@ def Extract(fileList, fileFormatList, archiveDir, skipUserInput):
     skipUserInput : boolean
       Set to skip any potential user input (if a single option is available
       it will be selected otherwise the user input will default to take no action).
+
+    extractedFileList : list [optional : default = None]
+      List which the path of each extracted file will be added to.
+
+    workerCount : int [optional : default = EXTRACT_WORKER_COUNT]
+      Maximum number of archives to extract at once.
+
+    db : RenamerDB object [optional : default = None]
+      Database storing the extraction ledger. If None no ledger is used.
   """
   goodlogging.Log.Info("EXTRACT", "Extracting files from compressed archives")
   goodlogging.Log.IncreaseIndent()
@@ -215,26 +545,44 @@ def Extract(fileList, fileFormatList, archiveDir, skipUserInput):
     goodlogging.Log.DecreaseIndent()
     return None
 
-  firstPartExtractList = []
-  otherPartSkippedList = []
+  extractJobList = []
 
   lastPassword = False
   reuseLastPassword = 0
-  for filePath in fileList:
+  for filePath, volumeList in GroupArchiveVolumes(fileList):
+    if filePath is None:
+      goodlogging.Log.Info("EXTRACT", "{0}".format(volumeList[0]))
+      goodlogging.Log.IncreaseIndent()
+      goodlogging.Log.Info("EXTRACT", "Archive skipped - first part of the multi-part RAR archive is missing")
+      goodlogging.Log.DecreaseIndent()
+      continue
+
     goodlogging.Log.Info("EXTRACT", "{0}".format(filePath))
     goodlogging.Log.IncreaseIndent()
+
+    fingerprint = None
+    extractedFileDict = {}
+    if db is not None:
+      fingerprint = GetArchiveFingerprint(volumeList)
+      extractState = db.GetExtractState(filePath)
+      if extractState is not None and extractState[0] == fingerprint:
+        if extractState[1] is True:
+          goodlogging.Log.Info("EXTRACT", "Archive skipped - already extracted by a previous run")
+          if ArchiveVolumes(volumeList, archiveDir):
+            db.DeleteExtractState(filePath)
+          goodlogging.Log.DecreaseIndent()
+          continue
+        extractedFileDict = extractState[2]
+
     try:
       rarArchive = rarfile.RarFile(filePath)
     except ImportError:
       goodlogging.Log.Info("EXTRACT", "Unable to extract - Python needs the rarfile package to be installed (see README for more details)")
     except rarfile.NeedFirstVolume:
       goodlogging.Log.Info("EXTRACT", "File skipped - this is not the first part of the RAR archive")
-      MultipartArchiving(firstPartExtractList, otherPartSkippedList, archiveDir, filePath)
     except BaseException as ex:
       goodlogging.Log.Info("EXTRACT", "Unable to extract - Exception: {0}".format(ex))
     else:
-      dirPath = os.path.dirname(filePath)
-      fileExtracted = False
       rarAuthentication = True
 
       if rarArchive.needs_password():
@@ -253,37 +601,64 @@ def Extract(fileList, fileFormatList, archiveDir, skipUserInput):
             rarAuthentication = False
 
       if rarAuthentication:
-        for f in rarArchive.infolist():
-          if util.FileExtensionMatch(f.filename, fileFormatList):
-            goodlogging.Log.Info("EXTRACT", "Extracting file: {0}".format(f.filename))
-
-            extractPath = os.path.join(dirPath, f.filename)
-            targetPath = os.path.join(dirPath, os.path.basename(f.filename))
-
-            if os.path.isfile(targetPath):
-              goodlogging.Log.Info("EXTRACT", "Extraction skipped - file already exists at target: {0}".format(targetPath))
-              fileExtracted = True
-            elif os.path.isfile(extractPath):
-              goodlogging.Log.Info("EXTRACT", "Extraction skipped - file already exists at extract directory: {0}".format(extractPath))
-              fileExtracted = True
-            else:
-              fileExtracted = DoRarExtraction(rarArchive, f, dirPath)
-
-            if os.path.isfile(extractPath) and not os.path.isfile(targetPath):
-              os.rename(extractPath, targetPath)
-              util.RemoveEmptyDirectoryTree(os.path.dirname(extractPath))
+        extractJobList.append((filePath, volumeList, rarArchive, fingerprint, extractedFileDict))
+    finally:
+      goodlogging.Log.DecreaseIndent()
 
-      if fileExtracted is True:
-        util.ArchiveProcessedFile(filePath, archiveDir)
+  if workerCount > 1 and len(extractJobList) > 1:
+    goodlogging.Log.Info("EXTRACT", "Extracting {0} archives using {1} workers".format(len(extractJobList), workerCount))
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=min(workerCount, len(extractJobList)))
+    futureDict = {}
+    for filePath, volumeList, rarArchive, fingerprint, extractedFileDict in extractJobList:
+      workerFileList, logList, cleanupDirList = [], [], []
+      future = executor.submit(ExtractArchiveFiles, rarArchive, filePath, fileFormatList, workerFileList, extractedFileDict, logList, cleanupDirList)
+      futureDict[future] = (filePath, volumeList, fingerprint, extractedFileDict, workerFileList, logList, cleanupDirList)
+    resultIterator = (futureDict[future][:2] + (future, ) + futureDict[future][2:] for future in concurrent.futures.as_completed(futureDict))
+  else:
+    executor = None
+    resultIterator = ((filePath, volumeList, rarArchive, fingerprint, extractedFileDict, None, None, None) for filePath, volumeList, rarArchive, fingerprint, extractedFileDict in extractJobList)
 
+  allCleanupDirList = []
+  try:
+    for filePath, volumeList, result, fingerprint, extractedFileDict, workerFileList, logList, cleanupDirList in resultIterator:
+      fileExtracted = False
+      try:
+        goodlogging.Log.Info("EXTRACT", "{0}".format(filePath))
+        goodlogging.Log.IncreaseIndent()
         try:
-          firstPartFileName = re.findall('(.+?)[.]part1[.]rar', filePath)[0]
-        except IndexError:
-          pass
-        else:
-          firstPartExtractList.append(firstPartFileName)
-          MultipartArchiving(firstPartExtractList, otherPartSkippedList, archiveDir)
+          if executor is None:
+            fileExtracted = ExtractArchiveFiles(result, filePath, fileFormatList, extractedFileList, extractedFileDict)
+          else:
+            try:
+              fileExtracted = result.result()
+            except Exception as ex:
+              logList.append("Extract failed - Exception: {0}".format(ex))
+            for logString in logList:
+              goodlogging.Log.Info("EXTRACT", logString)
+            if extractedFileList is not None:
+              extractedFileList.extend(workerFileList)
+            allCleanupDirList.extend(cleanupDirList)
+        finally:
+          goodlogging.Log.DecreaseIndent()
+      finally:
+        # Record progress (even if interrupted) so a later run can resume
+        if fingerprint is not None and (fileExtracted is True or len(extractedFileDict) > 0):
+          db.SetExtractState(filePath, fingerprint, fileExtracted, extractedFileDict)
+
+      if fileExtracted is True and ArchiveVolumes(volumeList, archiveDir):
+        if fingerprint is not None:
+          db.DeleteExtractState(filePath)
+  except BaseException:
+    if executor is not None:
+      # Don't start any remaining extractions or wait for running ones
+      executor.shutdown(wait=False, cancel_futures=True)
+    raise
+  else:
+    if executor is not None:
+      executor.shutdown(wait=True)
+  finally:
+    goodlogging.Log.DecreaseIndent()
 
-    finally:
-      goodlogging.Log.DecreaseIndent()
-  goodlogging.Log.DecreaseIndent()
+  # Only remove empty directories once no worker can be extracting into them
+  for dirPath in dict.fromkeys(allCleanupDirList):
+    util.RemoveEmptyDirectoryTree(dirPath)
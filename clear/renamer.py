@@ -53,12 +53,19 @@ class TVRenamer:
 
     _guide : EPGuidesLookup object
       Object for doing lookups from web TV guide.
+
+    _newFileNameDict : dict
+      New FileName table entries {fileName: showID}
+      found during the show lookup stage of a run,
+      which are written once the stage is complete.
+      None outside of this stage (entries are then
+      written immediately).
   """
 
   #################################################
   # constructor
   #################################################
-  def __init__(self, db, tvFileList, archiveDir, guideName = epguides.EPGuidesLookup.GUIDE_NAME, tvDir = None, inPlaceRename = False, forceCopy = False, skipUserInput = False):
+  def __init__(self, db, tvFileList, archiveDir, guideName = epguides.EPGuidesLookup.GUIDE_NAME, tvDir = None, inPlaceRename = False, forceCopy = False, skipUserInput = False, guide = None):
     """
     Constructor. Initialise object values.
 
@@ -91,6 +98,11 @@ class TVRenamer:
         If set skip any user inputs. If a single option
         is available this will be selected otherwise no
         further action will be taken.
+
+      guide : EPGuidesLookup object [optional: default = None]
+        Existing guide object to use (so lookups it has
+        already done are reused). If None a new guide is
+        selected using guideName.
      """
     self._db            = db
     self._fileList      = tvFileList
@@ -99,7 +111,12 @@ class TVRenamer:
     self._forceCopy     = forceCopy
     self._inPlaceRename = inPlaceRename
     self._skipUserInput = skipUserInput
-    self._SetGuide(guideName)
+    self._newFileNameDict = None
+
+    if guide is None:
+      self._SetGuide(guideName)
+    else:
+      self._guide = guide
 
   # *** INTERNAL CLASSES *** #
   ############################################################################
@@ -144,6 +161,69 @@ class TVRenamer:
     showNameList = [tvFile.fileInfo.showName for tvFile in tvFileList]
     return(set(showNameList))
 
+  ############################################################################
+  # _SearchFileNameTable
+  ############################################################################
+  def _SearchFileNameTable(self, fileName):
+    """
+    Search FileName table for given file name, including any new entries
+    which have not yet been written.
+
+    Parameters
+    ----------
+      fileName : string
+        File name to look up.
+
+    Returns
+    ----------
+      int or None
+        Show id of matching entry or None if no match is found.
+    """
+    if self._newFileNameDict is not None and fileName in self._newFileNameDict:
+      return self._newFileNameDict[fileName]
+    return self._db.SearchFileNameTable(fileName)
+
+  ############################################################################
+  # _AddToFileNameTable
+  ############################################################################
+  def _AddToFileNameTable(self, fileName, showID):
+    """
+    Add entry to FileName table. During the show lookup stage of a run the
+    entry is kept until the stage is complete (see _WriteFileNameTable).
+
+    Parameters
+    ----------
+      fileName : string
+        File name.
+
+      showID : int
+        Show id.
+    """
+    if self._newFileNameDict is None:
+      self._db.AddToFileNameTable(fileName, showID)
+    else:
+      self._newFileNameDict[fileName] = showID
+
+  ############################################################################
+  # _WriteFileNameTable
+  ############################################################################
+  def _WriteFileNameTable(self, fileNameDict):
+    """
+    Write new FileName table entries in a single transaction. Any file name
+    which has since been added by another process is skipped.
+
+    Parameters
+    ----------
+      fileNameDict : dict
+        New FileName table entries {fileName: showID}.
+    """
+    with self._db.Transaction(immediate = True):
+      for fileName, showID in fileNameDict.items():
+        if self._db.SearchFileNameTable(fileName) is None:
+          self._db.AddToFileNameTable(fileName, showID)
+        else:
+          goodlogging.Log.Info("RENAMER", "File name '{0}' has already been added to database".format(fileName))
+
   ############################################################################
   # _GetShowID
   ############################################################################
@@ -179,7 +259,7 @@ class TVRenamer:
 
     goodlogging.Log.IncreaseIndent()
 
-    showInfo.showID = self._db.SearchFileNameTable(stringSearch)
+    showInfo.showID = self._SearchFileNameTable(stringSearch)
 
     if showInfo.showID is None:
       goodlogging.Log.Info("RENAMER", "No show ID match found for '{0}' in database".format(stringSearch))
@@ -243,7 +323,7 @@ class TVRenamer:
         else:
           showInfo.showID = libEntry[0][0]
 
-        self._db.AddToFileNameTable(origStringSearch, showInfo.showID)
+        self._AddToFileNameTable(origStringSearch, showInfo.showID)
 
         goodlogging.Log.DecreaseIndent()
         return showInfo
@@ -256,7 +336,7 @@ class TVRenamer:
     else:
       goodlogging.Log.Info("RENAMER", "Match found: show ID = {0}".format(showInfo.showID))
       if origStringSearch != stringSearch:
-        self._db.AddToFileNameTable(origStringSearch, showInfo.showID)
+        self._AddToFileNameTable(origStringSearch, showInfo.showID)
       goodlogging.Log.DecreaseIndent()
       return showInfo
 
@@ -596,6 +676,7 @@ class TVRenamer:
     if showDir is None:
       goodlogging.Log.Info("RENAMER", "No directory match found in database - looking for best match in library directory: {0}".format(libraryDir))
       dirList = os.listdir(libraryDir)
+      dirIndex = util.BuildMatchIndex(dirList)
       listDir = False
       matchName = tvFile.showInfo.showName
       while showDir is None:
@@ -606,7 +687,7 @@ class TVRenamer:
           if listDir is True:
             goodlogging.Log.Info("RENAMER", "TV library directory contains: {0}".format(', '.join(dirList)))
           else:
-            matchDirList = util.GetBestMatch(matchName, dirList)
+            matchDirList = util.GetBestMatch(matchName, dirList, dirIndex)
 
           listDir = False
 
@@ -666,10 +747,25 @@ class TVRenamer:
       1) Extract a list of unique show titles from file name and lookup
          actual show names from database or TV guide.
       2) Update each file with showID and showName.
-      3) Get episode name for all remaining files in valid list.
+      3) Prefetch guide info for all shows in valid list and get episode
+         name for all remaining files in valid list.
       4) Print file details and generate new file paths.
       5) Rename files.
       6) List skipped and incompatible files.
+
+    New file name matches found in step 1 are written to the database in a
+    single short transaction once all show names have been looked up (so
+    they are not written if the run is aborted during this step). No
+    transaction is held open during user input or guide lookups, so the
+    database can be used by another process at the same time.
+
+    New TVLibrary entries (step 1) and show and season directories (step 4)
+    are intentionally committed as soon as they are made, so they are kept
+    if the run is aborted. Later lookups in the same run need the new show
+    id or directory straight away and each of these rows is complete on its
+    own: a show with no file name matches is simply matched again on the
+    next run and a directory entry only records a directory which has been
+    chosen or created in the TV library.
     """
     # ------------------------------------------------------------------------
     # Get list of unique fileInfo show names and find matching actual show
@@ -680,9 +776,19 @@ class TVRenamer:
     if len(uniqueFileShowList) > 0:
       goodlogging.Log.Seperator()
 
-    for fileShowName in uniqueFileShowList:
-      showNameMatchDict[fileShowName] = self._GetShowInfo(fileShowName)
-      goodlogging.Log.NewLine()
+    self._newFileNameDict = {}
+    try:
+      for fileShowName in uniqueFileShowList:
+        showNameMatchDict[fileShowName] = self._GetShowInfo(fileShowName)
+        goodlogging.Log.NewLine()
+      newFileNameDict = self._newFileNameDict
+    finally:
+      self._newFileNameDict = None
+
+    # Shows added to the TV library above are already committed - only the
+    # file name matches are held back until every show has been looked up
+    if len(newFileNameDict) > 0:
+      self._WriteFileNameTable(newFileNameDict)
 
     # ------------------------------------------------------------------------
     # Update each file with showID and showName
@@ -708,6 +814,9 @@ class TVRenamer:
 
     goodlogging.Log.Info("RENAMER", "Looking up episode names:\n")
 
+    if len(validShowFileList) > 0:
+      self._guide.PrefetchShowInfo(set(tvFile.showInfo.showName for tvFile in validShowFileList))
+
     for tvFile in validShowFileList:
       tvFile.showInfo.episodeName = self._guide.EpisodeNameLookUp(tvFile.showInfo.showName, tvFile.showInfo.seasonNum, tvFile.showInfo.episodeNum)
 
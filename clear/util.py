@@ -1,16 +1,36 @@
 """ Utility functions """
 
 # Python default package imports
+import collections
 import difflib
 import os
 import re
 import sys
 import shutil
+import time
+import threading
 
 # Third-party package imports
 import requests
+import requests.adapters
+from urllib3.util.retry import Retry
 import goodlogging
 
+# Web lookup configuration. These can be updated before the first call to
+# WebLookup (the shared session is created on first use).
+WEB_CONNECT_TIMEOUT = 10
+WEB_READ_TIMEOUT = 60
+WEB_RETRY_COUNT = 3
+WEB_RETRY_BACKOFF = 0.5
+WEB_POOL_SIZE = 10
+
+_webSession = None
+_webLock = threading.Lock()
+_webLookupStats = {'requests': 0, 'bytes': 0, 'seconds': 0.0, 'maxSeconds': 0.0}
+
+# Minimum match value for GetBestMatch to return a match
+MATCH_RATIO_THRESHOLD = 0.8
+
 ############################################################################
 # RemoveEmptyDirectoryTree
 ############################################################################
@@ -68,6 +88,35 @@ def CheckPathExists(path):
     path = "{0}_{1}".format(root, i) + ext
   return path
 
+############################################################################
+# LogInfo
+############################################################################
+def LogInfo(tag, message, *formatArgs, verbosity = goodlogging.Verbosity.ALWAYS):
+  """
+  Log info message with goodlogging.Log.Info. The message is only formatted
+  (using str.format with formatArgs) if its verbosity is at or above the
+  logging threshold, so messages which will not be displayed cost only the
+  verbosity check.
+
+  Parameters
+  ----------
+    tag : string
+      Log tag.
+
+    message : string
+      Message or format string if formatArgs are given.
+
+    formatArgs : positional arguments [optional]
+      Arguments to format into message.
+
+    verbosity : goodlogging.Verbosity [optional : default = ALWAYS]
+      Message verbosity.
+  """
+  if verbosity.value >= goodlogging.Log.verbosityThreshold.value:
+    if formatArgs:
+      message = message.format(*formatArgs)
+    goodlogging.Log.Info(tag, message, verbosity=verbosity)
+
 ############################################################################
 # StripSpecialCharacters
 ############################################################################
@@ -90,7 +139,7 @@ def StripSpecialCharacters(string, stripAll = False):
     string
       Resulting string with special characters removed.
   """
-  goodlogging.Log.Info("UTIL", "Stripping any special characters from {0}".format(string), verbosity=goodlogging.Verbosity.MINIMAL)
+  LogInfo("UTIL", "Stripping any special characters from {0}", string, verbosity=goodlogging.Verbosity.MINIMAL)
   string = string.strip()
   string = re.sub('[&]', 'and', string)
   string = re.sub(r'[@#$%^&*{};:,/<>?\\|`~=+±§£]', '', string)
@@ -100,7 +149,7 @@ def StripSpecialCharacters(string, stripAll = False):
     string = re.sub('[_.-]', '', string)
     string = re.sub('\s', '', string)
 
-  goodlogging.Log.Info("UTIL", "New string is: {0}".format(string), verbosity=goodlogging.Verbosity.MINIMAL)
+  LogInfo("UTIL", "New string is: {0}", string, verbosity=goodlogging.Verbosity.MINIMAL)
   return string
 
 #################################################
@@ -239,10 +288,149 @@ def UserAcceptance(
     if recursiveLookup:
       return response
 
+############################################################################
+# _NormaliseMatchString
+############################################################################
+def _NormaliseMatchString(string):
+  """
+  Convert string to the form used for match comparisons (lowercase with
+  all non-alphanumeric characters removed).
+
+  Parameters
+  ----------
+    string : string
+      String to normalise.
+
+  Returns
+  ----------
+    string
+      Normalised string.
+  """
+  return ''.join(i for i in string.lower() if i.isalnum())
+
+############################################################################
+# BuildMatchIndex
+############################################################################
+def BuildMatchIndex(matchList):
+  """
+  Build a match index over every element of matchList. This holds the
+  normalised form of each element along with a bigram index of these
+  normalised strings. It can be passed to GetBestMatch or
+  GetMatchCandidates to avoid normalising matchList again and to quickly
+  reduce matchList to the elements which could be returned by GetBestMatch.
+
+  Parameters
+  ----------
+    matchList : list
+      List of strings to index.
+
+  Returns
+  ----------
+    tuple
+      Index in the form (gramDict, normList, shortIndexList) where gramDict
+      matches each bigram to a list of matchList indexes (repeated once per
+      occurrence), normList gives the normalised form of each element
+      and shortIndexList lists the indexes of elements with a normalised
+      length of 1 or 2.
+  """
+  gramDict = {}
+  normList = []
+  shortIndexList = []
+
+  for index, item in enumerate(matchList):
+    normString = _NormaliseMatchString(item)
+    normList.append(normString)
+    if 0 < len(normString) <= 2:
+      shortIndexList.append(index)
+    for i in range(len(normString) - 1):
+      gramDict.setdefault(normString[i:i+2], []).append(index)
+
+  return (gramDict, normList, shortIndexList)
+
+############################################################################
+# _GetMatchCandidateIndexList
+############################################################################
+def _GetMatchCandidateIndexList(normTarget, matchIndex):
+  """
+  Get indexes of the match index elements which could score above
+  MATCH_RATIO_THRESHOLD against the normalised target string.
+
+  A string pair can only score above the threshold if they share more than
+  min(2S/3, (S+L)/5) - 1 bigrams (where S and L are the shorter and longer
+  normalised lengths), either through one long common substring or through
+  the matching blocks behind the full ratio. Elements which fail this bound
+  are dropped, so GetBestMatch gives the same result for the remaining
+  elements as it does for the full list.
+
+  Parameters
+  ----------
+    normTarget : string
+      Normalised target string.
+
+    matchIndex : tuple
+      Match index generated by BuildMatchIndex.
+
+  Returns
+  ----------
+    list
+      Sorted list of candidate indexes.
+  """
+  gramDict, normList, shortIndexList = matchIndex
+  targetLength = len(normTarget)
+
+  if targetLength <= 1:
+    return list(range(len(normList)))
+
+  targetGramCount = collections.Counter(normTarget[i:i+2] for i in range(targetLength - 1))
+  sharedCount = collections.Counter()
+  for gram, count in targetGramCount.items():
+    for index, indexCount in collections.Counter(gramDict.get(gram, ())).items():
+      sharedCount[index] += min(count, indexCount)
+
+  candidateIndexSet = set(sharedCount)
+  candidateIndexSet.update(shortIndexList)
+
+  candidateIndexList = []
+  for index in candidateIndexSet:
+    shortLength = min(targetLength, len(normList[index]))
+    longLength = max(targetLength, len(normList[index]))
+    # Integer form of: shared > min(2S/3, (S+L)/5) - 1
+    if shortLength > 0 and 15*sharedCount[index] > min(10*shortLength, 3*(shortLength + longLength)) - 15:
+      candidateIndexList.append(index)
+
+  return sorted(candidateIndexList)
+
+############################################################################
+# GetMatchCandidates
+############################################################################
+def GetMatchCandidates(target, matchList, matchIndex):
+  """
+  Reduce matchList to the elements which could score above
+  MATCH_RATIO_THRESHOLD against the target string in GetBestMatch.
+
+  Parameters
+  ----------
+    target : string
+      Target string to match.
+
+    matchList : list
+      List of strings to match target against.
+
+    matchIndex : tuple
+      Index of matchList generated by BuildMatchIndex.
+
+  Returns
+  ----------
+    list
+      Candidate elements of matchList in their original order.
+  """
+  candidateIndexList = _GetMatchCandidateIndexList(_NormaliseMatchString(target), matchIndex)
+  return [matchList[index] for index in candidateIndexList]
+
 ############################################################################
 # GetBestMatch
 ############################################################################
-def GetBestMatch(target, matchList):
+def GetBestMatch(target, matchList, matchIndex = None):
   """
   Finds the elements of matchList which best match the target string.
 
@@ -261,6 +449,11 @@ def GetBestMatch(target, matchList):
     matchList : list
       List of strings to match target against.
 
+    matchIndex : tuple [optional: default = None]
+      Index of matchList generated by BuildMatchIndex. If given, the
+      normalised strings from the index are reused and only candidates
+      which can score above the match threshold are compared.
+
   Returns
   ----------
     list
@@ -270,14 +463,19 @@ def GetBestMatch(target, matchList):
   """
   bestMatchList = []
 
-  if len(matchList) > 0:
-    ratioMatch = []
-    for item in matchList:
-      ratioMatch.append(GetBestStringMatchValue(target, item))
+  if matchIndex is None:
+    normMatchList = [_NormaliseMatchString(item) for item in matchList]
+    candidateIndexList = list(range(len(matchList)))
+  else:
+    normMatchList = matchIndex[1]
+    candidateIndexList = _GetMatchCandidateIndexList(_NormaliseMatchString(target), matchIndex)
+
+  if len(candidateIndexList) > 0:
+    ratioMatch = GetBestMatchValueList(target, [normMatchList[index] for index in candidateIndexList], MATCH_RATIO_THRESHOLD)
 
     maxRatio = max(ratioMatch)
-    if maxRatio > 0.8:
-      matchIndexList = [i for i, j in enumerate(ratioMatch) if j == maxRatio]
+    if maxRatio > MATCH_RATIO_THRESHOLD:
+      matchIndexList = [candidateIndexList[i] for i, j in enumerate(ratioMatch) if j == maxRatio]
 
       for index in matchIndexList:
         if maxRatio == 1 and len(matchList[index]) == len(target):
@@ -287,6 +485,163 @@ def GetBestMatch(target, matchList):
 
   return bestMatchList
 
+############################################################################
+# _GetMatcherValue
+############################################################################
+def _GetMatcherValue(match, substringMatch):
+  """
+  Return the best match value from a SequenceMatcher object where the
+  first sequence is no longer than the second sequence.
+
+  Each matching block is an exact copy of part of the shorter string, so
+  comparing the shorter string against a block of size k always gives a
+  ratio of 2k/(S+k). This is calculated directly for the largest block
+  rather than with a new SequenceMatcher per block (unless the shorter
+  string is long enough for difflib's autojunk heuristic to apply).
+
+  Parameters
+  ----------
+    match : difflib.SequenceMatcher
+      Matcher for the (shorter, longer) pair of normalised strings.
+
+    substringMatch : boolean
+      If set also compare the shorter string against every matching block
+      of the longer string.
+
+  Returns
+  ----------
+    int
+      Integer value representing the best match found.
+  """
+  bestRatio = match.ratio()
+
+  if substringMatch:
+    shortLength = len(match.a)
+    if shortLength < 200:
+      blockSize = max(block[2] for block in match.get_matching_blocks())
+      subRatio = 2.0 * blockSize / (shortLength + blockSize)
+      if subRatio > bestRatio:
+        bestRatio = subRatio
+    else:
+      subMatch = difflib.SequenceMatcher(None, match.a)
+      for block in match.get_matching_blocks():
+        subMatch.set_seq2(match.b[block[1]:block[1]+block[2]])
+        subRatio = subMatch.ratio()
+        if subRatio > bestRatio:
+          bestRatio = subRatio
+
+  return bestRatio
+
+############################################################################
+# _GetCommonCharCount
+############################################################################
+def _GetCommonCharCount(charCountDict, string):
+  """
+  Count the characters of string which can be paired with a character
+  from a character count dictionary (each character can only be paired
+  once). This is the same count used by SequenceMatcher.quick_ratio.
+
+  Parameters
+  ----------
+    charCountDict : dict
+      Dictionary matching each character to its count.
+
+    string : string
+      String to compare.
+
+  Returns
+  ----------
+    int
+      Number of common characters.
+  """
+  availDict = {}
+  commonCount = 0
+  for char in string:
+    if char in availDict:
+      availCount = availDict[char]
+    else:
+      availCount = charCountDict.get(char, 0)
+    availDict[char] = availCount - 1
+    if availCount > 0:
+      commonCount = commonCount + 1
+  return commonCount
+
+############################################################################
+# GetBestMatchValueList
+############################################################################
+def GetBestMatchValueList(target, normMatchList, pruneRatio = None):
+  """
+  Return the match value (as given by GetBestStringMatchValue) between the
+  target string and every element of a pre-normalised list.
+
+  The target is normalised once and the matcher holding the target as its
+  second sequence is reused for every shorter list element, so only the
+  comparison itself is repeated for each element.
+
+  If pruneRatio is given, an upper bound of each match value is calculated
+  from the count of common characters (Q) before the full comparison. This
+  is 2Q/(S+Q) where S is the shorter string length (or the quick ratio
+  for equal length strings). Elements whose bound is not above pruneRatio,
+  or is below the best value found so far, are skipped and reported as 0.
+
+  Parameters
+  ----------
+    target : string
+      Target string to match.
+
+    normMatchList : list
+      List of strings already normalised (e.g. the normalised list from
+      BuildMatchIndex).
+
+    pruneRatio : float [optional: default = None]
+      Only values above this are of interest. If None no elements
+      are skipped.
+
+  Returns
+  ----------
+    list
+      Match value for each element of normMatchList.
+  """
+  normTarget = _NormaliseMatchString(target)
+  targetLength = len(normTarget)
+  targetCharCount = collections.Counter(normTarget)
+  bestRatio = 0
+
+  # targetMatcher compares shorter elements against the target,
+  # itemMatcher compares the target against longer or equal elements
+  targetMatcher = difflib.SequenceMatcher(None, '', normTarget)
+  itemMatcher = difflib.SequenceMatcher(None, normTarget, '')
+
+  ratioList = []
+  for normItem in normMatchList:
+    itemLength = len(normItem)
+    if targetLength == 0 or itemLength == 0:
+      ratioList.append(0)
+      continue
+
+    if pruneRatio is not None:
+      commonCount = _GetCommonCharCount(targetCharCount, normItem)
+      if itemLength == targetLength:
+        ratioBound = 2.0 * commonCount / (itemLength + targetLength)
+      else:
+        ratioBound = 2.0 * commonCount / (min(itemLength, targetLength) + commonCount)
+      if ratioBound <= pruneRatio or ratioBound < bestRatio:
+        ratioList.append(0)
+        continue
+
+    if itemLength < targetLength:
+      targetMatcher.set_seq1(normItem)
+      ratio = _GetMatcherValue(targetMatcher, True)
+    else:
+      itemMatcher.set_seq2(normItem)
+      ratio = _GetMatcherValue(itemMatcher, itemLength != targetLength)
+
+    ratioList.append(ratio)
+    if ratio > bestRatio:
+      bestRatio = ratio
+
+  return ratioList
+
 ############################################################################
 # GetBestStringMatchValue
 ############################################################################
@@ -308,20 +663,16 @@ def GetBestStringMatchValue(string1, string2):
       Integer value representing the best match found
       between string1 and string2.
   """
-  # Ignore case
-  string1 = string1.lower()
-  string2 = string2.lower()
-
-  # Ignore non-alphanumeric characters
-  string1 = ''.join(i for i in string1 if i.isalnum())
-  string2 = ''.join(i for i in string2 if i.isalnum())
+  # Ignore case and non-alphanumeric characters
+  string1 = _NormaliseMatchString(string1)
+  string2 = _NormaliseMatchString(string2)
 
   # Finding best match value between string1 and string2
   if len(string1) == 0 or len(string2) == 0:
     bestRatio = 0
   elif len(string1) == len(string2):
     match = difflib.SequenceMatcher(None, string1, string2)
-    bestRatio = match.ratio()
+    bestRatio = _GetMatcherValue(match, False)
   else:
     if len(string1) > len(string2):
       shortString = string2
@@ -331,20 +682,74 @@ def GetBestStringMatchValue(string1, string2):
       longString = string2
 
     match = difflib.SequenceMatcher(None, shortString, longString)
-    bestRatio = match.ratio()
-
-    for block in match.get_matching_blocks():
-      subString = longString[block[1]:block[1]+block[2]]
-      subMatch = difflib.SequenceMatcher(None, shortString, subString)
-      if(subMatch.ratio() > bestRatio):
-        bestRatio = subMatch.ratio()
+    bestRatio = _GetMatcherValue(match, True)
 
   return(bestRatio)
 
+############################################################################
+# _GetWebSession
+############################################################################
+def _GetWebSession():
+  """
+  Get the shared requests session used by WebLookup, creating it on
+  first use.
+
+  The session keeps connections alive between lookups and requests gzip
+  encoded responses. Connection errors, read errors and server error
+  responses are retried up to WEB_RETRY_COUNT times with exponential
+  backoff.
+
+  Returns
+  ----------
+    requests.Session
+      Shared session object.
+  """
+  global _webSession
+  with _webLock:
+    if _webSession is None:
+      retry = Retry(total=WEB_RETRY_COUNT,
+                    backoff_factor=WEB_RETRY_BACKOFF,
+                    status_forcelist=(500, 502, 503, 504))
+      adapter = requests.adapters.HTTPAdapter(pool_connections=WEB_POOL_SIZE,
+                                              pool_maxsize=WEB_POOL_SIZE,
+                                              max_retries=retry)
+      session = requests.Session()
+      session.headers.update({'Accept-Encoding': 'gzip, deflate'})
+      session.mount('http://', adapter)
+      session.mount('https://', adapter)
+      _webSession = session
+    return _webSession
+
+############################################################################
+# GetWebLookupStats
+############################################################################
+def GetWebLookupStats():
+  """
+  Get counters for all web lookups done by WebLookup.
+
+  Returns
+  ----------
+    dict
+      Dictionary containing the number of requests ('requests'), the
+      number of response bytes received ('bytes'), the total time spent
+      on requests in seconds ('seconds') and the longest single request
+      time in seconds ('maxSeconds').
+  """
+  with _webLock:
+    return dict(_webLookupStats)
+
+############################################################################
+# ResetWebLookupStats
+############################################################################
+def ResetWebLookupStats():
+  """ Reset all web lookup counters to zero. """
+  with _webLock:
+    _webLookupStats.update({'requests': 0, 'bytes': 0, 'seconds': 0.0, 'maxSeconds': 0.0})
+
 ############################################################################
 # WebLookup
 ############################################################################
-def WebLookup(url, urlQuery=None, utf8=True):
+def WebLookup(url, urlQuery=None, utf8=True, timeout=None):
   """
   Look up webpage at given url with optional query string
 
@@ -359,15 +764,33 @@ def WebLookup(url, urlQuery=None, utf8=True):
     utf8 : boolean [optional: default = True]
       Set response encoding
 
+    timeout : tuple [optional: default = None]
+      Connect and read timeouts in seconds. If this is None then
+      (WEB_CONNECT_TIMEOUT, WEB_READ_TIMEOUT) is used.
+
   Returns
   ----------
     string
       GET response text
   """
+  if timeout is None:
+    timeout = (WEB_CONNECT_TIMEOUT, WEB_READ_TIMEOUT)
 
-  goodlogging.Log.Info("UTIL", "Looking up info from URL:{0} with QUERY:{1})".format(url, urlQuery), verbosity=goodlogging.Verbosity.MINIMAL)
-  response = requests.get(url, params=urlQuery)
-  goodlogging.Log.Info("UTIL", "Full url: {0}".format(response.url), verbosity=goodlogging.Verbosity.MINIMAL)
+  LogInfo("UTIL", "Looking up info from URL:{0} with QUERY:{1})", url, urlQuery, verbosity=goodlogging.Verbosity.MINIMAL)
+  responseBytes = 0
+  startTime = time.time()
+  try:
+    response = _GetWebSession().get(url, params=urlQuery, timeout=timeout)
+    responseBytes = len(response.content)
+  finally:
+    requestTime = time.time() - startTime
+    with _webLock:
+      _webLookupStats['requests'] += 1
+      _webLookupStats['bytes'] += responseBytes
+      _webLookupStats['seconds'] += requestTime
+      _webLookupStats['maxSeconds'] = max(_webLookupStats['maxSeconds'], requestTime)
+
+  LogInfo("UTIL", "Full url: {0}", response.url, verbosity=goodlogging.Verbosity.MINIMAL)
   if utf8 is True:
     response.encoding = 'utf-8'
   if(response.status_code == requests.codes.ok):
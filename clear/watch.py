@@ -0,0 +1,283 @@
+""" Source directory watching """
+
+# Python default package imports
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import time
+
+# Third-party package imports
+import goodlogging
+
+# inotify event flags (see inotify(7))
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+
+_INOTIFY_EVENT_HEADER = struct.Struct('iIII')
+
+#################################################
+# InotifyWatcher
+#################################################
+class InotifyWatcher:
+  """
+  Directory watcher using the Linux inotify interface (through ctypes so
+  no extra package is needed).
+
+  Each directory to watch must be added with WatchDirs. Creating, deleting
+  or moving a file or directory, or closing a file after writing to it,
+  in a watched directory counts as a change.
+
+  Attributes
+  ----------
+    _libc : ctypes.CDLL
+      C library providing the inotify functions.
+
+    _fd : int
+      inotify file descriptor.
+
+    _watchDict : dict
+      Dictionary matching each watched directory path
+      to its watch descriptor.
+  """
+  WATCH_MASK = IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+
+  #################################################
+  # constructor
+  #################################################
+  def __init__(self):
+    """
+    Constructor. Initialise inotify.
+
+    Raises
+    ----------
+      OSError
+        If inotify is not available on this system.
+    """
+    libcName = ctypes.util.find_library('c')
+    if libcName is None:
+      raise OSError(errno.ENOSYS, "C library not found")
+
+    self._libc = ctypes.CDLL(libcName, use_errno=True)
+    try:
+      self._libc.inotify_init1
+      self._libc.inotify_add_watch
+    except AttributeError:
+      raise OSError(errno.ENOSYS, "inotify is not supported")
+
+    self._fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+    if self._fd < 0:
+      ex = ctypes.get_errno()
+      raise OSError(ex, os.strerror(ex))
+
+    self._watchDict = {}
+
+  ############################################################################
+  # close
+  ############################################################################
+  def close(self):
+    """ Close inotify file descriptor (removes all watches). """
+    if self._fd is not None:
+      os.close(self._fd)
+      self._fd = None
+      self._watchDict = {}
+
+  ############################################################################
+  # WatchDirs
+  ############################################################################
+  def WatchDirs(self, dirList):
+    """
+    Add a watch for each directory not already watched. Directories which
+    no longer exist are skipped.
+
+    Parameters
+    ----------
+      dirList : list
+        List of directory paths.
+
+    Returns
+    ----------
+      int
+        Number of watches added.
+
+    Raises
+    ----------
+      OSError
+        If the watch limit is reached (ENOSPC) or a watch can not be added
+        for any reason other than the directory not existing.
+    """
+    addCount = 0
+    for dirPath in dirList:
+      if dirPath in self._watchDict:
+        continue
+      wd = self._libc.inotify_add_watch(self._fd, os.fsencode(dirPath), self.WATCH_MASK)
+      if wd < 0:
+        ex = ctypes.get_errno()
+        if ex in (errno.ENOENT, errno.ENOTDIR, errno.EACCES):
+          continue
+        raise OSError(ex, "{0}: {1}".format(os.strerror(ex), dirPath))
+      self._watchDict[dirPath] = wd
+      addCount = addCount + 1
+    return addCount
+
+  ############################################################################
+  # Wait
+  ############################################################################
+  def Wait(self, timeout = None):
+    """
+    Wait for a change in any watched directory.
+
+    Parameters
+    ----------
+      timeout : float [optional : default = None]
+        Maximum number of seconds to wait. If None wait until a change is
+        detected.
+
+    Returns
+    ----------
+      boolean
+        True if a change was detected, False if the timeout expired first.
+    """
+    readList, writeList, errorList = select.select([self._fd], [], [], timeout)
+    if len(readList) == 0:
+      return False
+
+    try:
+      data = os.read(self._fd, 64*1024)
+    except BlockingIOError:
+      return False
+
+    changed = False
+    removedWatchSet = set()
+    offset = 0
+    while offset + _INOTIFY_EVENT_HEADER.size <= len(data):
+      wd, mask, cookie, nameLength = _INOTIFY_EVENT_HEADER.unpack_from(data, offset)
+      offset = offset + _INOTIFY_EVENT_HEADER.size + nameLength
+      if mask & IN_IGNORED:
+        removedWatchSet.add(wd)
+      else:
+        changed = True
+
+    # Forget directories which have been deleted or unmounted so they can
+    # be watched again if they are recreated
+    if len(removedWatchSet) > 0:
+      self._watchDict = {dirPath: wd for dirPath, wd in self._watchDict.items() if wd not in removedWatchSet}
+      changed = True
+
+    return changed
+
+#################################################
+# PollWatcher
+#################################################
+class PollWatcher:
+  """
+  Directory watcher which reports a possible change at a fixed interval.
+  Used where inotify is not available (e.g. on other operating systems or
+  if the inotify watch limit is reached).
+
+  Attributes
+  ----------
+    _pollInterval : float
+      Number of seconds between each poll.
+  """
+
+  #################################################
+  # constructor
+  #################################################
+  def __init__(self, pollInterval):
+    """
+    Constructor. Initialise object values.
+
+    Parameters
+    ----------
+      pollInterval : float
+        Number of seconds between each poll.
+    """
+    self._pollInterval = pollInterval
+
+  ############################################################################
+  # close
+  ############################################################################
+  def close(self):
+    """ Nothing to close. """
+    pass
+
+  ############################################################################
+  # WatchDirs
+  ############################################################################
+  def WatchDirs(self, dirList):
+    """
+    Nothing to do - every poll may be a change.
+
+    Parameters
+    ----------
+      dirList : list
+        List of directory paths.
+
+    Returns
+    ----------
+      int
+        Number of watches added (always 0).
+    """
+    return 0
+
+  ############################################################################
+  # Wait
+  ############################################################################
+  def Wait(self, timeout = None):
+    """
+    Wait for the poll interval (or timeout if this is shorter).
+
+    Parameters
+    ----------
+      timeout : float [optional : default = None]
+        Maximum number of seconds to wait.
+
+    Returns
+    ----------
+      boolean
+        True if the poll interval expired, False if the timeout expired first.
+    """
+    if timeout is not None and timeout < self._pollInterval:
+      time.sleep(timeout)
+      return False
+    time.sleep(self._pollInterval)
+    return True
+
+############################################################################
+# GetWatcher
+############################################################################
+def GetWatcher(pollInterval):
+  """
+  Get a directory watcher, using inotify if it is available otherwise
+  falling back to polling.
+
+  Parameters
+  ----------
+    pollInterval : float
+      Number of seconds between each poll if polling is used.
+
+  Returns
+  ----------
+    InotifyWatcher or PollWatcher
+      Directory watcher.
+  """
+  try:
+    watcher = InotifyWatcher()
+  except OSError as ex:
+    goodlogging.Log.Info("WATCH", "inotify not available ({0}) - polling every {1}s".format(ex, pollInterval))
+    return PollWatcher(pollInterval)
+  else:
+    goodlogging.Log.Info("WATCH", "Using inotify to watch for changes")
+    return watcher
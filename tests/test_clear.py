@@ -3,20 +3,283 @@
 Testbench for clear.clear
 
 '''
+import os
+import time
+import goodlogging
 import unittest
+import unittest.mock as mock
 
 import clear.clear
+import clear.database
+
+import test_lib
 
 class Clear(unittest.TestCase):
   # Set up test infrastructure
   @classmethod
   def setUpClass(cls):
-    pass
+    # Silence all logging messages
+    goodlogging.Log.silenceAll = True
 
   # Tear down test infrastructure
   @classmethod
   def tearDownClass(cls):
     pass
 
+  #################################################
+  # Test _WalkSourceDir method
+  #################################################
+  def test_clear_WalkSourceDir(self):
+    rootDir = test_lib.GenerateRandomPath(os.path.join(test_lib.GetBaseDir(), 'test_walk'))
+    self.addCleanup(test_lib.DeleteTestPath, rootDir)
+
+    fileList = [os.path.join('a', 'file1.mkv'),
+                os.path.join('a', 'b', 'c', 'file2.avi'),
+                os.path.join('d', '.hidden.mkv'),
+                'file3.txt']
+    ignoredFileList = [os.path.join('IGNORE', 'file4.mkv'),
+                       os.path.join('a', 'IGNORE', 'file5.mkv')]
+
+    for filePath in fileList + ignoredFileList:
+      filePath = os.path.join(rootDir, filePath)
+      os.makedirs(os.path.dirname(filePath), exist_ok=True)
+      open(filePath, 'w').close()
+    os.makedirs(os.path.join(rootDir, 'empty'))
+
+    # Add symbolic links back to root directory (should not be followed)
+    os.symlink(rootDir, os.path.join(rootDir, 'd', 'loop'))
+    os.symlink(rootDir, os.path.join(rootDir, 'd', 'loop2'))
+
+    # Add symbolic link to a real sibling directory listed before it (files
+    # should only be found through the real path)
+    os.symlink(os.path.join(rootDir, 'd'), os.path.join(rootDir, '0link'))
+    os.symlink(os.path.join(rootDir, 'a', 'b'), os.path.join(rootDir, 'd', 'blink'))
+
+    clearManager = clear.clear.ClearManager()
+    walkList = [entry.path for entry in clearManager._WalkSourceDir(rootDir, ['IGNORE'])]
+    expectedList = [os.path.join(rootDir, filePath) for filePath in fileList]
+    self.assertEqual(sorted(walkList), sorted(expectedList))
+
+    # Check non-existent directory yields nothing
+    self.assertEqual(list(clearManager._WalkSourceDir(os.path.join(rootDir, 'invalid'), [])), [])
+
+  #################################################
+  # Test single walk for archives and supported files
+  #################################################
+  def test_clear_GetSourceFilesInDir(self):
+    rootDir = test_lib.GenerateRandomPath(os.path.join(test_lib.GetBaseDir(), 'test_source'))
+    self.addCleanup(test_lib.DeleteTestPath, rootDir)
+
+    archiveList = ['file1.rar', os.path.join('a', 'b', 'file2.part1.rar')]
+    candidateList = ['Show.Name.S01E01.mkv', os.path.join('a', 'Show.Name.S01E02.mkv')]
+    otherList = [os.path.join('a', 'notes.txt'),
+                 os.path.join('IGNORE', 'file3.rar'),
+                 os.path.join('a', 'IGNORE', 'Show.Name.S01E03.mkv')]
+
+    for filePath in archiveList + candidateList + otherList:
+      filePath = os.path.join(rootDir, filePath)
+      os.makedirs(os.path.dirname(filePath), exist_ok=True)
+      open(filePath, 'w').close()
+
+    clearManager = clear.clear.ClearManager()
+    archiveFileList = []
+    candidateFileList = []
+    with mock.patch('os.scandir', wraps=os.scandir) as mock_scandir:
+      clearManager._GetSourceFilesInDir(rootDir, archiveFileList, candidateFileList, ['.mkv'], ['IGNORE'], ['.rar'])
+    self.assertEqual(sorted(archiveFileList), sorted([os.path.join(rootDir, filePath) for filePath in archiveList]))
+    self.assertEqual(sorted(candidateFileList), sorted([os.path.join(rootDir, filePath) for filePath in candidateList]))
+    self.assertEqual(mock_scandir.call_count, 3)
+
+    # Check archives are ignored if no archive formats are given
+    archiveFileList = []
+    candidateFileList = []
+    clearManager._GetSourceFilesInDir(rootDir, archiveFileList, candidateFileList, ['.mkv'], ['IGNORE'])
+    self.assertEqual(archiveFileList, [])
+    self.assertEqual(len(candidateFileList), 2)
+
+  #################################################
+  # Test incremental scan of source directory
+  #################################################
+  def test_clear_IncrementalScan(self):
+    rootDir = test_lib.GenerateRandomPath(os.path.join(test_lib.GetBaseDir(), 'test_scan'))
+    dbPath = rootDir + '.db'
+    self.addCleanup(test_lib.DeleteTestPath, rootDir)
+    for path in (dbPath, dbPath + '-wal', dbPath + '-shm'):
+      self.addCleanup(test_lib.DeleteTestPath, path)
+
+    fileList = [os.path.join('a', 'Show.Name.S01E01.mkv'),
+                os.path.join('a', 'b', 'notes.txt'),
+                os.path.join('c', 'incompatible.mkv')]
+    for filePath in fileList:
+      filePath = os.path.join(rootDir, filePath)
+      os.makedirs(os.path.dirname(filePath), exist_ok=True)
+      open(filePath, 'w').close()
+
+    # Directories modified just before a scan are never settled
+    for dirPath in ('', 'a', os.path.join('a', 'b'), 'c'):
+      os.utime(os.path.join(rootDir, dirPath), (time.time() - 60, time.time() - 60))
+
+    db = clear.database.RenamerDB(dbPath)
+    self.addCleanup(db.close)
+
+    def Scan(fullScan = False, renamedPathList = []):
+      clearManager = clear.clear.ClearManager()
+      clearManager._db = db
+      clearManager._sourceDir = rootDir
+      clearManager._supportedFormatsList = ['.mkv']
+      clearManager._ignoredDirsList = ['IGNORE']
+      clearManager._fullScan = fullScan
+      clearManager._LoadScanState()
+      tvFileList = []
+      with mock.patch('os.scandir', wraps=os.scandir) as mock_scandir:
+        clearManager._GetSupportedFilesInDir(rootDir, tvFileList, clearManager._supportedFormatsList, clearManager._ignoredDirsList)
+      # Renamer result: files which are already at their new path are processed
+      for tvFile in tvFileList:
+        if tvFile.fileInfo.origPath in renamedPathList:
+          tvFile.fileInfo.newPath = tvFile.fileInfo.origPath
+      clearManager._SaveScanState(tvFileList)
+      scanDirList = [os.path.relpath(call[0][0], rootDir) for call in mock_scandir.call_args_list]
+      return (sorted([tvFile.fileInfo.origPath for tvFile in tvFileList]), sorted(scanDirList))
+
+    showFilePath = os.path.join(rootDir, fileList[0])
+
+    # First scan reads every directory
+    self.assertEqual(Scan(), ([showFilePath], ['.', 'a', os.path.join('a', 'b'), 'c']))
+
+    # Unprocessed file is parsed again and only its directory is read
+    self.assertEqual(Scan(renamedPathList = [showFilePath]), ([showFilePath], ['a']))
+
+    # Processed, incompatible and unsupported files are all skipped
+    self.assertEqual(Scan(), ([], []))
+
+    # Only changed directory is read and only new file is parsed
+    newFilePath = os.path.join(rootDir, 'c', 'Show.Name.S01E02.mkv')
+    open(newFilePath, 'w').close()
+    self.assertEqual(Scan(renamedPathList = [newFilePath]), ([newFilePath], ['c']))
+
+    # Directory changed just before the scan is read again
+    self.assertEqual(Scan(), ([], ['c']))
+    os.utime(os.path.join(rootDir, 'c'), (time.time() - 60, time.time() - 60))
+    self.assertEqual(Scan(), ([], ['c']))
+    self.assertEqual(Scan(), ([], []))
+
+    # Directory with mtime equal to the scan start time is not settled
+    scanTime = os.stat(os.path.join(rootDir, 'a')).st_mtime_ns
+    clearManager = clear.clear.ClearManager()
+    clearManager._db = db
+    clearManager._sourceDir = rootDir
+    with mock.patch('clear.clear.time.time_ns', return_value=scanTime):
+      clearManager._LoadScanState()
+    self.assertIs(clearManager._GetScanDirState(os.path.join(rootDir, 'a'), rootDir)[3], False)
+    clearManager._scanStartTime = scanTime + clearManager.SCAN_MTIME_MARGIN * 1000000000 + 1
+    self.assertIs(clearManager._GetScanDirState(os.path.join(rootDir, 'a'), rootDir)[3], True)
+
+    # Full scan ignores saved state
+    self.assertEqual(Scan(fullScan = True), ([showFilePath, newFilePath], ['.', 'a', os.path.join('a', 'b'), 'c']))
+
+  #################################################
+  # Test files still being written are left for a later scan
+  #################################################
+  def test_clear_SettleTime(self):
+    rootDir = test_lib.GenerateRandomPath(os.path.join(test_lib.GetBaseDir(), 'test_settle'))
+    self.addCleanup(test_lib.DeleteTestPath, rootDir)
+
+    oldFileList = ['Show.Name.S01E01.mkv', os.path.join('a', 'file1.part1.rar')]
+    newFileList = [os.path.join('b', 'Show.Name.S01E02.mkv'), os.path.join('a', 'file1.part2.rar')]
+    for filePath in oldFileList + newFileList:
+      filePath = os.path.join(rootDir, filePath)
+      os.makedirs(os.path.dirname(filePath), exist_ok=True)
+      open(filePath, 'w').close()
+    for filePath in oldFileList:
+      os.utime(os.path.join(rootDir, filePath), (0, 0))
+
+    clearManager = clear.clear.ClearManager()
+    clearManager._settleTime = 60
+    archiveFileList = []
+    candidateFileList = []
+    clearManager._GetSourceFilesInDir(rootDir, archiveFileList, candidateFileList, ['.mkv'], [], ['.rar'])
+    self.assertEqual(archiveFileList, [])
+    self.assertEqual(candidateFileList, [os.path.join(rootDir, oldFileList[0])])
+    self.assertEqual(clearManager._deferredFileCount, 2)
+
+  #################################################
+  # Test watch loop
+  #################################################
+  def test_clear_WatchSourceDir(self):
+    clearManager = clear.clear.ClearManager()
+    clearManager._settleTime = 30
+    watcher = mock.MagicMock(spec=clear.clear.watch.PollWatcher)
+    # Change, end of change burst, timeout with no change
+    watcher.Wait.side_effect = [True, True, False, False]
+
+    def ProcessSourceDir():
+      clearManager._deferredFileCount = 1
+      if len(process.call_args_list) == 3:
+        raise KeyboardInterrupt
+
+    with mock.patch.object(clearManager, '_ProcessSourceDir', side_effect=ProcessSourceDir) as process:
+      with mock.patch('clear.watch.GetWatcher', return_value=watcher):
+        clearManager._WatchSourceDir()
+
+    self.assertEqual(process.call_count, 3)
+    self.assertEqual(watcher.Wait.call_args_list, [mock.call(30), mock.call(clearManager.WATCH_QUIET_TIME), mock.call(clearManager.WATCH_QUIET_TIME), mock.call(30)])
+    watcher.close.assert_called_once_with()
+    self.assertIsNone(clearManager._watcher)
+
+  #################################################
+  # Test watch mode continues after a failed scan
+  #################################################
+  def test_clear_WatchSourceDirError(self):
+    clearManager = clear.clear.ClearManager()
+    clearManager._settleTime = 0
+    clearManager._watchPollInterval = 60
+    watcher = mock.MagicMock(spec=clear.clear.watch.PollWatcher)
+    # Timeout with no change after failed scan, then change
+    watcher.Wait.side_effect = [False, True, False]
+
+    def ProcessSourceDir():
+      clearManager._deferredFileCount = 0
+      if len(process.call_args_list) == 1:
+        raise ConnectionError('Test guide lookup error')
+      elif len(process.call_args_list) == 3:
+        raise KeyboardInterrupt
+
+    with mock.patch.object(clearManager, '_ProcessSourceDir', side_effect=ProcessSourceDir) as process:
+      with mock.patch('clear.watch.GetWatcher', return_value=watcher):
+        clearManager._WatchSourceDir()
+
+    # Failed scan is retried after the poll interval, later scans wait for a change
+    self.assertEqual(process.call_count, 3)
+    self.assertEqual(watcher.Wait.call_args_list, [mock.call(60), mock.call(None), mock.call(clearManager.WATCH_QUIET_TIME)])
+    watcher.close.assert_called_once_with()
+
+  #################################################
+  # Test guide cache time to live argument
+  #################################################
+  @mock.patch('clear.epguides.EPGuidesLookup')
+  def test_clear_GetGuide(self, mock_guide):
+    clearManager = clear.clear.ClearManager()
+
+    # Check argument is passed to guide and guide is reused
+    with mock.patch('sys.argv', ['clear', '--epguides_cache_ttl', '2']):
+      clearManager._GetArgs()
+    self.assertEqual(clearManager._guideCacheTTL, 2)
+    guide = clearManager._GetGuide()
+    self.assertIs(clearManager._GetGuide(), guide)
+    mock_guide.assert_called_once_with(cacheTTL = 2)
+
+    # Check a new guide is used each time if the cache is disabled
+    mock_guide.reset_mock()
+    with mock.patch('sys.argv', ['clear', '--epguides_cache_ttl', '0']):
+      clearManager._GetArgs()
+    clearManager._GetGuide()
+    clearManager._GetGuide()
+    self.assertEqual(mock_guide.call_args_list, [mock.call(cacheTTL = 0)]*2)
+
+    # Check negative value is rejected
+    with mock.patch('sys.argv', ['clear', '--epguides_cache_ttl', '-1']):
+      with self.assertRaises(SystemExit):
+        clearManager._GetArgs()
+
 if __name__ == '__main__':
   unittest.main()
@@ -31,8 +31,10 @@ class ClearDatabase(unittest.TestCase):
   #################################################
   @classmethod
   def tearDownClass(cls):
-    # Delete test database
-    test_lib.DeleteTestPath(cls.dbPath)
+    # Close and delete test database
+    cls.db.close()
+    for path in (cls.dbPath, cls.dbPath + '-wal', cls.dbPath + '-shm'):
+      test_lib.DeleteTestPath(path)
 
   #################################################
   # Misc database checks
@@ -56,6 +58,201 @@ class ClearDatabase(unittest.TestCase):
     result = self.db._GetFromSingleColumnTable("INVALID_TABLE")
     self.assertIsNone(result)
 
+  #################################################
+  # Check database connection
+  #################################################
+  def test_db_Connection(self):
+    # Check the same connection is used for every command
+    self.db.GetConfigValue('TestField')
+    connection = self.db._connection
+    self.assertIsNotNone(connection)
+    self.db.GetConfigValue('TestField')
+    self.assertIs(self.db._connection, connection)
+
+    # Check connection settings
+    self.assertEqual(self.db._ActionDatabase("PRAGMA journal_mode")[0][0], 'wal')
+    self.assertEqual(self.db._ActionDatabase("PRAGMA synchronous")[0][0], 1)
+    self.assertEqual(self.db._ActionDatabase("PRAGMA busy_timeout")[0][0], self.db.BUSY_TIMEOUT*1000)
+
+    # Close connection and check it reopens on next command
+    self.db.close()
+    self.assertIsNone(self.db._connection)
+    self.assertIsNone(self.db.GetConfigValue('TestField'))
+    self.assertIsNotNone(self.db._connection)
+
+    # Check context manager closes connection on exit
+    with clear.database.RenamerDB(self.dbPath) as db:
+      self.assertIsNone(db.GetConfigValue('TestField'))
+      self.assertIsNotNone(db._connection)
+    self.assertIsNone(db._connection)
+
+  #################################################
+  # Check database schema migration
+  #################################################
+  def test_db_UpgradeDatabase(self):
+    dbPath = test_lib.GenerateRandomPath(os.path.join(test_lib.GetBaseDir(), 'test_migrate'), '.db')
+    self.addCleanup(test_lib.DeleteTestPath, dbPath)
+
+    # Create original (version 0) database with some existing content
+    with clear.database.RenamerDB(dbPath) as db:
+      baseVersion = db._GetSchemaVersion()
+      self.assertEqual(baseVersion, len(db._migrationList))
+      db._ActionDatabase("PRAGMA user_version=0")
+      db.AddShowToTVLibrary('migrateshow')
+
+    def MigrateAddTable(db):
+      db._ActionDatabase("CREATE TABLE MigrateTest (Value TEXT)")
+
+    def MigrateAddIndex(db):
+      db._ActionDatabase("CREATE INDEX MigrateTestIndex ON MigrateTest (Value)")
+
+    def MigrateFail(db):
+      db._ActionDatabase("INSERT INTO MigrateTest VALUES ('fail')")
+      db._ActionDatabase("INVALID SQL")
+
+    # Check migrations are applied in order and existing content is kept
+    migrationList = [MigrateAddTable, MigrateAddIndex]
+    with mock.patch.object(clear.database.RenamerDB, '_UpgradeDatabase'):
+      db = clear.database.RenamerDB(dbPath)
+    db._migrationList = [lambda migration=migration: migration(db) for migration in migrationList]
+    db._UpgradeDatabase()
+    self.assertEqual(db._GetSchemaVersion(), 2)
+    self.assertEqual(db._ActionDatabase("SELECT name FROM sqlite_master WHERE name LIKE 'MigrateTest%' ORDER BY name"), [('MigrateTest',), ('MigrateTestIndex',)])
+    self.assertEqual(db.SearchTVLibrary(showName='migrateshow')[0][1], 'migrateshow')
+
+    # Check a failed migration leaves the database at the previous version
+    db._migrationList.append(lambda: MigrateFail(db))
+    with self.assertRaises(sqlite3.OperationalError):
+      db._UpgradeDatabase()
+    self.assertEqual(db._GetSchemaVersion(), 2)
+    self.assertEqual(db._ActionDatabase("SELECT * FROM MigrateTest"), [])
+
+    # Check a database newer than the supported version is rejected
+    db._migrationList = []
+    with self.assertRaises(SystemExit):
+      db._UpgradeDatabase()
+    db.close()
+
+  #################################################
+  # Check database transactions
+  #################################################
+  def test_db_Transaction(self):
+    # Check changes are committed when the transaction completes
+    with self.db.Transaction():
+      self.db.SetConfigValue('TransactionField', 'TestValue')
+      with self.db.Transaction():
+        self.db.AddIgnoredDir('transactiondir')
+      self.assertIs(self.db._connection.in_transaction, True)
+    self.assertIs(self.db._connection.in_transaction, False)
+    with clear.database.RenamerDB(self.dbPath) as db:
+      self.assertEqual(db.GetConfigValue('TransactionField'), 'TestValue')
+      self.assertEqual(db.GetIgnoredDirs(), ['transactiondir'])
+
+    # Check all changes are rolled back if the transaction is aborted
+    with self.assertRaises(SystemExit):
+      with self.db.Transaction():
+        self.db.SetConfigValue('TransactionField', 'TestValue2')
+        self.db.PurgeIgnoredDirs()
+        self.db.AddShowToTVLibrary('transactionshow')
+        self.db.AddToFileNameTable('transactionfile', 1)
+        self.db.AddToFileNameTable('transactionfile', 1)
+    self.assertEqual(self.db._transactionDepth, 0)
+    self.assertEqual(self.db.GetConfigValue('TransactionField'), 'TestValue')
+    self.assertEqual(self.db.GetIgnoredDirs(), ['transactiondir'])
+    self.assertIsNone(self.db.SearchTVLibrary())
+
+    # Check a failed command does not roll back the open transaction
+    with self.db.Transaction():
+      self.db.AddIgnoredDir('transactiondir2')
+      self.assertIsNone(self.db._GetFromSingleColumnTable("INVALID_TABLE"))
+    self.assertEqual(self.db.GetIgnoredDirs(), ['transactiondir', 'transactiondir2'])
+
+    self.db._PurgeTable('Config')
+    self.db.PurgeIgnoredDirs()
+
+  #################################################
+  # Check query statistics
+  #################################################
+  def test_db_QueryStats(self):
+    # Check no statistics are recorded when profiling is disabled
+    with mock.patch.object(self.db, '_RecordQueryStats') as mock_record:
+      self.db.GetConfigValue('StatsField')
+      mock_record.assert_not_called()
+    self.assertIsNone(self.db.GetQueryStats())
+
+    dbPath = test_lib.GenerateRandomPath(os.path.join(test_lib.GetBaseDir(), 'test_stats'), '.db')
+    self.addCleanup(test_lib.DeleteTestPath, dbPath)
+
+    with clear.database.RenamerDB(dbPath, profile = True) as db:
+      db.AddIgnoredDirs(['statsdir1', 'statsdir2'])
+      for _ in range(3):
+        db.GetIgnoredDirs()
+      with self.assertRaises(sqlite3.OperationalError):
+        db._ActionDatabase("SELECT * FROM InvalidTable")
+
+      queryStats = db.GetQueryStats()
+      selectStats = queryStats["SELECT * FROM IgnoredDir"]
+      self.assertEqual(selectStats['count'], 3)
+      self.assertEqual(selectStats['rows'], 6)
+      self.assertTrue(selectStats['seconds'] >= selectStats['maxSeconds'] > 0)
+      self.assertEqual(queryStats["INSERT OR IGNORE INTO IgnoredDir (DirName) VALUES (?)"]['count'], 1)
+      self.assertEqual(queryStats["SELECT * FROM InvalidTable"]['count'], 1)
+      self.assertEqual(queryStats["SELECT * FROM InvalidTable"]['rows'], 0)
+      db.LogQueryStats()
+
+  #################################################
+  # Check access from multiple connections
+  #################################################
+  @mock.patch('clear.database.time.sleep')
+  def test_db_Locking(self, mock_sleep):
+    dbPath = test_lib.GenerateRandomPath(os.path.join(test_lib.GetBaseDir(), 'test_lock'), '.db')
+    self.addCleanup(test_lib.DeleteTestPath, dbPath)
+
+    db1 = clear.database.RenamerDB(dbPath)
+    self.addCleanup(db1.close)
+    with mock.patch.object(clear.database.RenamerDB, 'BUSY_TIMEOUT', 0):
+      db2 = clear.database.RenamerDB(dbPath, cacheTables = True)
+    self.addCleanup(db2.close)
+
+    # Check lock held by another connection is retried and then raised
+    with db1.Transaction(immediate = True):
+      db1.SetConfigValue('LockField', 'LockValue1')
+      with self.assertRaises(sqlite3.OperationalError):
+        db2.SetConfigValue('LockField', 'LockValue2')
+      self.assertEqual(mock_sleep.call_count, db2.LOCK_RETRY_COUNT)
+      with self.assertRaises(sqlite3.OperationalError):
+        db2._ActionDatabase("INSERT INTO Config VALUES (?,?)", ('LockField', 'LockValue2'), error = False)
+    self.assertEqual(db2.GetConfigValue('LockField'), 'LockValue1')
+
+    # Check transaction and single command succeed once lock is released
+    for cmd in (lambda: db2.SetConfigValue('LockField', 'LockValue2'),
+                lambda: db2._ActionDatabase("INSERT INTO IgnoredDir VALUES (?)", ('lockdir', ))):
+      mock_sleep.reset_mock()
+      db1._connection.execute("BEGIN IMMEDIATE")
+      mock_sleep.side_effect = lambda delay: db1._connection.commit()
+      cmd()
+      self.assertEqual(mock_sleep.call_count, 1)
+    self.assertEqual(db1.GetConfigValue('LockField'), 'LockValue2')
+    self.assertEqual(db1.GetIgnoredDirs(), ['lockdir'])
+
+    # Check table cache is reloaded when changed by another connection
+    self.assertIsNone(db2.SearchTVLibrary(showName='lockshow'))
+    showID = db1.AddShowToTVLibrary('lockshow')
+    self.assertEqual(db2.SearchTVLibrary(showName='lockshow')[0][1], 'lockshow')
+
+    # Check show added by another connection first returns the existing show id
+    db1.UpdateShowDirInTVLibrary(showID, 'lockshowdir')
+    db3 = clear.database.RenamerDB(dbPath, cacheTables = True)
+    self.addCleanup(db3.close)
+    self.assertIsNone(db3.SearchTVLibrary(showName='lockshow2'))
+    showID2 = db1.AddShowToTVLibrary('lockshow2')
+    with mock.patch.object(db3, '_CheckTableCacheVersion'):
+      self.assertEqual(db3.AddShowToTVLibrary('lockshow2'), showID2)
+      self.assertEqual(db3.AddShowToTVLibrary('lockshow'), showID)
+      self.assertEqual(db3.SearchTVLibrary(showName='lockshow'), [(showID, 'lockshow', 'lockshowdir')])
+      self.assertEqual(db3.SearchTVLibrary(showDir='lockshowdir'), [(showID, 'lockshow', 'lockshowdir')])
+    self.assertEqual(db1.SearchTVLibrary(), [(showID, 'lockshow', 'lockshowdir'), (showID2, 'lockshow2', None)])
+
   #################################################
   # Check Config table methods
   #################################################
@@ -112,6 +309,36 @@ class ClearDatabase(unittest.TestCase):
     dbValue = self.db.GetSupportedFormats()
     self.assertIsNone(dbValue)
 
+  #################################################
+  # Check bulk single column table methods
+  #################################################
+  def test_db_SingleColumnTableBulk(self):
+    # Add list of formats including duplicates and check they are added once
+    self.db.AddSupportedFormats(['.bulkformat1', '.BULKFORMAT2', '.bulkformat1'])
+    self.assertEqual(self.db.GetSupportedFormats(), ['.bulkformat1', '.bulkformat2'])
+    self.db.AddSupportedFormats(['.bulkformat2', '.bulkformat3'])
+    self.assertEqual(self.db.GetSupportedFormats(), ['.bulkformat1', '.bulkformat2', '.bulkformat3'])
+
+    # Replace all formats
+    self.db.SetSupportedFormats(['.bulkformat4', '.bulkformat2'])
+    self.assertEqual(self.db.GetSupportedFormats(), ['.bulkformat4', '.bulkformat2'])
+
+    # Replace a large directory list with a single insert statement
+    dirList = ['bulkdir{0}'.format(i) for i in range(500)]
+    with mock.patch.object(self.db, '_ActionDatabase', wraps=self.db._ActionDatabase) as mock_action:
+      self.db.SetIgnoredDirs(dirList)
+      insertCallList = [i for i in mock_action.call_args_list if i[0][0].startswith('INSERT')]
+      self.assertEqual(len(insertCallList), 1)
+    self.assertEqual(self.db.GetIgnoredDirs(), dirList)
+
+    # Failed replace leaves table unchanged
+    with self.assertRaises(sqlite3.Error):
+      self.db.SetIgnoredDirs(['bulkdir', ['invalid']])
+    self.assertEqual(self.db.GetIgnoredDirs(), dirList)
+
+    self.db.PurgeSupportedFormats()
+    self.db.PurgeIgnoredDirs()
+
   #################################################
   # Check IgnoredDir table methods
   #################################################
@@ -152,9 +379,8 @@ class ClearDatabase(unittest.TestCase):
       self.assertEqual(showID, show[0])
       self.db.UpdateShowDirInTVLibrary(showID, show[2])
 
-    # Attempt to add duplicate showname to table, expect fatal error
-    with self.assertRaises(SystemExit):
-      self.db.AddShowToTVLibrary(showNameList[0][1])
+    # Add duplicate showname to table, expect existing show ID
+    self.assertEqual(self.db.AddShowToTVLibrary(showNameList[0][1]), showNameList[0][0])
 
     # Confirm table matches expected
     result = self.db.SearchTVLibrary()
@@ -254,6 +480,120 @@ class ClearDatabase(unittest.TestCase):
     result = self.db._ActionDatabase("SELECT * FROM SeasonDir", error = False)
     self.assertEqual(result, [])
 
+  #################################################
+  # Check TVLibrary, FileName and SeasonDir table cache
+  #################################################
+  def test_db_TableCache(self):
+    dbPath = test_lib.GenerateRandomPath(os.path.join(test_lib.GetBaseDir(), 'test_cache'), '.db')
+    self.addCleanup(test_lib.DeleteTestPath, dbPath)
+
+    with clear.database.RenamerDB(dbPath, cacheTables = True) as db:
+      showID = db.AddShowToTVLibrary('cacheshow1')
+      db.UpdateShowDirInTVLibrary(showID, 'cacheshowdir1')
+      db.AddToFileNameTable('cachefilename1', showID)
+      db.AddSeasonDirTable(showID, '01', 'Season 1')
+
+      # Check searches are answered from the cache after a single load
+      with mock.patch.object(db, '_ActionDatabase', wraps=db._ActionDatabase) as mock_action:
+        self.assertEqual(db.SearchTVLibrary(), [(showID, 'cacheshow1', 'cacheshowdir1')])
+        self.assertEqual(db.SearchTVLibrary(showName='cacheshow1'), [(showID, 'cacheshow1', 'cacheshowdir1')])
+        self.assertEqual(db.SearchTVLibrary(showID=str(showID)), [(showID, 'cacheshow1', 'cacheshowdir1')])
+        self.assertEqual(db.SearchTVLibrary(showDir='cacheshowdir1'), [(showID, 'cacheshow1', 'cacheshowdir1')])
+        self.assertIsNone(db.SearchTVLibrary(showName='invalidshow'))
+        self.assertEqual(db.SearchFileNameTable('cachefilename1'), showID)
+        self.assertIsNone(db.SearchFileNameTable('invalidfilename'))
+        self.assertEqual(db.SearchSeasonDirTable(showID, 1), 'Season 1')
+        self.assertEqual(db.SearchSeasonDirTable(str(showID), '01'), 'Season 1')
+        self.assertIsNone(db.SearchSeasonDirTable(showID, 2))
+        for callArgs in mock_action.call_args_list:
+          self.assertEqual(callArgs, mock.call("PRAGMA data_version"))
+
+      # Check changes made by another connection are seen by cached reads
+      with clear.database.RenamerDB(dbPath) as db2:
+        showID2 = db2.AddShowToTVLibrary('cacheshow2')
+        db2.AddToFileNameTable('cachefilename3', showID2)
+        db2.AddSeasonDirTable(showID2, 1, 'Series 1')
+      self.assertEqual(db.SearchTVLibrary(showName='cacheshow2'), [(showID2, 'cacheshow2', None)])
+      self.assertEqual(db.SearchFileNameTable('cachefilename3'), showID2)
+      self.assertEqual(db.SearchSeasonDirTable(showID2, 1), 'Series 1')
+
+      # Check cache is reloaded from the database after a rollback
+      with self.assertRaises(SystemExit):
+        with db.Transaction():
+          db.UpdateShowDirInTVLibrary(showID, 'cacheshowdir2')
+          db.AddToFileNameTable('cachefilename2', showID)
+          db.AddToFileNameTable('cachefilename2', showID)
+      self.assertEqual(db.SearchTVLibrary(showDir='cacheshowdir1'), [(showID, 'cacheshow1', 'cacheshowdir1')])
+      self.assertIsNone(db.SearchTVLibrary(showDir='cacheshowdir2'))
+      self.assertIsNone(db.SearchFileNameTable('cachefilename2'))
+
+    # Check cached results match an uncached database
+    with clear.database.RenamerDB(dbPath) as db:
+      self.assertEqual(db.SearchTVLibrary(), [(showID, 'cacheshow1', 'cacheshowdir1'), (showID2, 'cacheshow2', None)])
+      self.assertEqual(db.SearchFileNameTable('cachefilename1'), showID)
+      self.assertEqual(db.SearchSeasonDirTable(showID, '01'), 'Season 1')
+
+  #################################################
+  # Check source directory scan state
+  #################################################
+  def test_db_ScanState(self):
+    dirStateDict = {'/src': (None, 100, 1, True),
+                    '/src/a': ('/src', 200, 2, False)}
+    fileStateDict = {'/src/file1.txt': ('/src', 10, 300, 'unsupported'),
+                     '/src/a/file2.mkv': ('/src/a', 20, 400, 'processed')}
+
+    # Check no state is found for unknown root directory
+    self.assertEqual(self.db.GetScanState('/src', 'key1'), ({}, {}))
+
+    # Check saved state is only returned for a matching scan key
+    self.db.SetScanState('/src', 'key1', dirStateDict, fileStateDict)
+    self.assertEqual(self.db.GetScanState('/src', 'key1'), (dirStateDict, fileStateDict))
+    self.assertEqual(self.db.GetScanState('/src', 'key2'), ({}, {}))
+
+    # Check state for another root directory is kept separately
+    self.db.SetScanState('/src2', 'key1', {'/src2': (None, 500, 3, True)}, {})
+    self.assertEqual(self.db.GetScanState('/src2', 'key1'), ({'/src2': (None, 500, 3, True)}, {}))
+    self.assertEqual(self.db.GetScanState('/src', 'key1'), (dirStateDict, fileStateDict))
+
+    # Check saving only changes since saved state
+    savedState = self.db.GetScanState('/src', 'key1')
+    newDirStateDict = {'/src': (None, 150, 1, True)}
+    newFileStateDict = {'/src/file1.txt': ('/src', 10, 300, 'unsupported'),
+                        '/src/file3.txt': ('/src', 30, 700, 'unsupported')}
+    self.db.SetScanState('/src', 'key1', newDirStateDict, newFileStateDict, savedState = savedState)
+    self.assertEqual(self.db.GetScanState('/src', 'key1'), (newDirStateDict, newFileStateDict))
+
+    # Check saving state replaces all previous state for the root directory
+    self.db.SetScanState('/src', 'key2', {'/src': (None, 600, 1, True)}, {})
+    self.assertEqual(self.db.GetScanState('/src', 'key2'), ({'/src': (None, 600, 1, True)}, {}))
+    self.assertEqual(self.db.GetScanState('/src2', 'key1'), ({'/src2': (None, 500, 3, True)}, {}))
+
+  #################################################
+  # Check extraction ledger
+  #################################################
+  def test_db_ExtractState(self):
+    # Check no state is found for unknown archive
+    self.assertIsNone(self.db.GetExtractState('/src/a.part1.rar'))
+
+    # Check partial extraction state is saved
+    self.db.SetExtractState('/src/a.part1.rar', (2, 300, 400), False, {'dir/a.mkv': '/src/a.mkv'})
+    self.assertEqual(self.db.GetExtractState('/src/a.part1.rar'), ((2, 300, 400), False, {'dir/a.mkv': '/src/a.mkv'}))
+
+    # Check state for another archive is kept separately
+    self.db.SetExtractState('/src/b.rar', (1, 100, 200), True, {})
+    self.assertEqual(self.db.GetExtractState('/src/b.rar'), ((1, 100, 200), True, {}))
+
+    # Check saving state replaces previous state for the archive
+    self.db.SetExtractState('/src/a.part1.rar', (2, 300, 400), True, {'dir/a.mkv': '/src/a.mkv', 'a.srt': '/src/a.srt'})
+    self.assertEqual(self.db.GetExtractState('/src/a.part1.rar'), ((2, 300, 400), True, {'dir/a.mkv': '/src/a.mkv', 'a.srt': '/src/a.srt'}))
+    self.db.SetExtractState('/src/a.part1.rar', (2, 350, 500), False, {})
+    self.assertEqual(self.db.GetExtractState('/src/a.part1.rar'), ((2, 350, 500), False, {}))
+
+    # Check deleting state
+    self.db.DeleteExtractState('/src/a.part1.rar')
+    self.assertIsNone(self.db.GetExtractState('/src/a.part1.rar'))
+    self.assertEqual(self.db.GetExtractState('/src/b.rar'), ((1, 100, 200), True, {}))
+
   #################################################
   # Test manual update method
   # (with mocked user reponse)
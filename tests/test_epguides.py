@@ -6,11 +6,14 @@ Testbench for clear.epguides
 import os
 import datetime
 import goodlogging
+import requests
 import unittest
 import unittest.mock as mock
 
 import clear.epguides
 
+import test_lib
+
 class ClearEpguides(unittest.TestCase):
   #################################################
   # Set up test infrastructure
@@ -43,15 +46,28 @@ class ClearEpguides(unittest.TestCase):
 
     guide._ParseShowList(True) # Test checkOnly=True
     self.assertIsNone(guide._showTitleList)
-    self.assertIsNone(guide._showIDList)
+    self.assertIsNone(guide._showIDDict)
 
     guide._ParseShowList()
 
     expectedTitleList = [i[0] for c, i in enumerate(mock_allshow_list) if c > 0]
-    expectedIDList = [i[1] for c, i in enumerate(mock_allshow_list) if c > 0]
+    expectedIDDict = {i[0]: i[1] for c, i in enumerate(mock_allshow_list) if c > 0}
 
     self.assertEqual(guide._showTitleList, expectedTitleList)
-    self.assertEqual(guide._showIDList, expectedIDList)
+    self.assertEqual(guide._showTitleIndex, clear.util.BuildMatchIndex(expectedTitleList))
+    self.assertEqual(guide._showIDDict, expectedIDDict)
+
+    # Test duplicate titles keep the first id found
+    mock_allshow_list = (('title', guide.ID_LOOKUP_TAG), ('testshow1','1'), ('testshow1','2'))
+    guide._allShowList = self.mock_csv_format(mock_allshow_list)
+    guide._ParseShowList()
+    self.assertEqual(guide._showIDDict, {'testshow1': '1'})
+
+    # Test ended shows are recorded
+    mock_allshow_list = (('title', guide.ID_LOOKUP_TAG, guide.END_DATE_TAG), ('testshow1','1',''), ('testshow2','2','Jan 2010'))
+    guide._allShowList = self.mock_csv_format(mock_allshow_list)
+    guide._ParseShowList()
+    self.assertEqual(guide._endedShowIDSet, set(['2']))
 
     # Test invalid csv file format - invalid title
     mock_allshow_list = (('invalidtitle', guide.ID_LOOKUP_TAG), ('testshow1','1'), ('testshow2','2'))
@@ -158,42 +174,40 @@ class ClearEpguides(unittest.TestCase):
     self.assertIs(mock_gettitleandidlist.called, False)
 
   #################################################
-  # Test _GetIDList function
+  # Test _GetIDDict function
   #################################################
   @mock.patch('clear.epguides.EPGuidesLookup._GetTitleAndIDList')
-  def test_epguies_GetIDList(self, mock_gettitleandidlist):
+  def test_epguies_GetIDDict(self, mock_gettitleandidlist):
     guide = clear.epguides.EPGuidesLookup()
 
     # Test with empty allShowList
-    guide._GetIDList()
+    guide._GetIDDict()
     self.assertIs(mock_gettitleandidlist.called, True)
 
     # Test with non-empty allShowList
     mock_gettitleandidlist.reset_mock()
-    guide._showIDList = 'not empty'
-    guide._GetIDList()
+    guide._showIDDict = 'not empty'
+    guide._GetIDDict()
     self.assertIs(mock_gettitleandidlist.called, False)
 
   #################################################
   # Test _GetShowID function
   #################################################
-  @mock.patch('clear.epguides.EPGuidesLookup._GetTitleList')
-  @mock.patch('clear.epguides.EPGuidesLookup._GetIDList')
-  def test_epguies_GetShowID(self, mock_getidlist, mockgettitlelist):
+  @mock.patch('clear.epguides.EPGuidesLookup._GetIDDict')
+  def test_epguies_GetShowID(self, mock_getiddict):
     guide = clear.epguides.EPGuidesLookup()
 
-    # Test with invalid title list
-    guide._showTitleList = []
+    # Test with invalid id dictionary
+    guide._showIDDict = {}
     result = guide._GetShowID('TestShowName')
     self.assertIsNone(result)
 
-    # Test with valid title list
-    guide._showTitleList = ['TestShowName1', 'TestShowName2', 'TestShowName3']
-    guide._showIDList = ['3','86','2']
+    # Test with valid id dictionary
+    guide._showIDDict = {'TestShowName1': '3', 'TestShowName2': '86', 'TestShowName3': '2'}
 
-    for index, show in enumerate(guide._showTitleList):
+    for show, showID in guide._showIDDict.items():
       result = guide._GetShowID(show)
-      self.assertEqual(result, guide._showIDList[index])
+      self.assertEqual(result, showID)
 
   #################################################
   # Test _ExtractDataFromShowHtml function
@@ -217,6 +231,57 @@ class ClearEpguides(unittest.TestCase):
     with self.assertRaises(Exception):
       result = guide._ExtractDataFromShowHtml(html)
 
+  #################################################
+  # Test _ParseShowInfo function
+  #################################################
+  def test_epguies_ParseShowInfo(self):
+    guide = clear.epguides.EPGuidesLookup()
+
+    showInfoList = [['number', 'season', 'episode', 'title'],
+                    ['1', '1', '1', '1x1 Episode Title'],
+                    ['2', '1', '2', '1x2 Episode Title'],
+                    ['3', '1', '2', '1x2 Duplicate Title'],
+                    ['4', 'S', 'corrupted', 'Special Title']]
+    result = guide._ParseShowInfo('\n'.join([','.join(i) for i in showInfoList]))
+    self.assertEqual(result, {(1, 1): '1x1 Episode Title', (1, 2): '1x2 Episode Title'})
+
+  #################################################
+  # Test _LoadShowInfoCache and _SaveShowInfoCache functions
+  #################################################
+  def test_epguies_ShowInfoCache(self):
+    guide = clear.epguides.EPGuidesLookup()
+    guide._saveDir = test_lib.GenerateRandomPath(os.path.join(test_lib.GetBaseDir(), 'test_cache'))
+    self.addCleanup(test_lib.DeleteTestPath, guide._saveDir)
+
+    showID = '5'
+    episodeDict = {(1, 1): '1x1 Episode Title', (2, 3): '2x3 Episode Title'}
+
+    # Test empty cache
+    self.assertIsNone(guide._LoadShowInfoCache(showID))
+
+    # Test cache save and load
+    guide._SaveShowInfoCache(showID, episodeDict)
+    self.assertEqual(guide._LoadShowInfoCache(showID), episodeDict)
+
+    # Test expired cache entry
+    with mock.patch('time.time') as mock_time:
+      mock_time.return_value = os.path.getmtime(guide._GetShowInfoCachePath(showID)) + (guide._cacheTTL + 1) * 60 * 60
+      self.assertIsNone(guide._LoadShowInfoCache(showID))
+
+      # Test expired cache entry is reused for ended show
+      guide._endedShowIDSet = set([showID])
+      self.assertEqual(guide._LoadShowInfoCache(showID), episodeDict)
+
+    # Test disabled cache
+    guide._cacheTTL = 0
+    self.assertIsNone(guide._LoadShowInfoCache(showID))
+
+    # Test corrupted cache file
+    guide._cacheTTL = clear.epguides.EPGuidesLookup.EPISODE_CACHE_TTL
+    with open(guide._GetShowInfoCachePath(showID), 'w') as cacheFile:
+      cacheFile.write('corrupted')
+    self.assertIsNone(guide._LoadShowInfoCache(showID))
+
   #################################################
   # Test _GetEpisodeName function
   #################################################
@@ -232,7 +297,7 @@ class ClearEpguides(unittest.TestCase):
                     ['2','4','2x4 Episode Title'],
                     [season, episode, expectedTitle],
                     ['2','corrupted6','2x6 Episode Title']]
-    guide._showInfoDict[showID] = '\n'.join([','.join(i) for i in showInfoList])
+    guide._showInfoDict[showID] = guide._ParseShowInfo('\n'.join([','.join(i) for i in showInfoList]))
     result = guide._GetEpisodeName(showID, season, episode)
     self.assertEqual(result, expectedTitle)
 
@@ -248,6 +313,7 @@ class ClearEpguides(unittest.TestCase):
   def test_epguiesShowNameLookUp(self, mock_gettitlelist):
     guide = clear.epguides.EPGuidesLookup()
     guide._showTitleList = ['TestShow1', 'TestShow2', 'TestShow3', 'TestShow25']
+    guide._showTitleIndex = clear.util.BuildMatchIndex(guide._showTitleList)
 
     # Match all
     result = guide.ShowNameLookUp('Test')
@@ -265,6 +331,48 @@ class ClearEpguides(unittest.TestCase):
     result = guide.ShowNameLookUp('TestShow2')
     self.assertEqual(result, ['TestShow2'])
 
+    # Failed title list lookup is treated as no match
+    mock_gettitlelist.side_effect = requests.exceptions.Timeout('Test timeout')
+    result = guide.ShowNameLookUp('TestShow2')
+    self.assertEqual(result, [])
+
+  #################################################
+  # Test PrefetchShowInfo function
+  #################################################
+  @mock.patch('clear.epguides.EPGuidesLookup._FetchShowInfo')
+  @mock.patch('clear.epguides.EPGuidesLookup._LoadShowInfoCache')
+  @mock.patch('clear.epguides.EPGuidesLookup._GetShowID')
+  def test_epguiesPrefetchShowInfo(self, mock_getshowid, mock_loadcache, mock_fetch):
+    guide = clear.epguides.EPGuidesLookup()
+
+    showIDDict = {'Show1': '1', 'Show2': '2', 'Show3': '3', 'Show4': '4', 'Show5': None}
+    mock_getshowid.side_effect = lambda showName: showIDDict[showName]
+
+    guide._showInfoDict['1'] = {(1, 1): 'Loaded Title'}
+    mock_loadcache.side_effect = lambda showID: {(1, 1): 'Cached Title'} if showID == '2' else None
+    mock_fetch.side_effect = lambda showID: {(1, 1): 'Fetched Title {0}'.format(showID)}
+
+    guide.PrefetchShowInfo(sorted(showIDDict.keys()), workerCount=2)
+
+    self.assertEqual(sorted(i[0][0] for i in mock_fetch.call_args_list), ['3', '4'])
+    self.assertEqual(guide._showInfoDict, {'1': {(1, 1): 'Loaded Title'},
+                                           '2': {(1, 1): 'Cached Title'},
+                                           '3': {(1, 1): 'Fetched Title 3'},
+                                           '4': {(1, 1): 'Fetched Title 4'}})
+
+    # Test failed lookups are skipped
+    guide._showInfoDict = {}
+    mock_loadcache.side_effect = None
+    mock_loadcache.return_value = None
+    mock_fetch.side_effect = lambda showID: {}[showID]
+    guide.PrefetchShowInfo(['Show1'])
+    self.assertEqual(guide._showInfoDict, {})
+
+    # Test failed title list lookup is skipped
+    mock_getshowid.side_effect = requests.exceptions.ConnectionError('Test connection error')
+    guide.PrefetchShowInfo(['Show1'])
+    self.assertEqual(guide._showInfoDict, {})
+
   #################################################
   # Test EpisodeNameLookUp function
   #################################################
@@ -272,6 +380,8 @@ class ClearEpguides(unittest.TestCase):
   @mock.patch('clear.epguides.EPGuidesLookup._GetShowID')
   def test_epguiesEpisodeNameLookUp(self, mock_getshowid, mock_weblookup):
     guide = clear.epguides.EPGuidesLookup()
+    guide._saveDir = test_lib.GenerateRandomPath(os.path.join(test_lib.GetBaseDir(), 'test_cache'))
+    self.addCleanup(test_lib.DeleteTestPath, guide._saveDir)
 
     showName = 'Test ShowName'
     showID = '10'
@@ -311,5 +421,26 @@ class ClearEpguides(unittest.TestCase):
     result = guide.EpisodeNameLookUp(showName, season, episode)
     self.assertIsNone(result)
 
+    # Test new guide object reuses show info from cache
+    cachedGuide = clear.epguides.EPGuidesLookup()
+    cachedGuide._saveDir = guide._saveDir
+    mock_getshowid.return_value = showID
+    result = cachedGuide.EpisodeNameLookUp(showName, season, episode)
+    self.assertEqual(mock_weblookup.call_count, 1)
+    self.assertEqual(result, expectedTitle)
+
+    # Test failed web lookups are treated as no match
+    indent = goodlogging.Log.indent
+    mock_getshowid.side_effect = requests.exceptions.Timeout('Test timeout')
+    result = guide.EpisodeNameLookUp(showName, season, episode)
+    self.assertIsNone(result)
+    mock_getshowid.side_effect = None
+    mock_getshowid.return_value = '11'
+    mock_weblookup.side_effect = requests.exceptions.ConnectionError('Test connection error')
+    result = guide.EpisodeNameLookUp(showName, season, episode)
+    self.assertIsNone(result)
+    self.assertNotIn('11', guide._showInfoDict)
+    self.assertEqual(goodlogging.Log.indent, indent)
+
 if __name__ == '__main__':
   unittest.main()
@@ -3,7 +3,12 @@
 Testbench for clear.extract
 
 '''
+import io
 import os
+import shutil
+import tempfile
+import threading
+import time
 import goodlogging
 import rarfile
 import unittest
@@ -11,6 +16,7 @@ import unittest.mock as mock
 
 import test_lib
 
+import clear.database
 import clear.extract
 
 class Extract(unittest.TestCase):
@@ -23,66 +29,24 @@ class Extract(unittest.TestCase):
     goodlogging.Log.silenceAll = True
 
   #################################################
-  # Test GetCompressedFilesInDir function
+  # Test GroupArchiveVolumes function
   #################################################
-  @mock.patch('glob.glob')
-  @mock.patch('os.path.isdir')
-  def test_extract_GetCompressedFilesInDir(self, mock_isdir, mock_glob):
-    fileList = []
-    fileDir = 'fake/path'
-    ignoreDirList = ''
-    supportedFormatList = ['.rar',]
-
-    # Check file directory is not a directory
-    mock_isdir.return_value = False
-    clear.extract.GetCompressedFilesInDir(fileDir, fileList, ignoreDirList, supportedFormatList)
-    self.assertEqual(fileList, [])
-
-    # Force isdir to resolve true
-    mock_isdir.return_value = True
-    mock_glob.return_value = ['testfile1.txt', 'testfile2.rar', 'testfile3.zip', 'testdir4']
-    expectedFileList = ['testfile2.rar']
-    clear.extract.GetCompressedFilesInDir(fileDir, fileList, ignoreDirList, supportedFormatList)
-    self.assertEqual(fileList, expectedFileList)
-
-    # Check more complex glob paths
-    mock_glob.return_value = ['this/path/testfile5.txt',
-                              'this/path/testfile6.rar',
-                              'this/path/testdir7']
-    expectedFileList.append('this/path/testfile6.rar')
-    clear.extract.GetCompressedFilesInDir(fileDir, fileList, ignoreDirList, supportedFormatList)
-    self.assertEqual(fileList, expectedFileList)
-
-  #################################################
-  # Test MultipartArchiving function
-  #################################################
-  @mock.patch('clear.util.ArchiveProcessedFile')
-  def test_extract_MultipartArchiving(self, mock_util):
-    firstPartExtractList = []
-    otherPartSkippedList = ['file1.part3.rar']
-    archiveDir = 'fakedir'
-
-    # Mock of util.ArchiveProcessedFile will do nothing and return True
-    mock_util.return_value = True
-
-    # Found new parts but first part not extracted yet
-    otherPartExtractionList = ['file1.part2.rar', 'file1.part3.rar', 'file1.part4.rar']
-    for otherPartFilePath in otherPartExtractionList:
-      clear.extract.MultipartArchiving(firstPartExtractList, otherPartSkippedList, archiveDir, otherPartFilePath)
-    self.assertEqual(sorted(otherPartSkippedList), sorted(otherPartExtractionList))
-
-    # Found new parts with first part previously extracted
-    firstPartExtractList = 'file1.part1.rar'
-    for otherPartFilePath in otherPartExtractionList:
-      clear.extract.MultipartArchiving(firstPartExtractList, otherPartSkippedList, archiveDir, otherPartFilePath)
-    self.assertEqual(otherPartSkippedList, [])
-
-    # End of extraction reached. Call function to scan through remaining parts and archive as appropriate
-    extractedPartList = ['file1.part2.rar', 'file1.part3.rar', 'file1.part4.rar']
-    nonExtractedPartsList = ['file2.part2.rar', 'file3.part2.rar', 'file4.part4.rar', 'file2.part3.rar']
-    otherPartSkippedList = extractedPartList + nonExtractedPartsList
-    clear.extract.MultipartArchiving(firstPartExtractList, otherPartSkippedList, archiveDir)
-    self.assertEqual(sorted(otherPartSkippedList), sorted(nonExtractedPartsList))
+  def test_extract_GroupArchiveVolumes(self):
+    fileList = ['dir1/file1.part2.rar',
+                'dir1/file2.rar',
+                'dir1/file1.part10.rar',
+                'dir1/file1.part01.rar',
+                'dir2/file1.part1.rar',
+                'dir1/file3.part2.rar',
+                'dir1/file3.part3.rar']
+
+    expectedList = [('dir1/file1.part01.rar', ['dir1/file1.part01.rar', 'dir1/file1.part2.rar', 'dir1/file1.part10.rar']),
+                    ('dir1/file2.rar', ['dir1/file2.rar']),
+                    ('dir2/file1.part1.rar', ['dir2/file1.part1.rar']),
+                    (None, ['dir1/file3.part2.rar', 'dir1/file3.part3.rar'])]
+
+    self.assertEqual(clear.extract.GroupArchiveVolumes(fileList), expectedList)
+    self.assertEqual(clear.extract.GroupArchiveVolumes([]), [])
 
   #################################################
   # Test DoRarExtraction function
@@ -100,6 +64,80 @@ class Extract(unittest.TestCase):
       result = clear.extract.DoRarExtraction(rarArchive, 'target.file', 'fakedir')
       self.assertIs(result, True)
 
+  #################################################
+  # Test DoRarBatchExtraction function
+  #################################################
+  def test_extract_DoRarBatchExtraction(self):
+    tempDir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, tempDir)
+    targetFileList = [mock.MagicMock(filename=os.path.join('sub', 'fileA.ff1')), mock.MagicMock(filename='fileB.ff2')]
+    rarArchive = mock.MagicMock()
+
+    def ExtractAll(dstDir, memberList, failAfter = None):
+      os.makedirs(os.path.join(dstDir, 'sub'), exist_ok=True)
+      for f in memberList[:failAfter]:
+        open(os.path.join(dstDir, f.filename), 'w').close()
+      if failAfter is not None:
+        raise Exception('Test RARfile Error')
+
+    # All files extracted with one call, missing files are not reported
+    rarArchive.extractall.side_effect = lambda dstDir, memberList: ExtractAll(dstDir, memberList[:1])
+    result = clear.extract.DoRarBatchExtraction(rarArchive, targetFileList, tempDir)
+    rarArchive.extractall.assert_called_once_with(tempDir, targetFileList)
+    self.assertEqual(result, set([os.path.join('sub', 'fileA.ff1')]))
+
+    # Check exception raised by RAR file extraction removes extracted files
+    rarArchive.extractall.side_effect = lambda dstDir, memberList: ExtractAll(dstDir, memberList, 1)
+    result = clear.extract.DoRarBatchExtraction(rarArchive, targetFileList, tempDir)
+    self.assertEqual(result, set())
+    self.assertEqual(os.listdir(os.path.join(tempDir, 'sub')), [])
+    self.assertIs(os.path.exists(os.path.join(tempDir, 'fileB.ff2')), False)
+
+    # Check keyboard interrupt is not caught but extracted files are removed
+    def ExtractAllInterrupted(dstDir, memberList):
+      ExtractAll(dstDir, memberList[:1])
+      raise KeyboardInterrupt
+
+    rarArchive.extractall.side_effect = ExtractAllInterrupted
+    with self.assertRaises(KeyboardInterrupt):
+      clear.extract.DoRarBatchExtraction(rarArchive, targetFileList, tempDir)
+    self.assertEqual(os.listdir(os.path.join(tempDir, 'sub')), [])
+
+  #################################################
+  # Test StreamRarExtraction function
+  #################################################
+  def test_extract_StreamRarExtraction(self):
+    tempDir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, tempDir)
+    targetPath = os.path.join(tempDir, 'fileA.ff1')
+    targetFile = mock.MagicMock(filename=os.path.join('sub', 'fileA.ff1'), date_time=(2015, 6, 1, 12, 30, 0))
+    rarArchive = mock.MagicMock()
+
+    # File data is written directly to target path with archive modification time
+    rarArchive.open.return_value = io.BytesIO(b'file data')
+    result = clear.extract.StreamRarExtraction(rarArchive, targetFile, targetPath)
+    self.assertIs(result, True)
+    rarArchive.open.assert_called_once_with(targetFile)
+    with open(targetPath, 'rb') as f:
+      self.assertEqual(f.read(), b'file data')
+    self.assertEqual(os.path.getmtime(targetPath), time.mktime((2015, 6, 1, 12, 30, 0, 0, 0, -1)))
+    self.assertEqual(os.listdir(tempDir), ['fileA.ff1'])
+
+    # Check exception raised while reading archive leaves no partial file
+    os.remove(targetPath)
+    srcFile = mock.MagicMock()
+    srcFile.__enter__.return_value.read.side_effect = [b'partial', Exception('Test RARfile Error')]
+    rarArchive.open.return_value = srcFile
+    result = clear.extract.StreamRarExtraction(rarArchive, targetFile, targetPath)
+    self.assertIs(result, False)
+    self.assertEqual(os.listdir(tempDir), [])
+
+    # Check keyboard interrupt is not caught but leaves no partial file
+    srcFile.__enter__.return_value.read.side_effect = [b'partial', KeyboardInterrupt]
+    with self.assertRaises(KeyboardInterrupt):
+      clear.extract.StreamRarExtraction(rarArchive, targetFile, targetPath)
+    self.assertEqual(os.listdir(tempDir), [])
+
   #################################################
   # Test GetRarPassword function
   #################################################
@@ -174,10 +212,12 @@ class Extract(unittest.TestCase):
   @mock.patch('clear.util.RemoveEmptyDirectoryTree')
   @mock.patch('clear.util.ArchiveProcessedFile')
   @mock.patch('clear.extract.DoRarExtraction')
-  @mock.patch('clear.extract.MultipartArchiving')
-  def test_extract_Extract(self, mock_multipartarchiving, mock_rarextract,
+  @mock.patch('clear.extract.StreamRarExtraction')
+  @mock.patch('clear.extract.DoRarBatchExtraction')
+  def test_extract_Extract(self, mock_rarbatch, mock_rarstream, mock_rarextract,
                            mock_archivefile, mock_removedirtree, mock_rename, mock_isfile):
-    mock_multipartarchiving.return_value = True # Skip archiving mutlipart rar archive
+    mock_rarbatch.return_value = set() # Fall back to extracting one file at a time
+    mock_rarstream.return_value = False # Fall back to extracting with archive directory structure
     mock_rarextract.return_value = True # Skip actual RAR extraction
     mock_archivefile.return_value = True # Skip archiving extracted rar archive file
     mock_removedirtree.return_value = True # Skip directory removal
@@ -219,6 +259,7 @@ class Extract(unittest.TestCase):
 
       # Test rar file doesn't need password
       mock_rarextract.reset_mock()
+      mock_rarstream.reset_mock()
       mock_rarfile.reset_mock()
 
       mock_rarfile_instance.needs_password.return_value = False
@@ -232,10 +273,43 @@ class Extract(unittest.TestCase):
       for archivepath in fileList:
         for file in archive:
           if os.path.splitext(file.filename)[1] in fileFormatList:
-            expectedRarExtractArgList.append(mock.call(mock_rarfile_instance, file, os.path.dirname(archivepath)))
+            expectedRarExtractArgList.append(mock.call(mock_rarfile_instance, file, os.path.dirname(archivepath), None))
 
       self.assertEqual(mock_rarextract.call_count, 6)
       self.assertEqual(expectedRarExtractArgList, mock_rarextract.call_args_list)
+      self.assertEqual(mock_rarstream.call_count, 6)
+      self.assertEqual(mock_rarbatch.call_args_list[-1], mock.call(mock_rarfile_instance, archive[:2], os.path.dirname(fileList[-1]), None))
+
+      # Test files extracted with a single call per archive
+      mock_rarstream.reset_mock()
+      mock_rarextract.reset_mock()
+      mock_rarbatch.reset_mock()
+      mock_rarbatch.return_value = set(['fileA.ff1', 'fileB.ff2'])
+      extractedFileList = []
+      clear.extract.Extract(fileList, fileFormatList, archiveDir, skipUserInput, extractedFileList)
+      self.assertEqual(mock_rarbatch.call_count, 3)
+      self.assertIs(mock_rarstream.called, False)
+      self.assertIs(mock_rarextract.called, False)
+      self.assertEqual(len(extractedFileList), 6)
+
+      # Test files not extracted by single call are extracted one at a time
+      mock_rarbatch.return_value = set(['fileA.ff1'])
+      clear.extract.Extract(fileList, fileFormatList, archiveDir, skipUserInput)
+      self.assertEqual(mock_rarstream.call_args_list, [mock.call(mock_rarfile_instance, archive[1], os.path.join(os.path.dirname(i), 'fileB.ff2'), None) for i in fileList])
+      mock_rarbatch.return_value = set()
+
+      # Test files streamed directly to archive directory
+      mock_rarstream.reset_mock()
+      mock_rarextract.reset_mock()
+      mock_rarstream.return_value = True
+      extractedFileList = []
+      clear.extract.Extract(fileList, fileFormatList, archiveDir, skipUserInput, extractedFileList)
+      self.assertEqual(mock_rarstream.call_args_list[0], mock.call(mock_rarfile_instance, archive[0], os.path.join('filedir1', 'fileA.ff1'), None))
+      self.assertEqual(mock_rarstream.call_count, 6)
+      self.assertIs(mock_rarextract.called, False)
+      self.assertIs(mock_rename.called, False)
+      self.assertEqual(len(extractedFileList), 6)
+      mock_rarstream.return_value = False
 
       # Do following test exercises with a single archive file, containing only one file to extract
       mock_rarextract.reset_mock()
@@ -251,18 +325,22 @@ class Extract(unittest.TestCase):
       fileList = ['filedir1/file1.part1.rar']
 
       # Test rar files extracted to sub-directory
+      extractedFileList = []
       mock_isfile.side_effect = [False, False, True, False]
-      clear.extract.Extract(fileList, fileFormatList, archiveDir, skipUserInput)
+      clear.extract.Extract(fileList, fileFormatList, archiveDir, skipUserInput, extractedFileList)
       self.assertEqual(mock_rarextract.call_count, 1)
       self.assertEqual(mock_removedirtree.call_count, 1)
       self.assertEqual(mock_rename.call_count, 1)
+      self.assertEqual(extractedFileList, [os.path.join('filedir1', 'fileA.ff1')])
 
       # Test file already extracted at base directory
+      extractedFileList = []
       mock_isfile.side_effect = [True, False, False]
-      clear.extract.Extract(fileList, fileFormatList, archiveDir, skipUserInput)
+      clear.extract.Extract(fileList, fileFormatList, archiveDir, skipUserInput, extractedFileList)
       self.assertEqual(mock_rarextract.call_count, 1)
       self.assertEqual(mock_removedirtree.call_count, 1)
       self.assertEqual(mock_rename.call_count, 1)
+      self.assertEqual(extractedFileList, [])
 
       # Test file already exists at extracted sub-directory
       mock_isfile.side_effect = [False, True, False, False]
@@ -278,10 +356,15 @@ class Extract(unittest.TestCase):
       self.assertIs(mock_rarfile_instance.needs_password.called, False)
 
       # Test rar archive rarfile.NeedFirstVolume error
-      mock_multipartarchiving.reset_mock()
+      mock_archivefile.reset_mock()
       mock_rarfile.side_effect = [rarfile.NeedFirstVolume]
       clear.extract.Extract(fileList, fileFormatList, archiveDir, skipUserInput)
-      self.assertEqual(mock_multipartarchiving.call_count, 1)
+      self.assertIs(mock_archivefile.called, False)
+
+      # Test multi-part archive with missing first part is not opened
+      mock_rarfile.reset_mock()
+      clear.extract.Extract(['filedir1/file1.part2.rar', 'filedir1/file1.part3.rar'], fileFormatList, archiveDir, skipUserInput)
+      self.assertIs(mock_rarfile.called, False)
 
       # Test rar archive other exception
       mock_rarfile.reset_mock()
@@ -294,5 +377,147 @@ class Extract(unittest.TestCase):
       result = clear.extract.Extract(fileList, fileFormatList, archiveDir, skipUserInput)
       self.assertIsNone(result)
 
+  #################################################
+  # Test Extract function with parallel workers
+  #################################################
+  @mock.patch('clear.util.ArchiveProcessedFile')
+  @mock.patch('clear.extract.GetRarPassword')
+  @mock.patch('clear.extract.ExtractArchiveFiles')
+  def test_extract_ExtractParallel(self, mock_extractfiles, mock_rarpassword, mock_archivefile):
+    fileList = ['d/a.part1.rar', 'd/a.part2.rar', 'd/b.rar', 'd/c.rar', 'd/e.rar']
+    archiveDict = {}
+
+    def RarFile(filePath):
+      archiveDict[filePath] = mock.MagicMock()
+      archiveDict[filePath].needs_password.return_value = filePath in ('d/c.rar', 'd/e.rar')
+      return archiveDict[filePath]
+
+    def ExtractArchiveFiles(rarArchive, filePath, fileFormatList, extractedFileList, extractedFileDict, logList, cleanupDirList):
+      extractedFileList.append(filePath + '.mkv')
+      logList.append('Extracting file: {0}.mkv'.format(filePath))
+      cleanupDirList.append('d/sub')
+      return filePath != 'd/b.rar'
+
+    def RemoveEmptyDirectoryTree(path):
+      self.assertIs(threading.current_thread(), threading.main_thread())
+      self.assertEqual(mock_extractfiles.call_count, 3)
+
+    mock_extractfiles.side_effect = ExtractArchiveFiles
+    mock_rarpassword.side_effect = ['fakepwd1', False]
+
+    extractedFileList = []
+    with mock.patch('rarfile.RarFile', side_effect=RarFile):
+      with mock.patch('clear.extract.CheckPasswordReuse', return_value=0):
+        with mock.patch('clear.util.RemoveEmptyDirectoryTree', side_effect=RemoveEmptyDirectoryTree) as mock_removedir:
+          clear.extract.Extract(fileList, ['.mkv'], 'fakedir', False, extractedFileList, workerCount = 4)
+
+    # Empty directories are removed once by the main thread after all workers complete
+    mock_removedir.assert_called_once_with('d/sub')
+
+    # Passwords are requested in turn and only archives with a password are extracted
+    self.assertEqual(mock_rarpassword.call_count, 2)
+    archiveDict['d/c.rar'].setpassword.assert_called_once_with('fakepwd1')
+    self.assertEqual(sorted(call[0][1] for call in mock_extractfiles.call_args_list), ['d/a.part1.rar', 'd/b.rar', 'd/c.rar'])
+    self.assertEqual(sorted(extractedFileList), ['d/a.part1.rar.mkv', 'd/b.rar.mkv', 'd/c.rar.mkv'])
+
+    # Only first volume is opened and extracted archives are archived along with all other parts
+    self.assertEqual(sorted(archiveDict), ['d/a.part1.rar', 'd/b.rar', 'd/c.rar', 'd/e.rar'])
+    self.assertEqual(sorted(call[0][0] for call in mock_archivefile.call_args_list), ['d/a.part1.rar', 'd/a.part2.rar', 'd/c.rar'])
+
+    # Interrupt cancels archives not yet started without waiting for running archives
+    releaseEvent = threading.Event()
+    self.addCleanup(releaseEvent.set)
+    finishedList = []
+
+    def ExtractArchiveFilesWait(rarArchive, filePath, fileFormatList, extractedFileList, extractedFileDict, logList, cleanupDirList):
+      if filePath != 'd/a.rar':
+        releaseEvent.wait(5)
+        finishedList.append(filePath)
+      return True
+
+    mock_extractfiles.reset_mock()
+    mock_extractfiles.side_effect = ExtractArchiveFilesWait
+    mock_archivefile.side_effect = KeyboardInterrupt
+    with mock.patch('rarfile.RarFile') as mock_rarfile:
+      mock_rarfile.return_value.needs_password.return_value = False
+      with self.assertRaises(KeyboardInterrupt):
+        clear.extract.Extract(['d/a.rar', 'd/b.rar', 'd/c.rar', 'd/e.rar'], ['.mkv'], 'fakedir', True, workerCount = 2)
+    self.assertEqual(finishedList, [])
+    self.assertNotIn('d/e.rar', [call[0][1] for call in mock_extractfiles.call_args_list])
+
+  #################################################
+  # Test Extract function with extraction ledger
+  #################################################
+  @mock.patch('clear.extract.DoRarBatchExtraction', return_value=set())
+  @mock.patch('clear.extract.StreamRarExtraction')
+  @mock.patch('clear.util.ArchiveProcessedFile')
+  def test_extract_ExtractLedger(self, mock_archivefile, mock_rarstream, mock_rarbatch):
+    tempDir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, tempDir)
+    db = clear.database.RenamerDB(os.path.join(tempDir, 'test.db'))
+    self.addCleanup(db.close)
+
+    volumeList = [os.path.join(tempDir, 'a.part1.rar'), os.path.join(tempDir, 'a.part2.rar')]
+    for volumePath in volumeList:
+      with open(volumePath, 'w') as f:
+        f.write('volume')
+    archive = [mock.MagicMock(filename=os.path.join('sub', 'fileA.ff1')), mock.MagicMock(filename='fileB.ff1')]
+
+    def StreamRarExtraction(rarArchive, targetFile, targetPath, logList):
+      if targetFile is archive[1] and failSecond is True:
+        raise KeyboardInterrupt
+      open(targetPath, 'w').close()
+      return True
+
+    mock_rarstream.side_effect = StreamRarExtraction
+
+    def RunExtract():
+      mock_rarstream.reset_mock()
+      extractedFileList = []
+      with mock.patch('rarfile.RarFile', autospec=True) as mock_rarfile:
+        mock_rarfile.return_value.needs_password.return_value = False
+        mock_rarfile.return_value.infolist.return_value = archive
+        clear.extract.Extract(volumeList, ['.ff1'], 'fakedir', True, extractedFileList, db = db)
+      return (mock_rarfile.called, extractedFileList)
+
+    # Check extraction progress is recorded if it is interrupted
+    failSecond = True
+    with self.assertRaises(KeyboardInterrupt):
+      RunExtract()
+    fingerprint = clear.extract.GetArchiveFingerprint(volumeList)
+    self.assertEqual(fingerprint[:2], (2, 12))
+    self.assertEqual(db.GetExtractState(volumeList[0]), (fingerprint, False, {archive[0].filename: os.path.join(tempDir, 'fileA.ff1')}))
+
+    # Check extraction resumes from first unfinished file (even if earlier
+    # files have since been moved) and is recorded as complete if the
+    # archive can not be moved to the archive directory
+    os.remove(os.path.join(tempDir, 'fileA.ff1'))
+    failSecond = False
+    rarOpened, extractedFileList = RunExtract()
+    self.assertIs(rarOpened, True)
+    self.assertEqual([call[0][1] for call in mock_rarstream.call_args_list], [archive[1]])
+    self.assertEqual(extractedFileList, [os.path.join(tempDir, 'fileB.ff1')])
+    self.assertEqual(db.GetExtractState(volumeList[0])[1], True)
+    self.assertEqual(mock_archivefile.call_count, 2)
+
+    # Check completed archive is not opened again
+    rarOpened, extractedFileList = RunExtract()
+    self.assertIs(rarOpened, False)
+    self.assertEqual(extractedFileList, [])
+    self.assertEqual(mock_archivefile.call_count, 4)
+
+    # Check changed archive is extracted again
+    with open(volumeList[1], 'a') as f:
+      f.write('changed')
+    os.remove(os.path.join(tempDir, 'fileB.ff1'))
+    rarOpened, extractedFileList = RunExtract()
+    self.assertIs(rarOpened, True)
+    self.assertEqual(extractedFileList, [os.path.join(tempDir, 'fileA.ff1'), os.path.join(tempDir, 'fileB.ff1')])
+
+    # Check state is removed once the archive is moved to the archive directory
+    mock_archivefile.side_effect = lambda filePath, archiveDir: os.remove(filePath)
+    RunExtract()
+    self.assertIsNone(db.GetExtractState(volumeList[0]))
+
 if __name__ == '__main__':
   unittest.main()
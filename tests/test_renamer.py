@@ -11,6 +11,7 @@ import unittest
 import unittest.mock as mock
 
 import clear.renamer
+import clear.database
 
 class Clear(unittest.TestCase):
   #################################################
@@ -590,12 +591,14 @@ class Clear(unittest.TestCase):
   @mock.patch('clear.renamer.TVRenamer._MoveFileToLibrary')
   @mock.patch('goodlogging.Log.Input')
   @mock.patch('clear.renamer.TVRenamer._GenerateLibraryPath')
+  @mock.patch('clear.epguides.EPGuidesLookup.PrefetchShowInfo')
   @mock.patch('clear.epguides.EPGuidesLookup.EpisodeNameLookUp')
   @mock.patch('clear.renamer.TVRenamer._GetShowInfo')
   @mock.patch('clear.renamer.TVRenamer._GetUniqueFileShowNames')
   def test_renamer_Run(self, mock_getfileshowname, mock_getshowinfo, mock_episodelookup,
-                      mock_genlibpath, mock_input, mock_movefile):
-    renamer = clear.renamer.TVRenamer('fakedir', [], 'fakedir')
+                      mock_prefetch, mock_genlibpath, mock_input, mock_movefile):
+    db = mock.MagicMock(spec=clear.database.RenamerDB)
+    renamer = clear.renamer.TVRenamer(db, [], 'fakedir')
 
     # Test empty file list
     mock_getfileshowname.return_value = []
@@ -622,13 +625,46 @@ class Clear(unittest.TestCase):
     renamer._fileList = fileList
     renamer.Run()
     mock_getshowinfo.assert_called_once_with(showFileName)
+    db.Transaction.assert_not_called()
+    mock_prefetch.assert_not_called()
     mock_episodelookup.assert_not_called()
 
+    # Test new file name matches are only written once all shows are looked up
+    def GetShowInfo(fileShowName):
+      renamer._AddToFileNameTable(fileShowName, showID)
+      self.assertIs(db.AddToFileNameTable.called, False)
+      self.assertEqual(renamer._SearchFileNameTable(fileShowName), showID)
+      return None
+
+    mock_getshowinfo.side_effect = GetShowInfo
+    db.SearchFileNameTable.return_value = None
+    renamer.Run()
+    db.Transaction.assert_called_once_with(immediate = True)
+    db.AddToFileNameTable.assert_called_once_with(showFileName, showID)
+    self.assertIsNone(renamer._newFileNameDict)
+
+    # Test aborted show lookup keeps new TV library entries but writes no file name matches
+    def GetShowInfoAbort(fileShowName):
+      showID = db.AddShowToTVLibrary(showName)
+      renamer._AddToFileNameTable(fileShowName, showID)
+      raise KeyboardInterrupt
+
+    db.reset_mock()
+    mock_getshowinfo.side_effect = GetShowInfoAbort
+    with self.assertRaises(KeyboardInterrupt):
+      renamer.Run()
+    db.AddShowToTVLibrary.assert_called_once_with(showName)
+    db.Transaction.assert_not_called()
+    db.AddToFileNameTable.assert_not_called()
+    self.assertIsNone(renamer._newFileNameDict)
+    mock_getshowinfo.side_effect = None
+
     mock_getshowinfo.return_value = mock.MagicMock(showName=showName, ShowID=showID)
 
     # Test no episode name
     mock_episodelookup.return_value = None
     renamer.Run()
+    mock_prefetch.assert_called_once_with(set([showName]))
     mock_episodelookup.assert_called_once_with(showName, seasonNum, episodeNum)
 
     mock_episodelookup.return_value = episodeName
@@ -4,6 +4,7 @@ Testbench for clear.util
 
 '''
 import os
+import random
 import shutil
 import requests
 import goodlogging
@@ -60,6 +61,29 @@ class ClearUtil(unittest.TestCase):
     expectedPath = 'test/file/path/abc_2.xyz'
     self.assertEqual(result, expectedPath)
 
+  #################################################
+  # Test LogInfo function
+  #################################################
+  @mock.patch('goodlogging.Log.Info')
+  def test_LogInfo(self, mock_logging):
+    formatArg = mock.MagicMock()
+    formatArg.__format__ = mock.MagicMock(return_value='ARG')
+
+    # Test message below threshold is not formatted or logged
+    with mock.patch.object(goodlogging.Log, 'verbosityThreshold', goodlogging.Verbosity.NORMAL):
+      clear.util.LogInfo("TEST", "Message {0}", formatArg, verbosity=goodlogging.Verbosity.MINIMAL)
+      formatArg.__format__.assert_not_called()
+      mock_logging.assert_not_called()
+
+      # Test message at threshold is formatted and logged
+      clear.util.LogInfo("TEST", "Message {0}", formatArg, verbosity=goodlogging.Verbosity.NORMAL)
+      mock_logging.assert_called_once_with("TEST", "Message ARG", verbosity=goodlogging.Verbosity.NORMAL)
+
+      # Test message without format arguments is logged unchanged
+      mock_logging.reset_mock()
+      clear.util.LogInfo("TEST", "Message {}")
+      mock_logging.assert_called_once_with("TEST", "Message {}", verbosity=goodlogging.Verbosity.ALWAYS)
+
   #################################################
   # Test StripSpecialCharacters function
   #################################################
@@ -202,30 +226,114 @@ class ClearUtil(unittest.TestCase):
     result = clear.util.GetBestMatch(target, matchList)
     self.assertEqual(result, [])
 
+  #################################################
+  # Test BuildMatchIndex and GetMatchCandidates functions
+  #################################################
+  def test_GetMatchCandidates(self):
+    matchList = ['Test Show', 'A', 'XY', 'ab1cd2ef3gh', 'Unrelated Title', 'Testing Shows', 'TEST SHOW']
+    matchIndex = clear.util.BuildMatchIndex(matchList)
+
+    # Test candidates are filtered and kept in original order (single character
+    # entries are always kept as they can be a full substring match)
+    result = clear.util.GetMatchCandidates('test.show', matchList, matchIndex)
+    self.assertEqual(result, ['Test Show', 'A', 'Testing Shows', 'TEST SHOW'])
+
+    # Test match sharing only scattered bigrams (no common substring longer than a bigram) is kept
+    self.assertGreater(clear.util.GetBestStringMatchValue('abcdefgh', 'ab1cd2ef3gh'), clear.util.MATCH_RATIO_THRESHOLD)
+    result = clear.util.GetMatchCandidates('abcdefgh', matchList, matchIndex)
+    self.assertIn('ab1cd2ef3gh', result)
+
+    # Test short target returns full list
+    result = clear.util.GetMatchCandidates('a', matchList, matchIndex)
+    self.assertEqual(result, matchList)
+
+    # Test GetBestMatch result is unchanged for random strings
+    rand = random.Random(0)
+    for _ in range(20):
+      matchList = [''.join(rand.choice('abcd ') for _ in range(rand.randint(0, 12))) for _ in range(200)]
+      matchIndex = clear.util.BuildMatchIndex(matchList)
+      for _ in range(10):
+        target = ''.join(rand.choice('abcd') for _ in range(rand.randint(1, 10)))
+        candidateList = clear.util.GetMatchCandidates(target, matchList, matchIndex)
+        self.assertEqual(clear.util.GetBestMatch(target, candidateList), clear.util.GetBestMatch(target, matchList))
+
+  #################################################
+  # Test GetBestMatchValueList function
+  #################################################
+  def test_GetBestMatchValueList(self):
+    rand = random.Random(1)
+    for _ in range(20):
+      target = ''.join(rand.choice('abc .') for _ in range(rand.randint(0, 10)))
+      matchList = [''.join(rand.choice('abc -') for _ in range(rand.randint(0, 12))) for _ in range(50)] + [target.upper()]
+      normMatchList = clear.util.BuildMatchIndex(matchList)[1]
+      expectedValueList = [clear.util.GetBestStringMatchValue(target, item) for item in matchList]
+      self.assertEqual(clear.util.GetBestMatchValueList(target, normMatchList), expectedValueList)
+
+      # Test pruned values are unchanged where they could be the best match
+      prunedValueList = clear.util.GetBestMatchValueList(target, normMatchList, clear.util.MATCH_RATIO_THRESHOLD)
+      if max(expectedValueList) > clear.util.MATCH_RATIO_THRESHOLD:
+        maxRatio = max(expectedValueList)
+        self.assertEqual(max(prunedValueList), maxRatio)
+        self.assertEqual([value == maxRatio for value in prunedValueList], [value == maxRatio for value in expectedValueList])
+      else:
+        self.assertTrue(max(prunedValueList) <= clear.util.MATCH_RATIO_THRESHOLD)
+
+      # Test GetBestMatch result is unchanged when a match index is given
+      matchIndex = clear.util.BuildMatchIndex(matchList)
+      self.assertEqual(clear.util.GetBestMatch(target, matchList, matchIndex), clear.util.GetBestMatch(target, matchList))
+
   #################################################
   # Test WebLookup function
   #################################################
-  @mock.patch('requests.get')
+  @mock.patch('requests.Session.get')
   def test_WebLookup(self, mock_requests):
     url = 'test.url'
     urlQuery = {'A': 'B'}
     webText = 'Web lookup text'
 
-    mock_requests.return_value = mock.MagicMock(status_code=requests.codes.ok, text=webText)
+    clear.util.ResetWebLookupStats()
+    mock_requests.return_value = mock.MagicMock(status_code=requests.codes.ok, text=webText, content=webText.encode())
 
     # Test successful lookup with utf8=False and urlQuery
     result = clear.util.WebLookup(url, urlQuery=urlQuery, utf8=False)
     self.assertEqual(result, webText)
+    mock_requests.assert_called_once_with(url, params=urlQuery, timeout=(clear.util.WEB_CONNECT_TIMEOUT, clear.util.WEB_READ_TIMEOUT))
 
-    # Test successful lookup with utf8=True and no urlQuery
-    clear.util.WebLookup(url, urlQuery=None, utf8=True)
+    # Test successful lookup with utf8=True, no urlQuery and timeout override
+    result = clear.util.WebLookup(url, urlQuery=None, utf8=True, timeout=(1, 2))
     self.assertEqual(result, webText)
+    mock_requests.assert_called_with(url, params=None, timeout=(1, 2))
 
     # Test not okay response
-    mock_requests.return_value = mock.MagicMock(status_code=requests.codes.bad)
+    mock_requests.return_value = mock.MagicMock(status_code=requests.codes.bad, content=b'')
     result = clear.util.WebLookup(url, urlQuery=None, utf8=True)
     self.assertIsNone(result)
 
+    # Test failed request
+    mock_requests.side_effect = requests.exceptions.ConnectionError('Test Connection Error')
+    with self.assertRaises(requests.exceptions.ConnectionError):
+      clear.util.WebLookup(url)
+
+    # Test lookup stats
+    stats = clear.util.GetWebLookupStats()
+    self.assertEqual(stats['requests'], 4)
+    self.assertEqual(stats['bytes'], 2*len(webText))
+    self.assertGreaterEqual(stats['seconds'], stats['maxSeconds'])
+
+    clear.util.ResetWebLookupStats()
+    self.assertEqual(clear.util.GetWebLookupStats()['requests'], 0)
+
+  #################################################
+  # Test _GetWebSession function
+  #################################################
+  def test_GetWebSession(self):
+    session = clear.util._GetWebSession()
+    self.assertIsInstance(session, requests.Session)
+    self.assertIs(clear.util._GetWebSession(), session)
+
+    adapter = session.get_adapter('http://epguides.com')
+    self.assertEqual(adapter.max_retries.total, clear.util.WEB_RETRY_COUNT)
+
   #################################################
   # Test ArchiveProcessedFile function
   #################################################
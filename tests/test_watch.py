@@ -0,0 +1,87 @@
+'''
+
+Testbench for clear.watch
+
+'''
+import os
+import goodlogging
+import unittest
+import unittest.mock as mock
+
+import clear.watch
+
+import test_lib
+
+class Watch(unittest.TestCase):
+  #################################################
+  # Set up test infrastructure
+  #################################################
+  @classmethod
+  def setUpClass(cls):
+    # Silence all logging messages
+    goodlogging.Log.silenceAll = True
+
+  #################################################
+  # Test InotifyWatcher class
+  #################################################
+  def test_watch_InotifyWatcher(self):
+    try:
+      watcher = clear.watch.InotifyWatcher()
+    except OSError:
+      self.skipTest('inotify not available')
+    self.addCleanup(watcher.close)
+
+    rootDir = test_lib.GenerateRandomPath(os.path.join(test_lib.GetBaseDir(), 'test_watch'))
+    self.addCleanup(test_lib.DeleteTestPath, rootDir)
+    subDir = os.path.join(rootDir, 'a')
+    os.makedirs(subDir)
+
+    # Check each directory is only watched once and missing directories are skipped
+    self.assertEqual(watcher.WatchDirs([rootDir, subDir, os.path.join(rootDir, 'invalid')]), 2)
+    self.assertEqual(watcher.WatchDirs([rootDir, subDir]), 0)
+
+    # Check timeout with no change
+    self.assertIs(watcher.Wait(0), False)
+
+    # Check file created in sub-directory is detected
+    open(os.path.join(subDir, 'file.mkv'), 'w').close()
+    self.assertIs(watcher.Wait(1), True)
+    self.assertIs(watcher.Wait(0), False)
+
+    # Check deleted directory is no longer watched
+    test_lib.DeleteTestPath(subDir)
+    while watcher.Wait(0.1):
+      pass
+    os.makedirs(subDir)
+    while watcher.Wait(0.1):
+      pass
+    self.assertEqual(watcher.WatchDirs([rootDir, subDir]), 1)
+
+  #################################################
+  # Test PollWatcher class
+  #################################################
+  @mock.patch('time.sleep')
+  def test_watch_PollWatcher(self, mock_sleep):
+    watcher = clear.watch.PollWatcher(60)
+    self.assertEqual(watcher.WatchDirs(['fake/path']), 0)
+
+    # Check full poll interval is a possible change
+    self.assertIs(watcher.Wait(), True)
+    mock_sleep.assert_called_with(60)
+
+    # Check shorter timeout is not a change
+    self.assertIs(watcher.Wait(10), False)
+    mock_sleep.assert_called_with(10)
+    watcher.close()
+
+  #################################################
+  # Test GetWatcher function
+  #################################################
+  def test_watch_GetWatcher(self):
+    # Check fallback to polling if inotify is not available
+    with mock.patch('clear.watch.InotifyWatcher', side_effect=OSError('Test inotify error')):
+      watcher = clear.watch.GetWatcher(30)
+    self.assertIsInstance(watcher, clear.watch.PollWatcher)
+
+if __name__ == '__main__':
+  unittest.main()